@@ -0,0 +1,294 @@
+"""
+Local mirror of the state of AMM pools (LiquidityPoolV1Converter), for computing conversion returns offline.
+
+The reserve balances, weights and conversion fee of each converter are seeded once with batched calls,
+after which they are kept up to date from the Conversion, LiquidityAdded, LiquidityRemoved, TokenRateUpdate
+and ConversionFeeUpdate events of the converters. The state is persisted on disk, so later runs only need
+to process the new events.
+
+Run like this (verify the local returns against getReturn of the converters):
+
+    python amm.py --converter 0x... --converter 0x... --verify
+"""
+import json
+import logging
+import os
+import random
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from decimal import Decimal, localcontext
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from web3 import Web3
+
+from utils import (
+    batch_call,
+    enable_logging,
+    get_cache_path,
+    get_contract,
+    get_contract_events,
+    get_web3,
+    load_abi,
+    to_address,
+    write_json_atomic,
+)
+
+logger = logging.getLogger(__name__)
+
+CONVERTER_ABI = load_abi('amm/LiquidityPoolV1Converter')
+PPM_RESOLUTION = 1_000_000
+POOL_EVENT_NAMES = [
+    'Conversion',
+    'LiquidityAdded',
+    'LiquidityRemoved',
+    'TokenRateUpdate',
+    'ConversionFeeUpdate',
+]
+
+
+@dataclass
+class PoolState:
+    converter_address: str
+    anchor_address: str
+    reserve_tokens: List[str]
+    balances: Dict[str, int]
+    weights: Dict[str, int]
+    conversion_fee: int  # in PPM
+
+    def get_return(self, source_token: str, target_token: str, amount: int) -> Tuple[int, int]:
+        """Return (amount, fee) of converting amount of source_token to target_token, like getReturn"""
+        if source_token == target_token:
+            raise ValueError('source and target tokens are the same')
+        target_amount = cross_reserve_target_amount(
+            source_balance=self.balances[source_token],
+            source_weight=self.weights[source_token],
+            target_balance=self.balances[target_token],
+            target_weight=self.weights[target_token],
+            amount=amount,
+        )
+        fee = target_amount * self.conversion_fee // PPM_RESOLUTION
+        return target_amount - fee, fee
+
+    def apply_event(self, event):
+        args = event.args
+        if event.event == 'Conversion':
+            self.balances[args._fromToken] += args._amount
+            self.balances[args._toToken] -= args._return
+        elif event.event in ('LiquidityAdded', 'LiquidityRemoved'):
+            self.balances[args._reserveToken] = args._newBalance
+        elif event.event == 'TokenRateUpdate':
+            # The converter emits TokenRateUpdate(anchor, reserveToken, balance * PPM_RESOLUTION, supply * weight)
+            # for each reserve after conversions, which tells us the exact balance of the reserve
+            if args._token1 == self.anchor_address and args._token2 in self.balances:
+                self.balances[args._token2] = args._rateN // PPM_RESOLUTION
+        elif event.event == 'ConversionFeeUpdate':
+            self.conversion_fee = args._newFee
+
+
+def cross_reserve_target_amount(
+    *,
+    source_balance: int,
+    source_weight: int,
+    target_balance: int,
+    target_weight: int,
+    amount: int,
+) -> int:
+    """
+    The bancor formula, as in SovrynSwapFormula.crossReserveTargetAmount.
+
+    For equal weights (50/50 pools), this is the same exact integer math as on chain.
+    For other weights the power is computed with high-precision decimals, which can differ from the on-chain
+    fixed-point approximation in the last digits.
+    """
+    if source_balance <= 0 or target_balance <= 0 or amount < 0:
+        raise ValueError('invalid balances or amount')
+    if source_weight == target_weight:
+        return target_balance * amount // (source_balance + amount)
+    with localcontext() as ctx:
+        ctx.prec = 80
+        base = Decimal(source_balance) / (Decimal(source_balance) + amount)
+        power = base ** (Decimal(source_weight) / Decimal(target_weight))
+        return int(target_balance * (1 - power))
+
+
+class PoolStateMirror:
+    def __init__(self, web3: Web3, *, path: str = None):
+        self.web3 = web3
+        if path is None:
+            path = get_cache_path('amm_pools', f'{web3.eth.chain_id}.json')
+        self.path = path
+        self.block_number: Optional[int] = None
+        self.pools: Dict[str, PoolState] = {}
+        self._converter = web3.eth.contract(abi=CONVERTER_ABI)
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.block_number = data['block_number']
+            self.pools = {
+                address: PoolState(**pool_data)
+                for address, pool_data in data['pools'].items()
+            }
+
+    def get_converter(self, address: str):
+        return get_contract(web3=self.web3, abi_name='amm/LiquidityPoolV1Converter', address=address)
+
+    def add_converters(self, converter_addresses: Iterable[str]):
+        """Seed the state of converters that are not yet mirrored, at the current block of the mirror"""
+        new_addresses = sorted(set(to_address(a) for a in converter_addresses) - self.pools.keys())
+        if not new_addresses:
+            return
+        if self.block_number is None:
+            self.block_number = self.web3.eth.block_number
+        logger.info('seeding the state of %s converters at block %s', len(new_addresses), self.block_number)
+        converters = [self.get_converter(address) for address in new_addresses]
+        results = batch_call(
+            self.web3,
+            [
+                function
+                for converter in converters
+                for function in (
+                    converter.functions.anchor(),
+                    converter.functions.conversionFee(),
+                    converter.functions.reserveTokenCount(),
+                )
+            ],
+            block_identifier=self.block_number,
+        )
+        reserve_token_counts = {}
+        for i, converter in enumerate(converters):
+            anchor_address, conversion_fee, reserve_token_count = results[i * 3:i * 3 + 3]
+            self.pools[converter.address] = PoolState(
+                converter_address=converter.address,
+                anchor_address=anchor_address,
+                reserve_tokens=[],
+                balances={},
+                weights={},
+                conversion_fee=conversion_fee,
+            )
+            reserve_token_counts[converter.address] = reserve_token_count
+
+        reserve_token_calls = [
+            (converter, index)
+            for converter in converters
+            for index in range(reserve_token_counts[converter.address])
+        ]
+        reserve_tokens = batch_call(
+            self.web3,
+            [converter.functions.reserveTokens(index) for converter, index in reserve_token_calls],
+            block_identifier=self.block_number,
+        )
+        reserves = batch_call(
+            self.web3,
+            [
+                converter.functions.reserves(reserve_token)
+                for (converter, _), reserve_token in zip(reserve_token_calls, reserve_tokens)
+            ],
+            block_identifier=self.block_number,
+        )
+        for (converter, _), reserve_token, (balance, weight, *_) in zip(reserve_token_calls, reserve_tokens, reserves):
+            pool = self.pools[converter.address]
+            pool.reserve_tokens.append(reserve_token)
+            pool.balances[reserve_token] = balance
+            pool.weights[reserve_token] = weight
+        self.save()
+
+    def update(self, to_block: int = None, *, batch_size: int = 1000):
+        """Apply the events of all mirrored converters up to to_block (latest by default)"""
+        if to_block is None:
+            to_block = self.web3.eth.block_number
+        if not self.pools or to_block <= self.block_number:
+            return
+        events = get_contract_events(
+            contract=self._converter,
+            addresses=list(self.pools.keys()),
+            event_names=POOL_EVENT_NAMES,
+            from_block=self.block_number + 1,
+            to_block=to_block,
+            batch_size=batch_size,
+        )
+        for event in events:
+            self.pools[event.address].apply_event(event)
+        logger.info('applied %s events up to block %s', len(events), to_block)
+        self.block_number = to_block
+        self.save()
+
+    def save(self):
+        write_json_atomic(self.path, {
+            'block_number': self.block_number,
+            'pools': {address: asdict(pool) for address, pool in sorted(self.pools.items())},
+        })
+
+    def verify(self, *, sample_size: int = 20, amounts: Sequence[int] = None) -> List[dict]:
+        """
+        Compare local returns against getReturn of the converters at the block of the mirror.
+
+        Returns the mismatches.
+        """
+        samples = []
+        for pool in self.pools.values():
+            for source_token in pool.reserve_tokens:
+                for target_token in pool.reserve_tokens:
+                    if source_token == target_token:
+                        continue
+                    for amount in amounts or (pool.balances[source_token] // 1000, pool.balances[source_token] // 10):
+                        if amount > 0:
+                            samples.append((pool, source_token, target_token, amount))
+        samples = random.sample(samples, min(sample_size, len(samples)))
+        remote_returns = batch_call(
+            self.web3,
+            [
+                self.get_converter(pool.converter_address).functions.getReturn(source_token, target_token, amount)
+                for pool, source_token, target_token, amount in samples
+            ],
+            block_identifier=self.block_number,
+        )
+        mismatches = []
+        for (pool, source_token, target_token, amount), remote_return in zip(samples, remote_returns):
+            local_return = pool.get_return(source_token, target_token, amount)
+            if tuple(remote_return) != local_return:
+                mismatches.append({
+                    'converter': pool.converter_address,
+                    'source_token': source_token,
+                    'target_token': target_token,
+                    'amount': amount,
+                    'local_return': local_return,
+                    'remote_return': tuple(remote_return),
+                })
+        return mismatches
+
+
+def main():
+    parser = ArgumentParser(description="Mirror the state of AMM pools locally")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--converter', help='address of a converter to mirror', action='append', default=[])
+    parser.add_argument('--verify', action='store_true', default=False,
+                        help='verify local returns against getReturn of the converters')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    mirror = PoolStateMirror(web3)
+    # Update the existing pools first, so that new pools are seeded at the latest block
+    mirror.update()
+    mirror.add_converters(args.converter)
+    print(f"State of {len(mirror.pools)} pools at block {mirror.block_number}:")
+    for pool in mirror.pools.values():
+        print(f"{pool.converter_address} (fee {pool.conversion_fee / PPM_RESOLUTION:.4%})")
+        for reserve_token in pool.reserve_tokens:
+            print(f"    {reserve_token}: balance {pool.balances[reserve_token]}, weight {pool.weights[reserve_token]}")
+
+    if args.verify:
+        mismatches = mirror.verify()
+        if mismatches:
+            print(f"{len(mismatches)} mismatches between local and remote returns:")
+            for mismatch in mismatches:
+                print(mismatch)
+        else:
+            print("Local returns match getReturn of the converters")
+
+
+if __name__ == '__main__':
+    main()
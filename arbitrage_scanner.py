@@ -0,0 +1,187 @@
+"""
+Scan AMM pools for prices that diverge from the PriceFeeds oracle, i.e. opportunities for Watcher.arbitrage.
+
+For every block, the pool states (from the local pool state mirror, see amm.py) and the oracle rates between all
+pool tokens are read at that block, and the optimal trade size and expected profit of selling to each
+pool in both directions are computed at once with array operations.
+
+For a 50/50 pool with source reserve Rs, target reserve Rt and conversion fee f, selling x of the source
+token returns (1 - f) * Rt * x / (Rs + x). Given the oracle rate r (target per source), the profit
+(1 - f) * Rt * x / (Rs + x) - r * x is maximized at x* = sqrt((1 - f) * Rt * Rs / r) - Rs.
+
+Run like this:
+
+    python arbitrage_scanner.py --converter 0x... --converter 0x... --quote-token 0x...
+"""
+import logging
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from amm import PPM_RESOLUTION, PoolState, PoolStateMirror
+from constants import SOVRYN_PROTOCOL_ADDRESS
+from price_snapshot import PriceSnapshotStore
+from tokens import get_token_registry
+from utils import enable_logging, get_web3, load_abi, to_address
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ArbitrageOpportunity:
+    pool: PoolState
+    source_token: str
+    target_token: str
+    amount: int  # of source token
+    expected_return: int  # of target token
+    profit: float  # in quote token wei
+    divergence: float  # pool rate (after fee) / oracle rate - 1
+
+    @property
+    def conversion_path(self) -> List[str]:
+        return [self.source_token, self.pool.anchor_address, self.target_token]
+
+
+def get_pool_directions(pools: Iterable[PoolState]) -> List[Tuple[PoolState, str, str]]:
+    """All (pool, source token, target token) trade directions of 2-reserve 50/50 pools"""
+    directions = []
+    for pool in pools:
+        if len(pool.reserve_tokens) != 2 or len(set(pool.weights.values())) != 1:
+            logger.debug('skipping pool %s, only 2-reserve 50/50 pools are supported', pool.converter_address)
+            continue
+        token1, token2 = pool.reserve_tokens
+        directions.append((pool, token1, token2))
+        directions.append((pool, token2, token1))
+    return directions
+
+
+def scan_pools(
+    *,
+    directions: List[Tuple[PoolState, str, str]],
+    get_rate,
+    quote_token: str,
+    min_profit: float = 0.0,
+) -> List[ArbitrageOpportunity]:
+    """
+    Find the optimal trade of each direction and return the profitable ones, most profitable first.
+
+    get_rate(source_token, target_token) returns the oracle rate of a pair, or None if there is none
+    (e.g. PriceSnapshot.get_rate).
+    """
+    if not directions:
+        return []
+    source_balance = np.array([float(pool.balances[s]) for pool, s, _ in directions])
+    target_balance = np.array([float(pool.balances[t]) for pool, _, t in directions])
+    fee_multiplier = np.array([1 - pool.conversion_fee / PPM_RESOLUTION for pool, _, _ in directions])
+    oracle_rate = np.array([get_rate(s, t) or np.nan for _, s, t in directions])
+    quote_rate = np.array([
+        1.0 if t == quote_token else get_rate(t, quote_token) or np.nan
+        for _, _, t in directions
+    ])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Marginal rate of the pool (after fee) for an infinitesimal trade
+        pool_rate = fee_multiplier * target_balance / source_balance
+        divergence = pool_rate / oracle_rate - 1
+        amount = np.sqrt(fee_multiplier * target_balance * source_balance / oracle_rate) - source_balance
+        amount = np.where(np.isfinite(amount) & (amount > 0), amount, 0.0)
+        expected_return = fee_multiplier * target_balance * amount / (source_balance + amount)
+        profit = (expected_return - oracle_rate * amount) * quote_rate
+    profit = np.where(np.isfinite(profit), profit, 0.0)
+
+    opportunities = []
+    for i in np.argsort(-profit):
+        if profit[i] <= min_profit:
+            break
+        pool, source_token, target_token = directions[i]
+        amount_wei = int(amount[i])
+        opportunities.append(ArbitrageOpportunity(
+            pool=pool,
+            source_token=source_token,
+            target_token=target_token,
+            amount=amount_wei,
+            expected_return=pool.get_return(source_token, target_token, amount_wei)[0],
+            profit=float(profit[i]),
+            divergence=float(divergence[i]),
+        ))
+    return opportunities
+
+
+def main():
+    parser = ArgumentParser(description="Scan AMM pools for arbitrage opportunities against the price oracle")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--converter', help='address of a converter to add to the mirror', action='append',
+                        default=[])
+    parser.add_argument('--quote-token', help='address of the token to value profits in', required=True)
+    parser.add_argument('--min-profit', help='minimum profit in quote token', type=float, default=0.0)
+    parser.add_argument('--top', help='number of opportunities to show per block', type=int, default=10)
+    parser.add_argument('--poll-interval', help='seconds between polls for new blocks', type=float, default=5)
+    parser.add_argument('--once', action='store_true', default=False, help='scan the latest block and exit')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    sovryn_protocol = web3.eth.contract(
+        address=SOVRYN_PROTOCOL_ADDRESS,
+        abi=load_abi('loans/SovrynProtocol')
+    )
+    price_feeds = web3.eth.contract(
+        address=sovryn_protocol.functions.priceFeeds().call(),
+        abi=load_abi('price_feed/PriceFeeds'),
+    )
+    quote_token = to_address(args.quote_token)
+    token_registry = get_token_registry(web3)
+    quote_token_info = token_registry.get(quote_token)
+
+    price_snapshots = PriceSnapshotStore(price_feeds)
+    mirror = PoolStateMirror(web3)
+    mirror.update()
+    mirror.add_converters(args.converter)
+    if not mirror.pools:
+        # An empty mirror has no block to scan at, and nothing to scan
+        parser.error('no pools mirrored yet, give at least one --converter')
+    scanned_block_number = None
+    while True:
+        start = time.time()
+        mirror.update()
+        if mirror.block_number == scanned_block_number:
+            time.sleep(args.poll_interval)
+            continue
+        scanned_block_number = mirror.block_number
+        directions = get_pool_directions(mirror.pools.values())
+        token_addresses = set(t for _, _, t in directions) | {quote_token}
+        price_snapshot = price_snapshots.get(token_addresses, mirror.block_number)
+        opportunities = scan_pools(
+            directions=directions,
+            get_rate=price_snapshot.get_rate,
+            quote_token=quote_token,
+            min_profit=args.min_profit * 10 ** quote_token_info.decimals,
+        )
+        tokens = token_registry.get_many(set(t for _, _, t in directions))
+        print(
+            f"Block {mirror.block_number}: {len(opportunities)} opportunities in {len(directions) // 2} pools "
+            f"(scanned in {time.time() - start:.2f}s)"
+        )
+        for opportunity in opportunities[:args.top]:
+            source_info = tokens[opportunity.source_token]
+            target_info = tokens[opportunity.target_token]
+            print(
+                f"    {source_info.to_decimal(opportunity.amount)} {source_info.symbol} -> "
+                f"{target_info.to_decimal(opportunity.expected_return)} {target_info.symbol} "
+                f"via {opportunity.pool.converter_address} "
+                f"(divergence {opportunity.divergence:+.2%}, "
+                f"profit {opportunity.profit / 10 ** quote_token_info.decimals:.6f} {quote_token_info.symbol})"
+            )
+        if args.once:
+            break
+        time.sleep(args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
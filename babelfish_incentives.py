@@ -0,0 +1,283 @@
+"""
+Simulate the Babelfish basket incentive algorithm (see notebooks/babelfish_incentive_algo_review.ipynb)
+with NumPy, over whole grids of basket balances, targets and fee parameters at once.
+
+The formulas are the ones from the notebook, with the same 10**18 fixed-point scaling:
+
+    dsqr(x, y) = |x - y|**2 / 10**18
+    getWeight(bal, total) = 10**18 * bal / total
+    D = sum(dsqr(t[i], getWeight(b[i], T)) for i in 1..N) / N
+    V = 10**18 * D / (10**18 - D)
+    reward = F * (V_before - V_after) / 10**18 * S / 10**18
+
+Every division is an integer division (truncating like Solidity). The functions accept any arrays that
+broadcast together: float64 arrays are fast and exact enough for sweeps (about 15 significant digits),
+and object arrays of Python ints (see to_fixed) give exact integer results.
+
+The basket history for the simulations is replayed from the Minted and Redeemed events of a MassetV3.
+
+Run like this (compare 50/50 and 70/30 targets with two fee parameters over a block range):
+
+    python babelfish_incentives.py --chain bsc_mainnet --masset 0x... --basset 0x... --basset 0x... \\
+        --from-block 15000000 --to-block 16000000 --targets 0.5,0.5 --targets 0.7,0.3 --fees 0.001,0.01
+
+    python babelfish_incentives.py --check  # check the formulas against the sympy expressions of the notebook
+"""
+import logging
+import random
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import List, Sequence
+
+import numpy as np
+
+from tokens import get_token_registry
+from utils import batch_call, enable_logging, get_contract_events, get_erc20_contract, get_web3, load_abi, to_address
+
+logger = logging.getLogger(__name__)
+
+ONE = 10 ** 18
+MASSET_ABI = load_abi('babelfish/MassetV3')
+
+
+def to_fixed(values, *, exact: bool = False) -> np.ndarray:
+    """Convert values (already 10**18-scaled) to an array for the formulas, exact Python ints if exact is True"""
+    if exact:
+        return np.vectorize(int, otypes=[object])(values)
+    return np.asarray(values, dtype=np.float64)
+
+
+def _div(a, b):
+    """Integer division truncating towards zero, like signed division in Solidity"""
+    a = np.asarray(a)
+    sign = np.where(a < 0, -1, 1).astype(a.dtype)
+    return sign * (a * sign // b)
+
+
+def dsqr(x, y):
+    return (x - y) ** 2 // ONE
+
+
+def get_weight(bal, total):
+    return ONE * bal // total
+
+
+def get_deviation(balances, targets):
+    """D of baskets with balances (..., N) and targets (..., N), both broadcasting, returning (...)"""
+    total = balances.sum(axis=-1, keepdims=True)
+    weights = get_weight(balances, total)
+    return dsqr(targets, weights).sum(axis=-1) // balances.shape[-1]
+
+
+def get_v(deviation):
+    return ONE * deviation // (ONE - deviation)
+
+
+def get_reward(*, fee, deviation_before, deviation_after, amount):
+    """Reward (positive) or penalty (negative) of moving the basket from deviation_before to deviation_after"""
+    return _div(_div(fee * (get_v(deviation_before) - get_v(deviation_after)), ONE) * amount, ONE)
+
+
+@dataclass
+class BasketReplay:
+    basset_addresses: List[str]
+    block_numbers: np.ndarray  # (events,) int64
+    is_mint: np.ndarray  # (events,) bool
+    basset_index: np.ndarray  # (events,) int64
+    amounts: np.ndarray  # (events,) float64, masset wei
+    balances_before: np.ndarray  # (events, bassets) float64, masset wei
+    balances_after: np.ndarray  # (events, bassets) float64, masset wei
+
+    def __len__(self):
+        return len(self.block_numbers)
+
+    def get_rewards(self, *, targets: np.ndarray, fees: np.ndarray) -> np.ndarray:
+        """
+        Rewards of all events for a grid of parameters.
+
+        targets is a (target sets, bassets) array of 10**18-scaled target weights and fees a (fees,) array of
+        10**18-scaled fee parameters. Returns a (fees, target sets, events) array.
+        """
+        targets = to_fixed(targets)[:, np.newaxis, :]
+        fees = to_fixed(fees)[:, np.newaxis, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return get_reward(
+                fee=fees,
+                deviation_before=get_deviation(self.balances_before[np.newaxis], targets),
+                deviation_after=get_deviation(self.balances_after[np.newaxis], targets),
+                amount=self.amounts,
+            )
+
+
+def load_basket_replay(
+    *,
+    masset,
+    basset_addresses: Sequence[str],
+    from_block: int,
+    to_block: int,
+    batch_size: int = 5000,
+) -> BasketReplay:
+    """
+    Replay the basket balances of a MassetV3 from its Minted and Redeemed events.
+
+    The initial balances are the bAsset balances of the masset contract at from_block - 1, converted to
+    18 decimals. Balances change by the massetQuantity of each event.
+    """
+    web3 = masset.web3
+    basset_addresses = [to_address(a) for a in basset_addresses]
+    basset_index_by_address = {address: i for i, address in enumerate(basset_addresses)}
+    tokens = get_token_registry(web3).get_many(basset_addresses)
+    initial_balances = batch_call(
+        web3,
+        [
+            get_erc20_contract(token_address=address, web3=web3).functions.balanceOf(masset.address)
+            for address in basset_addresses
+        ],
+        block_identifier=from_block - 1,
+    )
+    initial_balances = np.array([
+        balance * 10 ** (18 - tokens[address].decimals)
+        for address, balance in zip(basset_addresses, initial_balances)
+    ], dtype=np.float64)
+
+    events = [
+        event for event in get_contract_events(
+            contract=masset,
+            event_names=['Minted', 'Redeemed'],
+            from_block=from_block,
+            to_block=to_block,
+            batch_size=batch_size,
+        )
+        if event.args.bAsset in basset_index_by_address
+    ]
+    is_mint = np.array([event.event == 'Minted' for event in events], dtype=bool)
+    basset_index = np.array([basset_index_by_address[event.args.bAsset] for event in events], dtype=np.int64)
+    amounts = np.array([event.args.massetQuantity for event in events], dtype=np.float64)
+    deltas = np.zeros((len(events), len(basset_addresses)))
+    deltas[np.arange(len(events)), basset_index] = np.where(is_mint, amounts, -amounts)
+    balances_after = initial_balances + np.cumsum(deltas, axis=0)
+    return BasketReplay(
+        basset_addresses=basset_addresses,
+        block_numbers=np.array([event.blockNumber for event in events], dtype=np.int64),
+        is_mint=is_mint,
+        basset_index=basset_index,
+        amounts=amounts,
+        balances_before=balances_after - deltas,
+        balances_after=balances_after,
+    )
+
+
+def check_against_sympy(*, num_samples: int = 200, num_bassets: int = 3, seed: int = 0) -> float:
+    """
+    Compare the formulas against the (exact rational) sympy expressions of the notebook at random points.
+
+    Returns the largest relative difference of the reward, of either the float or the exact version.
+    The exact version differs from sympy only by the truncation of the integer divisions.
+    """
+    from sympy import Abs, Rational, Symbol
+
+    one = Symbol('10^18')
+    x, y, bal, total, d, f, s = (Symbol(name) for name in ('x', 'y', 'bal', 'total', 'D', 'F', 'S'))
+    dsqr_expr = Abs(x - y) ** 2 / one
+    get_weight_expr = one * bal / total
+    v_expr = (d * one) / (one - d)
+
+    def sympy_deviation(balances, targets):
+        total_value = sum(balances)
+        return sum(
+            dsqr_expr.subs({
+                x: target,
+                y: get_weight_expr.subs({bal: balance, total: total_value, one: ONE}),
+                one: ONE,
+            })
+            for balance, target in zip(balances, targets)
+        ) / len(balances)
+
+    rng = random.Random(seed)
+    max_difference = 0.0
+    for _ in range(num_samples):
+        balances_before = [rng.randrange(1, 10 ** 24) for _ in range(num_bassets)]
+        balances_after = list(balances_before)
+        balances_after[rng.randrange(num_bassets)] += rng.randrange(1, 10 ** 23)
+        targets = [rng.randrange(1, ONE) for _ in range(num_bassets)]
+        fee = rng.randrange(1, ONE)
+        amount = rng.randrange(1, 10 ** 23)
+
+        reward_expr = f * (v_expr.subs(d, sympy_deviation(balances_before, targets))
+                           - v_expr.subs(d, sympy_deviation(balances_after, targets))) / one * s / one
+        expected = Rational(reward_expr.subs({f: fee, s: amount, one: ONE}))
+        for exact in (False, True):
+            deviation_before = get_deviation(to_fixed(balances_before, exact=exact), to_fixed(targets, exact=exact))
+            deviation_after = get_deviation(to_fixed(balances_after, exact=exact), to_fixed(targets, exact=exact))
+            reward = get_reward(
+                fee=to_fixed(fee, exact=exact),
+                deviation_before=deviation_before,
+                deviation_after=deviation_after,
+                amount=to_fixed(amount, exact=exact),
+            )
+            difference = abs(Decimal(int(reward)) - Decimal(int(expected.p)) / Decimal(int(expected.q)))
+            if expected != 0:
+                difference /= abs(Decimal(int(expected.p)) / Decimal(int(expected.q)))
+            max_difference = max(max_difference, float(difference))
+    return max_difference
+
+
+def parse_decimals(s: str) -> List[Decimal]:
+    return [Decimal(p) for p in s.split(',') if p.strip()]
+
+
+def main():
+    parser = ArgumentParser(description="Simulate Babelfish basket incentives over replayed mints and redeems")
+    parser.add_argument('--chain', default='bsc_mainnet')
+    parser.add_argument('--masset', help='address of the MassetV3')
+    parser.add_argument('--basset', help='address of a bAsset of the basket', action='append', default=[])
+    parser.add_argument('--from-block', type=int)
+    parser.add_argument('--to-block', type=int)
+    parser.add_argument('--targets', help='comma-separated target weights of the bAssets, e.g. 0.5,0.5',
+                        type=parse_decimals, action='append', default=[])
+    parser.add_argument('--fees', help='comma-separated fee parameters to simulate', type=parse_decimals,
+                        default=parse_decimals('0.001'))
+    parser.add_argument('--check', action='store_true', default=False,
+                        help='only check the formulas against the sympy expressions of the notebook')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    if args.check:
+        print(f"Largest relative difference to sympy: {check_against_sympy():.3e}")
+        return
+
+    if not args.masset or not args.basset or args.from_block is None:
+        parser.error('--masset, --basset and --from-block are required')
+    targets = args.targets or [[Decimal(1) / len(args.basset)] * len(args.basset)]
+    if any(len(target_set) != len(args.basset) for target_set in targets):
+        parser.error('--targets must have one weight per --basset')
+
+    web3 = get_web3(args.chain)
+    masset = web3.eth.contract(address=to_address(args.masset), abi=MASSET_ABI)
+    replay = load_basket_replay(
+        masset=masset,
+        basset_addresses=args.basset,
+        from_block=args.from_block,
+        to_block=args.to_block if args.to_block is not None else web3.eth.block_number,
+    )
+    rewards = replay.get_rewards(
+        targets=np.array([[int(weight * ONE) for weight in target_set] for target_set in targets]),
+        fees=np.array([int(fee * ONE) for fee in args.fees]),
+    )
+    print(f"Replayed {len(replay)} mints and redeems ({np.count_nonzero(replay.is_mint)} mints)")
+    for fee, fee_rewards in zip(args.fees, rewards):
+        for target_set, target_rewards in zip(targets, fee_rewards):
+            paid = target_rewards[target_rewards > 0].sum() / ONE
+            charged = -target_rewards[target_rewards < 0].sum() / ONE
+            print(
+                f"fee {fee}, targets {','.join(str(w) for w in target_set)}: "
+                f"rewards paid {paid:.6f}, penalties charged {charged:.6f}, net {paid - charged:+.6f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
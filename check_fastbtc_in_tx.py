@@ -1,7 +1,8 @@
 import json
 import os
-from utils import to_address, get_web3, load_abi
-from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from utils import batch_call, to_address, get_web3, load_abi
+from typing import Dict, Iterable, List, NamedTuple, Tuple
 
 # To get debug output, create fastbtc_in_federators.json that looks like this
 # [
@@ -25,31 +26,92 @@ class MultisigTransaction(NamedTuple):
     executed: bool
 
 
-def show_confirmation_details(tx_number):
+class ConfirmationStatus(NamedTuple):
+    tx_number: int
+    transaction: MultisigTransaction
+    required: int
+    confirmed_by: List[str]
+    missing_owners: List[str]
+
+    @property
+    def is_confirmed(self) -> bool:
+        return len(self.confirmed_by) >= self.required
+
+
+def get_multisig():
     web3 = get_web3('rsk_mainnet')
-    multisig = web3.eth.contract(
+    return web3.eth.contract(
         address=MULTISIG_ADDRESS,
         abi=load_abi('fastbtc/Multisig'),
     )
-    bridge_multisig_rows = FEDS
-    required = multisig.functions.required().call()
-    confirmations = 0
-    confirmation_left_from = []
-    for owner in multisig.functions.getOwners().call():
-        has_confirmed = multisig.functions.confirmations(tx_number, owner).call()
-        if has_confirmed:
-            confirmations += 1
-        else:
-            try:
-                owner_row = [r for r in bridge_multisig_rows if r[1] == owner][0]
-                confirmation_left_from.append(owner_row)
-            except IndexError:
-                pass
+
+
+def get_confirmation_statuses(
+    multisig,
+    tx_numbers: Iterable[int],
+    *,
+    block_identifier='latest',
+    batch_size: int = 100,
+    max_workers: int = 4,
+) -> Dict[int, ConfirmationStatus]:
+    """
+    Get the transaction struct and the confirmations of all owners of many multisig transactions.
+
+    The owners, the requirement and the transactions and their confirmations are read with batched calls,
+    all pinned to the same block. For a single transaction, that's one JSON-RPC batch request, plus one
+    eth_blockNumber request to pin the block if block_identifier is 'latest' (eth_call can't refer to the
+    result of another request of the same batch). Larger sets are split in batches that are sent concurrently.
+    """
+    tx_numbers = list(tx_numbers)
+    web3 = multisig.web3
+    if block_identifier == 'latest':
+        block_identifier = web3.eth.block_number
+    functions = [multisig.functions.required(), multisig.functions.getOwners()]
+    for tx_number in tx_numbers:
+        functions.append(multisig.functions.transactions(tx_number))
+        functions.append(multisig.functions.getConfirmations(tx_number))
+    chunks = [functions[i:i + batch_size] for i in range(0, len(functions), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = [
+            result
+            for chunk_results in executor.map(
+                lambda chunk: batch_call(web3, chunk, block_identifier=block_identifier, batch_size=batch_size),
+                chunks,
+            )
+            for result in chunk_results
+        ]
+    required, owners = results[:2]
+    ret = {}
+    for i, tx_number in enumerate(tx_numbers):
+        transaction, confirmed_by = results[2 + 2 * i:4 + 2 * i]
+        confirmed_by = [to_address(a) for a in confirmed_by]
+        ret[tx_number] = ConfirmationStatus(
+            tx_number=tx_number,
+            transaction=MultisigTransaction(*transaction),
+            required=required,
+            confirmed_by=confirmed_by,
+            missing_owners=[to_address(a) for a in owners if to_address(a) not in confirmed_by],
+        )
+    return ret
+
+
+def get_federator_rows(owners: Iterable[str]) -> List[Tuple[str, str]]:
+    """(name, address) rows of the owners found in fastbtc_in_federators.json"""
+    names_by_address = {address: name for name, address in FEDS}
+    return [(names_by_address[owner], owner) for owner in owners if owner in names_by_address]
+
+
+def show_confirmation_details(tx_number):
+    multisig = get_multisig()
+    status = get_confirmation_statuses(multisig, [tx_number])[tx_number]
+    required = status.required
+    confirmations = len(status.confirmed_by)
+    confirmation_left_from = get_federator_rows(status.missing_owners)
     print(f'Multisig address: `{multisig.address}`')
     print(f'Transaction id: `{tx_number}`')
-    is_confirmed = multisig.functions.isConfirmed(tx_number).call()
+    is_confirmed = status.is_confirmed
     print('Is confirmed?: ', is_confirmed)
-    transaction = MultisigTransaction(*multisig.functions.transactions(tx_number).call())
+    transaction = status.transaction
     print("Transaction:", transaction)
     if is_confirmed:
         if transaction.executed:
@@ -77,12 +139,53 @@ def show_confirmation_details(tx_number):
     print("")
 
 
+def sweep_pending_transactions(from_tx_number=None, to_tx_number=None):
+    """Show the missing signers of every not executed transaction in the range (the last 1000 by default)"""
+    multisig = get_multisig()
+    transaction_count = multisig.functions.transactionCount().call()
+    if to_tx_number is None:
+        to_tx_number = transaction_count - 1
+    if from_tx_number is None:
+        from_tx_number = max(0, to_tx_number - 999)
+    to_tx_number = min(to_tx_number, transaction_count - 1)
+    print(f'Multisig address: `{multisig.address}`')
+    print(f'Checking transactions {from_tx_number}-{to_tx_number}')
+    statuses = get_confirmation_statuses(multisig, range(from_tx_number, to_tx_number + 1))
+    pending = [status for status in statuses.values() if not status.transaction.executed]
+    print(f'{len(pending)} transactions not executed')
+    for status in pending:
+        print("")
+        if status.is_confirmed:
+            print(f'Transaction `{status.tx_number}` is confirmed but not executed!')
+            continue
+        print(
+            f'Transaction `{status.tx_number}`: {len(status.confirmed_by)} out of {status.required} confirmations, '
+            f'{status.required - len(status.confirmed_by)} left'
+        )
+        federator_rows = get_federator_rows(status.missing_owners)
+        for discord_nick, address in federator_rows:
+            print(f"{discord_nick} `{address}`")
+        known_addresses = {address for _, address in federator_rows}
+        for address in status.missing_owners:
+            if address not in known_addresses:
+                print(f"(unknown) `{address}`")
+
+
 def main():
     from argparse import ArgumentParser
     parser = ArgumentParser(description='Show confirmation details for a given transaction number in the FastBTC-in multisig')
-    parser.add_argument('tx_number', type=int)
+    parser.add_argument('tx_number', type=int, nargs='?')
+    parser.add_argument('--sweep', action='store_true', default=False,
+                        help='show the missing signers of all not executed transactions (the last 1000 by default)')
+    parser.add_argument('--from-tx', type=int, default=None, help='first transaction number to sweep')
+    parser.add_argument('--to-tx', type=int, default=None, help='last transaction number to sweep')
     args = parser.parse_args()
-    show_confirmation_details(args.tx_number)
+    if args.sweep:
+        sweep_pending_transactions(args.from_tx, args.to_tx)
+    elif args.tx_number is not None:
+        show_confirmation_details(args.tx_number)
+    else:
+        parser.error('give a transaction number or --sweep')
 
 
 if __name__ == '__main__':
@@ -14,13 +14,23 @@ Run like this:
 
     python3 check_log_inconsistencies.py --rpc http://localhost:4445 --from-block 3581430 --to-block 3581530
 
+Alternatively, compare the eth_getLogs responses of two nodes against each other by giving --compare-rpc.
+In this mode both nodes are queried in parallel and only digests of the logs of each block range are compared.
+Ranges whose digests differ are bisected (re-querying both nodes for the smaller ranges) until the differing
+blocks are found, so large ranges can be compared with few extra calls:
+
+    python3 check_log_inconsistencies.py --rpc http://localhost:4444 --compare-rpc https://public-node.rsk.co \
+        --from-block 3000000 --to-block 4000000 --batch-size 10000
+
 Python 3.6 or later required. No external libraries required.
 """
 import argparse
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from urllib import request
 
 
@@ -30,27 +40,46 @@ def main():
     parser.add_argument('--from-block', type=int, help="from block", required=True)
     parser.add_argument('--to-block', type=int, help="to block", required=True)
     parser.add_argument('--batch-size', type=int, help="number of blocks to get in single request", default=100)
+    parser.add_argument(
+        '--compare-rpc',
+        type=str,
+        help="rpc url of another node. If given, compare eth_getLogs responses of the two nodes instead",
+        default=None,
+    )
     args = parser.parse_args()
 
-    print(
-        f"Checking for inconsistencies in logs returned by eth_getLogs and eth_getTransactionReceipt "
-        f"between blocks {args.from_block} and {args.to_block}."
-    )
-    inconsistencies = []
     client = JSONRPCClient(args.rpc)
-    from_block = args.from_block
-    to_block = args.to_block
-    while from_block <= to_block:
-        batch_to_block = min(from_block + args.batch_size, to_block)
-        print(f"Checking blocks {from_block} to {batch_to_block} (up to {to_block})")
-        logs = client.get_logs(from_block, batch_to_block)
-        batch_inconsistencies = check_inconsistencies(
+    if args.compare_rpc:
+        print(
+            f"Comparing logs returned by eth_getLogs of {args.rpc} and {args.compare_rpc} "
+            f"between blocks {args.from_block} and {args.to_block}."
+        )
+        inconsistencies = compare_nodes(
             client=client,
-            logs=logs
+            other_client=JSONRPCClient(args.compare_rpc),
+            from_block=args.from_block,
+            to_block=args.to_block,
+            batch_size=args.batch_size,
+        )
+    else:
+        print(
+            f"Checking for inconsistencies in logs returned by eth_getLogs and eth_getTransactionReceipt "
+            f"between blocks {args.from_block} and {args.to_block}."
         )
-        if batch_inconsistencies:
-            inconsistencies.extend(batch_inconsistencies)
-        from_block = batch_to_block + 1
+        inconsistencies = []
+        from_block = args.from_block
+        to_block = args.to_block
+        while from_block <= to_block:
+            batch_to_block = min(from_block + args.batch_size, to_block)
+            print(f"Checking blocks {from_block} to {batch_to_block} (up to {to_block})")
+            logs = client.get_logs(from_block, batch_to_block)
+            batch_inconsistencies = check_inconsistencies(
+                client=client,
+                logs=logs
+            )
+            if batch_inconsistencies:
+                inconsistencies.extend(batch_inconsistencies)
+            from_block = batch_to_block + 1
 
     if inconsistencies:
         print("\n\nDetected inconsistencies:")
@@ -131,6 +160,35 @@ class LogInconsistency:
         return '\n'.join(lines)
 
 
+@dataclass
+class NodeLogInconsistency:
+    tx_hash: str
+    log_index: int
+    block_number: int
+    node: str
+    other_node: str
+    log: Optional[Dict[str, Any]]
+    other_log: Optional[Dict[str, Any]]
+    type: str
+
+    def __repr__(self):
+        lines = [
+            f"<INCONSISTENCY(",
+            f"  block: {self.block_number}, tx: {self.tx_hash}, index: {self.log_index}",
+            f"  type: {self.type}",
+            f"  {self.node}: {format_log(self.log)}",
+            f"  {self.other_node}: {format_log(self.other_log)}",
+            ")>",
+        ]
+        return '\n'.join(lines)
+
+
+def format_log(log: Optional[Dict[str, Any]]) -> str:
+    if log is None:
+        return '(none)'
+    return f"address {log['address']}, topics {','.join(log['topics'])}, data {log['data']}"
+
+
 def check_inconsistencies(client: JSONRPCClient, logs: List[Dict[str, any]]):
     logs_by_tx_hash_and_log_index = {}
     tx_hashes = set()
@@ -223,6 +281,122 @@ def check_data_mismatch(receipt_log: Dict[str, Any], getlogs_log: Dict[str, Any]
     return None
 
 
+def compare_nodes(
+    client: JSONRPCClient,
+    other_client: JSONRPCClient,
+    from_block: int,
+    to_block: int,
+    batch_size: int,
+) -> List[NodeLogInconsistency]:
+    """
+    Compare eth_getLogs responses of two nodes range by range.
+
+    Only digests of the ranges are compared. When the digests of a range differ, the range is split in two
+    and both halves are queried again from both nodes, recursing only into the halves that still differ.
+    """
+    def diff(logs: List, other_logs: List) -> List[NodeLogInconsistency]:
+        return diff_logs(logs, other_logs, node=client.rpc_url, other_node=other_client.rpc_url)
+
+    inconsistencies = []
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        def get_logs_from_both(range_from_block: int, range_to_block: int) -> Tuple[List, List]:
+            future = executor.submit(client.get_logs, range_from_block, range_to_block)
+            other_future = executor.submit(other_client.get_logs, range_from_block, range_to_block)
+            return future.result(), other_future.result()
+
+        def compare_range(range_from_block: int, range_to_block: int, logs: List, other_logs: List):
+            """Find the differences of a range whose digests are already known to differ"""
+            print(f"Digests differ between blocks {range_from_block} and {range_to_block}")
+            if range_from_block == range_to_block:
+                inconsistencies.extend(diff(logs, other_logs))
+                return
+
+            middle_block = (range_from_block + range_to_block) // 2
+            num_differing_halves = 0
+            for half_from_block, half_to_block in (
+                (range_from_block, middle_block),
+                (middle_block + 1, range_to_block),
+            ):
+                half_logs, half_other_logs = get_logs_from_both(half_from_block, half_to_block)
+                if get_logs_digest(half_logs) != get_logs_digest(half_other_logs):
+                    num_differing_halves += 1
+                    compare_range(half_from_block, half_to_block, half_logs, half_other_logs)
+            if num_differing_halves == 0:
+                # The nodes only disagree when queried with the larger range, so report the differences there
+                print(
+                    f"NOTE: blocks {range_from_block} to {range_to_block} differ only when queried as a whole"
+                )
+                inconsistencies.extend(diff(logs, other_logs))
+
+        while from_block <= to_block:
+            batch_to_block = min(from_block + batch_size, to_block)
+            print(f"Comparing blocks {from_block} to {batch_to_block} (up to {to_block})")
+            logs, other_logs = get_logs_from_both(from_block, batch_to_block)
+            if get_logs_digest(logs) != get_logs_digest(other_logs):
+                compare_range(from_block, batch_to_block, logs, other_logs)
+            from_block = batch_to_block + 1
+
+    return inconsistencies
+
+
+def get_log_key(log: Dict[str, Any]) -> Tuple[str, int]:
+    return log['transactionHash'].lower(), int(log['logIndex'], 16)
+
+
+def get_logs_digest(logs: List[Dict[str, Any]]) -> str:
+    rows = sorted(
+        (
+            *get_log_key(log),
+            log['address'].lower(),
+            ','.join(topic.lower() for topic in log['topics']),
+            log['data'].lower(),
+        )
+        for log in logs
+    )
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(repr(row).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def diff_logs(
+    logs: List[Dict[str, Any]],
+    other_logs: List[Dict[str, Any]],
+    *,
+    node: str = 'first node',
+    other_node: str = 'second node',
+) -> List[NodeLogInconsistency]:
+    """Diff logs from two nodes, labeled with node and other_node (e.g. the RPC urls) in the results"""
+    logs_by_key = {get_log_key(log): log for log in logs}
+    other_logs_by_key = {get_log_key(log): log for log in other_logs}
+    inconsistencies = []
+    for log_key in sorted(logs_by_key.keys() | other_logs_by_key.keys()):
+        log = logs_by_key.get(log_key)
+        other_log = other_logs_by_key.get(log_key)
+        if log is None:
+            inconsistency_type = f'log missing from {node}'
+        elif other_log is None:
+            inconsistency_type = f'log missing from {other_node}'
+        elif get_logs_digest([log]) != get_logs_digest([other_log]):
+            inconsistency_type = 'log mismatch between nodes'
+        else:
+            continue
+        inconsistency = NodeLogInconsistency(
+            tx_hash=log_key[0],
+            log_index=log_key[1],
+            block_number=int((log or other_log)['blockNumber'], 16),
+            node=node,
+            other_node=other_node,
+            log=log,
+            other_log=other_log,
+            type=inconsistency_type,
+        )
+        print("INCONSISTENCY DETECTED --", inconsistency_type)
+        print(inconsistency)
+        inconsistencies.append(inconsistency)
+    return inconsistencies
+
+
 def print_percentage_progress(i, length):
     if length >= 10:
         if i % (length // 10) == 0:
@@ -1,4 +1,4 @@
-from utils import load_abi, to_address
+from utils import get_lazy_abi_getattr, to_address
 
 
 SOVRYN_PROTOCOL_ADDRESS = to_address('0x5a0d867e0d70fcc6ade25c3f1b89d618b5b4eaa7')
@@ -64,5 +64,8 @@ BRIDGES = {
         }
     },
 }
-BRIDGE_ABI = load_abi('token_bridge/Bridge')
-FEDERATION_ABI = load_abi('token_bridge/Federation')
\ No newline at end of file
+# ABIs are loaded on first access
+__getattr__ = get_lazy_abi_getattr(__name__, {
+    'BRIDGE_ABI': 'token_bridge/Bridge',
+    'FEDERATION_ABI': 'token_bridge/Federation',
+})
@@ -6,11 +6,10 @@ import pandas as pd
 from eth_abi import decode_abi
 from eth_utils import is_hexstr, to_bytes, to_hex
 
-from utils import load_abi
+from utils import get_function_selectors
 
-FEDERATION_ABI = load_abi('token_bridge/Federation')
-
-VOTE_TRANSACTION_ABI = [x for x in FEDERATION_ABI if x.get('name') == 'voteTransaction'][0]
+VOTE_TRANSACTION_SELECTOR = '0xd03e1ee9'
+VOTE_TRANSACTION_ABI = get_function_selectors('token_bridge/Federation')[VOTE_TRANSACTION_SELECTOR]
 VOTE_TRANSACTION_PARAMETER_TYPES = [x['type'] for x in VOTE_TRANSACTION_ABI['inputs']]
 VOTE_TRANSACTION_PARAMETER_NAMES = [x['name'] for x in VOTE_TRANSACTION_ABI['inputs']]
 
@@ -39,7 +38,7 @@ def decode_votetransaction_hex_data(tx_data_hex: str, *, transfer_dataframe: Opt
     tx_data_bytes = to_bytes(hexstr=tx_data_hex)
     tx_data_function_selector = tx_data_bytes[:4]
     tx_data_function_selector_hex = to_hex(tx_data_function_selector)
-    if tx_data_function_selector_hex != '0xd03e1ee9':
+    if tx_data_function_selector_hex != VOTE_TRANSACTION_SELECTOR:
         warnings.warn(
             f"Function selector {tx_data_function_selector_hex!r} doesn't match expected voteTransaction selector"
         )
@@ -0,0 +1,98 @@
+"""
+Base for incrementally updated local indexes of contract events, stored in SQLite.
+
+Subclasses define the tables (SCHEMA) and how to store a batch of events (store_events). The last indexed
+block is stored in the same database and updated in the same transaction as the events of each batch, so an
+interrupted update continues where it left off. Subclasses that keep in-memory state derived from the events
+apply it in on_batch_committed and drop it in on_batch_rolled_back, so it never gets ahead of the database.
+"""
+import logging
+import sqlite3
+from typing import List, Sequence
+
+from web3.contract import Contract
+
+from utils import get_contract_events
+
+logger = logging.getLogger(__name__)
+
+
+class EventIndex:
+    SCHEMA: str = ''
+    EVENT_NAMES: Sequence[str] = ()
+
+    def __init__(
+        self,
+        *,
+        contract: Contract,
+        path: str,
+        start_block: int = 0,
+        confirmations: int = 10,
+        batch_size: int = 10000,
+    ):
+        self.contract = contract
+        self.web3 = contract.web3
+        self.start_block = start_block
+        self.confirmations = confirmations
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self.db.executescript(self.SCHEMA)
+
+    @property
+    def block_number(self) -> int:
+        """The last indexed block"""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'block_number'").fetchone()
+        return int(row['value']) if row else self.start_block - 1
+
+    def update(self, to_block: int = None) -> int:
+        """Index the events up to to_block (latest block minus confirmations by default). Returns the event count."""
+        if to_block is None:
+            to_block = self.web3.eth.block_number - self.confirmations
+        num_events = 0
+        from_block = self.block_number + 1
+        while from_block <= to_block:
+            batch_to_block = min(from_block + self.batch_size - 1, to_block)
+            events = get_contract_events(
+                contract=self.contract,
+                event_names=self.EVENT_NAMES,
+                from_block=from_block,
+                to_block=batch_to_block,
+                batch_size=self.batch_size,
+            )
+            try:
+                with self.db:
+                    self.store_events(events)
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('block_number', ?)",
+                        (str(batch_to_block),),
+                    )
+            except BaseException:
+                self.on_batch_rolled_back()
+                raise
+            self.on_batch_committed()
+            num_events += len(events)
+            from_block = batch_to_block + 1
+        if num_events:
+            logger.info('indexed %s events up to block %s', num_events, to_block)
+        return num_events
+
+    def store_events(self, events: List):
+        raise NotImplementedError()
+
+    def on_batch_committed(self):
+        """Called after the events stored by store_events have been committed"""
+
+    def on_batch_rolled_back(self):
+        """Called after storing a batch of events failed and its transaction has been rolled back"""
+
+    def close(self):
+        self.db.close()
+
+
+def chunked(items: Sequence, size: int = 500):
+    """Split items in chunks, e.g. to stay below the SQLite limit of query parameters"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -1,18 +1,23 @@
-import dataclasses
-import enum
 import os
 import sys
 import time
-from collections import defaultdict
-from pprint import pprint
-from typing import Optional
 
 from eth_account import Account
 from eth_utils import to_hex
 from eth_abi import encode_abi
-from web3.logs import DISCARD
 
-from utils import get_erc20_contract, get_events, get_web3, load_abi, set_web3_account, to_address, enable_logging
+from fastbtc_transfer_index import TransferIndex
+from tokens import get_token_registry
+from utils import (
+    TransactionPipeline,
+    batch_call,
+    enable_logging,
+    get_contract_events,
+    get_erc20_contract,
+    get_web3,
+    load_abi,
+    to_address,
+)
 
 enable_logging()
 
@@ -93,10 +98,12 @@ bsc_btcs = get_erc20_contract(
     token_address=to_address(bsc_btcs_token_address),
     web3=bsc_web3
 )
+bsc_btcs_info = get_token_registry(bsc_web3).get(bsc_btcs_token_address)
 print("rsk address    ", test_account.address)
 print("bitcoin address", bitcoin_address)
 
 if command == 'transfer_from_bsc_to_btc':
+    bsc_pipeline = TransactionPipeline(bsc_web3, account=test_account, replace_after=120)
     transfer_fee = rsk_allowtokens.functions.getFeePerToken(rsk_rbtc_wrapper_address).call()
     print("Fee:", transfer_fee)
     min_per_token = rsk_allowtokens.functions.getMinPerToken(rsk_rbtc_wrapper_address).call()
@@ -111,7 +118,8 @@ if command == 'transfer_from_bsc_to_btc':
         )
     print("Min transfer:", min_transfer_satoshi, "satoshi,", min_transfer_wei, "wei")
 
-    print("BTCs balance   ", bsc_btcs.functions.balanceOf(test_account.address).call())
+    btcs_balance = bsc_btcs.functions.balanceOf(test_account.address).call()
+    print("BTCs balance   ", btcs_balance, f"({bsc_btcs_info.to_decimal(btcs_balance)} {bsc_btcs_info.symbol})")
     print("Transfer amount", bsc_to_btc_transfer_amount_wei)
 
     #user_data = fastbtc_inbox.functions.encodeUserData(test_account.address, bitcoin_address).call()
@@ -120,27 +128,33 @@ if command == 'transfer_from_bsc_to_btc':
 
     if bsc_btcs.functions.allowance(test_account.address, bsc_btcs_aggregator_address).call() < bsc_to_btc_transfer_amount_wei:
         print("Setting allowance")
-        tx = bsc_btcs.functions.approve(bsc_btcs_aggregator_address, 2**256 - 1).transact()
-        print("Done, tx:", to_hex(tx), "waiting for receipt")
-        bsc_web3.eth.wait_for_transaction_receipt(tx)
+        # redeemToBridge can only be estimated after the approval is mined
+        tx = bsc_pipeline.send(bsc_btcs.functions.approve(bsc_btcs_aggregator_address, 2**256 - 1))
+        print("Done, tx:", tx.tx_hash, "waiting for receipt")
+        bsc_pipeline.wait()
 
     print("Redeeming to bridge in 3s...")
     time.sleep(3)
 
     #"0xc41d41cb7a31c80662ac2d8ab7a7e5f5841eebc3","20000000000000","0x18a2EF981110C23Cf1a58065EfA41b27AD963980","0x000000000000000000000000a7a7a7"
-    tx = bsc_aggregator.functions.redeemToBridge(
+    tx = bsc_pipeline.send(bsc_aggregator.functions.redeemToBridge(
         bsc_brbtc_token_address,
         bsc_to_btc_transfer_amount_wei,
         #fastbtc_inbox_address,
         fastbtc_bridge_address,
         #test_account.address,
         user_data,
-    ).transact()
-    print("Done, tx:", to_hex(tx), "waiting for receipt")
-    bsc_web3.eth.wait_for_transaction_receipt(tx)
+    ))
+    print("Done, tx:", tx.tx_hash, "waiting for receipt")
+    bsc_pipeline.wait()
 elif command == 'transfer_from_rsk_to_bsc':
     print("RBTC balance (RSK)          ", rsk_web3.eth.get_balance(test_account.address))
-    print("BTCs balance (BSC)          ", bsc_btcs.functions.balanceOf(test_account.address).call())
+    btcs_balance = bsc_btcs.functions.balanceOf(test_account.address).call()
+    print(
+        "BTCs balance (BSC)          ",
+        btcs_balance,
+        f"({bsc_btcs_info.to_decimal(btcs_balance)} {bsc_btcs_info.symbol})"
+    )
     print("Transfer amount (RSK to BSC)", rsk_to_bsc_transfer_amount_wei)
 
     encoded_address = encode_abi(['address'], [test_account.address])
@@ -150,76 +164,86 @@ elif command == 'transfer_from_rsk_to_bsc':
     print("Transferring RBTC through RSK bridge to BSC in 3s...")
     time.sleep(3)
 
-    tx = rsk_bridge.functions.receiveEthAt(
-        bsc_btcs_aggregator_address,
-        encoded_address
-    ).transact({
-        "value": rsk_to_bsc_transfer_amount_wei
-    })
-    print("Done, tx:", to_hex(tx), "waiting for receipt")
-    rsk_web3.eth.wait_for_transaction_receipt(tx)
+    pipeline = TransactionPipeline(rsk_web3, account=test_account, replace_after=120)
+    tx = pipeline.send(
+        rsk_bridge.functions.receiveEthAt(
+            bsc_btcs_aggregator_address,
+            encoded_address
+        ),
+        value=rsk_to_bsc_transfer_amount_wei,
+    )
+    print("Done, tx:", tx.tx_hash, "waiting for receipt")
+    pipeline.wait()
 
 elif command == 'accept_transfers':
-    # TODO: no longer in use
     to_block = rsk_web3.eth.get_block_number()
-    inbox_received_events = get_events(
-       event=fastbtc_inbox.events.Received(),
-       from_block=2_360_000,
-       to_block=to_block,
-       batch_size=10_000
+    federation_events = get_contract_events(
+        contract=rsk_federation,
+        event_names=['Voted', 'Executed'],
+        from_block=2_360_000,
+        to_block=to_block,
+        batch_size=10_000,
+    )
+    executed_transaction_ids = set(
+        e.args.transactionId for e in federation_events if e.event == 'Executed'
     )
-    print("Found", len(inbox_received_events), "inbox transfers")
-    pprint(inbox_received_events)
+    # Every federator emits Voted for the same transaction, one is enough
+    voted_events_by_transaction_id = {}
+    for event in federation_events:
+        if event.event != 'Voted' or to_address(event.args.receiver) != fastbtc_inbox.address:
+            continue
+        voted_events_by_transaction_id.setdefault(event.args.transactionId, event)
+    print("Found", len(voted_events_by_transaction_id), "inbox transfers")
 
+    candidates = []
+    for transaction_id, voted_event in voted_events_by_transaction_id.items():
+        if transaction_id not in executed_transaction_ids:
+            print(f"Event with tx id u {to_hex(transaction_id)} voted but not executed")
+            continue
+        candidates.append(voted_event)
+    accepted = batch_call(
+        rsk_web3,
+        [
+            fastbtc_inbox.functions.acceptedTokenBridgeTransfers(voted_event.args.transactionId)
+            for voted_event in candidates
+        ],
+    )
     acceptable_transfers = []
-    for i, event in enumerate(inbox_received_events, start=1):
-        tx_hash = event.transactionHash
-        print(f"Event #{i}, block: {event.blockNumber}, tx: {to_hex(tx_hash)}")
-        receipt = rsk_web3.eth.get_transaction_receipt(tx_hash)
-        voted_events = rsk_federation.events.Voted().processReceipt(
-            receipt,
-            errors=DISCARD
-        )
-        executed_events = rsk_federation.events.Executed().processReceipt(
-            receipt,
-            errors=DISCARD
-        )
-        print(len(voted_events), "voted events")
-        print(len(executed_events), "executed events")
-        executed_transaction_ids = set(e.args.transactionId for e in executed_events)
-        for voted_event in voted_events:
-            transaction_id = voted_event.args.transactionId
-            if transaction_id not in executed_transaction_ids:
-                print(f"Event with tx id u {to_hex(transaction_id)} voted but not executed")
-                continue
-            if fastbtc_inbox.functions.acceptedTokenBridgeTransfers(transaction_id).call():
-                print(f"Event with tx id u {to_hex(transaction_id)} already accepted")
-                continue
-            acceptable_transfers.append(
-                (
-                    voted_event.args.amount,
-                    voted_event.args.symbol,
-                    voted_event.args.blockHash,
-                    voted_event.args.transactionHash,
-                    voted_event.args.logIndex,
-                    voted_event.args.decimals,
-                    voted_event.args.granularity,
-                    voted_event.args.userData
-                )
+    for voted_event, is_accepted in zip(candidates, accepted):
+        if is_accepted:
+            print(f"Event with tx id u {to_hex(voted_event.args.transactionId)} already accepted")
+            continue
+        acceptable_transfers.append(
+            (
+                voted_event.args.amount,
+                voted_event.args.symbol,
+                voted_event.args.blockHash,
+                voted_event.args.transactionHash,
+                voted_event.args.logIndex,
+                voted_event.args.decimals,
+                voted_event.args.granularity,
+                voted_event.args.userData
             )
+        )
 
     if acceptable_transfers:
         print("Accepting", len(acceptable_transfers), "transfers")
         time.sleep(3)
     else:
         print("No transfers to accept")
+    pipeline = TransactionPipeline(rsk_web3, account=test_account, replace_after=120)
     for i, args in enumerate(acceptable_transfers, start=1):
         print(
             f"Accepting event #{i} with args:", args
         )
-        tx = fastbtc_inbox.functions.acceptTokenBridgeTransfer(*args).transact()
-        print("Done, tx:", to_hex(tx), "waiting for receipt")
-        rsk_web3.eth.wait_for_transaction_receipt(tx)
+        transaction = pipeline.send(
+            fastbtc_inbox.functions.acceptTokenBridgeTransfer(*args),
+            label=f"accept #{i}",
+        )
+        print("Sent, tx:", transaction.tx_hash)
+    print("Waiting for receipts")
+    for transaction in pipeline.wait():
+        print(transaction.label, transaction.tx_hash, "OK" if transaction.succeeded else "FAILED")
 
     #accepted_cross_transfer_events = get_events(
     #    event=rsk_bridge.events.AcceptedCrossTransfer(),
@@ -280,7 +304,8 @@ elif command == 'accept_bridge_transfer':
     )
     time.sleep(3)
 
-    tx = fastbtc_inbox.functions.acceptTokenBridgeTransfer(
+    pipeline = TransactionPipeline(rsk_web3, account=test_account, replace_after=120)
+    tx = pipeline.send(fastbtc_inbox.functions.acceptTokenBridgeTransfer(
         amount,
         symbol,
         blockHash,
@@ -289,12 +314,10 @@ elif command == 'accept_bridge_transfer':
         decimals,
         granularity,
         userData
-    ).transact()
-    print("Done, tx:", to_hex(tx), "waiting for receipt")
-    rsk_web3.eth.wait_for_transaction_receipt(tx)
+    ))
+    print("Done, tx:", tx.tx_hash, "waiting for receipt")
+    pipeline.wait()
 elif command == "get_transfer_history":
-    from_block = fastbtc_bridge_deploy_block
-    to_block = rsk_web3.eth.get_block_number()
     user_address = ''
     try:
         user_address = sys.argv[2]
@@ -302,111 +325,13 @@ elif command == "get_transfer_history":
     except IndexError:
         print("Showing transfers from all users")
 
-    class TransferStatus(enum.IntEnum):
-        NOT_APPLICABLE = 0
-        NEW = 1
-        SENDING = 2
-        MINED = 3
-        REFUNDED = 4
-
-    @dataclasses.dataclass()
-    class BitcoinTransfer:
-        transfer_id: str
-        rsk_address: str
-        bitcoin_address: str
-        total_amount_satoshi: int
-        net_amount_satoshi: int
-        fee_satoshi: int
-        #is_bridge_transfer: bool
-        status: TransferStatus
-        bitcoin_tx_id: Optional[str] = None
-
-
-    # TODO: this can be optimized at least by reducing the amount of calls needed,
-    # and by utilizing filters better
-    new_bitcoin_transfer_events = get_events(
-        event=fastbtc_bridge.events.NewBitcoinTransfer(),
-        from_block=from_block,
-        to_block=to_block,
-        batch_size=10_000,
-        # Cannot filter by rskAddress if we take FastBTCInbox NewTokenBridgeBitcoinTransfer events into account
-        argument_filters=dict(
-            rskAddress=user_address,
-        ) if user_address else None
-    )
-    print("Found", len(new_bitcoin_transfer_events), "NewBitcoinTransfer events")
-
-    #new_token_bridge_bitcoin_transfer_events = get_events(
-    #    event=fastbtc_inbox.events.NewTokenBridgeBitcoinTransfer(),
-    #    from_block=from_block,
-    #    to_block=to_block,
-    #    batch_size=10_000,
-    #    argument_filters=dict(
-    #        rskAddress=user_address,
-    #    ) if user_address else None
-    #)
-    #print("Found", len(new_bitcoin_transfer_events), "NewTokenBridgeBitcoinTransfer events")
-
-    bitcoin_transfer_batch_sending_events = get_events(
-        event=fastbtc_bridge.events.BitcoinTransferBatchSending(),
-        from_block=from_block,
-        to_block=to_block,
-        batch_size=10_000,
-    )
-    print("Found", len(bitcoin_transfer_batch_sending_events), "BitcoinTransferBatchSending events")
-
-    bitcoin_transfer_status_updated_events = get_events(
-        event=fastbtc_bridge.events.BitcoinTransferStatusUpdated(),
-        from_block=from_block,
-        to_block=to_block,
-        batch_size=10_000,
-    )
-    print("Found", len(bitcoin_transfer_batch_sending_events), "BitcoinTransferStatusUpdated events")
-
-    transfer_batch_sending_events_by_tx_hash = defaultdict(list)
-    for event in bitcoin_transfer_batch_sending_events:
-        # Add a reference to this event for each event in the transferBatchSize,
-        # to make processing easier
-        transfer_batch_sending_events_by_tx_hash[event.transactionHash].extend(
-            [event] * event.args.transferBatchSize
-        )
-
-    bitcoin_tx_ids_by_transfer_id = dict()
-    statuses_by_transfer_id = dict()
-    #actual_rsk_addresses_by_transfer_id = dict()
-
-    #for event in new_token_bridge_bitcoin_transfer_events:
-    #    actual_rsk_addresses_by_transfer_id[event.args.transferId] = event.args.rskAddress
-
-    for event in bitcoin_transfer_status_updated_events:
-        status = TransferStatus(event.args.newStatus)
-        statuses_by_transfer_id[event.args.transferId] = status
-        if status == TransferStatus.SENDING:
-            sending_event = transfer_batch_sending_events_by_tx_hash[event.transactionHash].pop(0)
-            bitcoin_tx_ids_by_transfer_id[event.args.transferId] = sending_event.args.bitcoinTxHash
-
-    transfers = []
-    for event in new_bitcoin_transfer_events:
-        bitcoin_tx_id = bitcoin_tx_ids_by_transfer_id.get(event.args.transferId)
-        if bitcoin_tx_id:
-            bitcoin_tx_id = to_hex(bitcoin_tx_id)[2:]
-
-        #rsk_address = actual_rsk_addresses_by_transfer_id.get(event.args.transferId, event.args.rskAddress)
-        rsk_address = event.args.rskAddress
-        if user_address and rsk_address.lower() != user_address.lower():
-            continue
-        transfer = BitcoinTransfer(
-            transfer_id=to_hex(event.args.transferId),
-            rsk_address=rsk_address,
-            bitcoin_address=event.args.btcAddress,
-            total_amount_satoshi=event.args.amountSatoshi + event.args.feeSatoshi,
-            net_amount_satoshi=event.args.amountSatoshi,
-            fee_satoshi=event.args.feeSatoshi,
-            #is_bridge_transfer=event.args.transferId in actual_rsk_addresses_by_transfer_id,
-            status=statuses_by_transfer_id.get(event.args.transferId, TransferStatus.NEW),
-            bitcoin_tx_id=bitcoin_tx_id,
-        )
-        transfers.append(transfer)
+    transfer_index = TransferIndex(fastbtc_bridge, start_block=fastbtc_bridge_deploy_block)
+    transfer_index.update()
+    if user_address:
+        transfers = transfer_index.get_transfers_by_rsk_address(user_address)
+    else:
+        transfers = transfer_index.get_transfers()
+    print("Found", len(transfers), "transfers")
 
     for transfer in transfers:
         print(transfer)
@@ -415,19 +340,20 @@ elif command == "set_wrbtc_address":
     admin_account_private_key = os.getenv('ADMIN_PRIVATE_KEY')
     if not admin_account_private_key:
         sys.exit("provide env var ADMIN_PRIVATE_KEY")
-    set_web3_account(
-        web3=rsk_web3,
-        account=Account.from_key(admin_account_private_key)
+    pipeline = TransactionPipeline(
+        rsk_web3,
+        account=Account.from_key(admin_account_private_key),
+        replace_after=120,
     )
 
     print("Setting WRBTC to", rsk_rbtc_wrapper_address)
     time.sleep(3)
-    tx = fastbtc_inbox.functions.setWrbtcToken(
+    tx = pipeline.send(fastbtc_inbox.functions.setWrbtcToken(
         rsk_rbtc_wrapper_address
-    ).transact()
+    ))
 
-    print("Done, tx:", to_hex(tx), "waiting for receipt")
-    rsk_web3.eth.wait_for_transaction_receipt(tx)
+    print("Done, tx:", tx.tx_hash, "waiting for receipt")
+    pipeline.wait()
 elif command == 'check_managed_wallet':
     old_managed_wallet = rsk_web3.eth.contract(
         address=rsk_old_managed_wallet_address,
@@ -449,20 +375,22 @@ elif command == 'check_managed_wallet':
     new_balance = rsk_web3.eth.get_balance(new_managed_wallet.address)
     print("New balance: ", new_balance)
     print("User balance:", rsk_web3.eth.get_balance(test_account.address))
+    pipeline = TransactionPipeline(rsk_web3, account=test_account, replace_after=120)
     if old_admin != previous_new_admin:
         print("Setting new ManagedWallet admin to", old_admin, "in 3s")
         time.sleep(3)
-        tx = new_managed_wallet.functions.changeAdmin(old_admin).transact()
-        print("Tx:", to_hex(tx))
+        tx = pipeline.send(new_managed_wallet.functions.changeAdmin(old_admin))
+        print("Tx:", tx.tx_hash)
     goal_balance = int(0.25 * 10**18)
     if new_balance < goal_balance / 2:
         print("Funding the wallet in 3s")
         time.sleep(3)
-        tx = rsk_web3.eth.send_transaction({
+        tx = pipeline.send({
             "to": rsk_new_managed_wallet_address,
             "value": goal_balance
         })
-        print("Tx:", to_hex(tx))
+        print("Tx:", tx.tx_hash)
+    pipeline.wait()
 
 elif command == 'pending_tx_fix':
     a = rsk_web3.eth.get_transaction_count(test_account.address, block_identifier='latest')
@@ -470,15 +398,21 @@ elif command == 'pending_tx_fix':
     b = rsk_web3.eth.get_transaction_count(test_account.address, block_identifier='pending')
     print("Pending", b)
     goal_nonce = 22
-    nonce = a
-    while nonce <= goal_nonce:
-        tx_hash = rsk_web3.eth.send_transaction({
+    # Stuck transactions with the same nonces are only replaced by ones with a higher gas price
+    pipeline = TransactionPipeline(
+        rsk_web3,
+        account=test_account,
+        nonce=a,
+        gas_price=int(rsk_web3.eth.gas_price * 1.25),
+        replace_after=60,
+    )
+    while pipeline.next_nonce <= goal_nonce:
+        tx = pipeline.send({
             "to": test_account.address,
             "value": bsc_to_btc_transfer_amount_wei,
-            "nonce": nonce
         })
-        print("Nonce:", nonce, "tx", to_hex(tx_hash))
-        nonce += 1
+        print("Nonce:", tx.nonce, "tx", tx.tx_hash)
+    pipeline.wait()
 
 elif command == "check_bridge_receiver":
     try:
@@ -0,0 +1,410 @@
+"""
+Persistent index of FastBTC (RSK -> BTC) transfers of a FastBTCBridge contract.
+
+Transfers are built from the NewBitcoinTransfer, BitcoinTransferBatchSending and BitcoinTransferStatusUpdated
+events and stored in SQLite with indexes on transfer id, RSK address, bitcoin address and bitcoin tx id.
+The index catches up incrementally from the last indexed block, so lookups need no chain scan.
+
+Every status transition is stored with its block timestamp too. In follow mode, new blocks are tailed and
+transitions are shown as they happen, together with rolling NEW -> SENDING -> MINED latency percentiles and
+transfers that have been stuck in NEW or SENDING for too long.
+
+Run like this:
+
+    python fastbtc_transfer_index.py --bridge 0x... --start-block 4000000 --follow
+"""
+import dataclasses
+import enum
+import heapq
+import logging
+import time
+from argparse import ArgumentParser
+from collections import deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from eth_utils import to_hex
+
+from event_index import EventIndex
+from utils import enable_logging, get_block_timestamps, get_cache_path, get_web3, load_abi, to_address
+
+logger = logging.getLogger(__name__)
+
+
+class TransferStatus(enum.IntEnum):
+    NOT_APPLICABLE = 0
+    NEW = 1
+    SENDING = 2
+    MINED = 3
+    REFUNDED = 4
+
+
+@dataclasses.dataclass()
+class BitcoinTransfer:
+    transfer_id: str
+    rsk_address: str
+    bitcoin_address: str
+    total_amount_satoshi: int
+    net_amount_satoshi: int
+    fee_satoshi: int
+    status: TransferStatus
+    bitcoin_tx_id: Optional[str] = None
+
+
+@dataclasses.dataclass()
+class TransferTransition:
+    transfer_id: str
+    old_status: Optional[TransferStatus]  # None for new transfers
+    new_status: TransferStatus
+    block_number: int
+    timestamp: int
+
+
+EXPECTED_TRANSITIONS = {
+    (None, TransferStatus.NEW),
+    (TransferStatus.NEW, TransferStatus.SENDING),
+    (TransferStatus.NEW, TransferStatus.REFUNDED),
+    (TransferStatus.SENDING, TransferStatus.MINED),
+    (TransferStatus.SENDING, TransferStatus.REFUNDED),
+}
+LATENCY_PAIRS = [
+    (TransferStatus.NEW, TransferStatus.SENDING),
+    (TransferStatus.SENDING, TransferStatus.MINED),
+    (TransferStatus.NEW, TransferStatus.MINED),
+]
+
+
+def get_event_sort_key(event) -> Tuple[int, int, int]:
+    return event.blockNumber, event.transactionIndex, event.logIndex
+
+
+def assign_bitcoin_tx_ids(*event_streams: Iterable) -> Iterator[Tuple[object, Optional[bytes]]]:
+    """
+    Match SENDING status updates to the BitcoinTransferBatchSending events of the same transaction.
+
+    Takes any number of event streams, each in the order the events were emitted, and merges them lazily
+    by (blockNumber, transactionIndex, logIndex). Yields (event, bitcoin tx hash) pairs, where the hash is
+    only set for SENDING status updates. Within a transaction, the batches and the status updates are
+    matched in the order they were emitted (first batch to the first transferBatchSize updates and so on),
+    regardless of whether the batch event comes before or after its status updates. Only the state of the
+    current transaction is kept in memory.
+    """
+    current_tx_hash = None
+    batches: Deque[List] = deque()  # [bitcoin tx hash, number of transfers left]
+    unmatched_events = deque()  # SENDING updates seen before their batch
+
+    def flush_transaction():
+        for unmatched_event in unmatched_events:
+            logger.warning(
+                'no BitcoinTransferBatchSending for transfer %s in tx %s',
+                to_hex(unmatched_event.args.transferId),
+                to_hex(unmatched_event.transactionHash),
+            )
+            yield unmatched_event, None
+        unmatched_events.clear()
+        batches.clear()
+
+    def match_unmatched_events():
+        while unmatched_events and batches:
+            batch = batches[0]
+            yield unmatched_events.popleft(), batch[0]
+            batch[1] -= 1
+            if batch[1] <= 0:
+                batches.popleft()
+
+    for event in heapq.merge(*event_streams, key=get_event_sort_key):
+        if event.transactionHash != current_tx_hash:
+            yield from flush_transaction()
+            current_tx_hash = event.transactionHash
+
+        if event.event == 'BitcoinTransferBatchSending':
+            if event.args.transferBatchSize > 0:
+                batches.append([event.args.bitcoinTxHash, event.args.transferBatchSize])
+            yield event, None
+            yield from match_unmatched_events()
+        elif event.event == 'BitcoinTransferStatusUpdated' and event.args.newStatus == TransferStatus.SENDING:
+            unmatched_events.append(event)
+            yield from match_unmatched_events()
+        else:
+            yield event, None
+    yield from flush_transaction()
+
+
+class TransferIndex(EventIndex):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS transfers (
+            transfer_id TEXT PRIMARY KEY,
+            rsk_address TEXT NOT NULL COLLATE NOCASE,
+            bitcoin_address TEXT NOT NULL,
+            net_amount_satoshi INTEGER NOT NULL,
+            fee_satoshi INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            bitcoin_tx_id TEXT,
+            block_number INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transfers_rsk_address ON transfers (rsk_address);
+        CREATE INDEX IF NOT EXISTS transfers_bitcoin_address ON transfers (bitcoin_address);
+        CREATE INDEX IF NOT EXISTS transfers_bitcoin_tx_id ON transfers (bitcoin_tx_id);
+        CREATE TABLE IF NOT EXISTS transitions (
+            transfer_id TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            block_number INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transitions_transfer_id ON transitions (transfer_id);
+    """
+    EVENT_NAMES = [
+        'NewBitcoinTransfer',
+        'BitcoinTransferBatchSending',
+        'BitcoinTransferStatusUpdated',
+    ]
+
+    def __init__(self, fastbtc_bridge, *, path: str = None, record_transitions: bool = False, **kwargs):
+        if path is None:
+            path = get_cache_path(
+                'fastbtc_transfers',
+                str(fastbtc_bridge.web3.eth.chain_id),
+                f'{fastbtc_bridge.address.lower()}.sqlite',
+            )
+        super().__init__(contract=fastbtc_bridge, path=path, **kwargs)
+        # Whether to keep the transitions in memory for pop_transitions
+        self.record_transitions = record_transitions
+        # Transitions committed since the last call of pop_transitions
+        self._new_transitions: List[TransferTransition] = []
+        # Transitions of the batch being stored, published when it's committed
+        self._batch_transitions: List[TransferTransition] = []
+
+    def pop_transitions(self) -> List[TransferTransition]:
+        """The transitions indexed since the last call (if record_transitions is set), in the order they happened"""
+        transitions = self._new_transitions
+        self._new_transitions = []
+        return transitions
+
+    def store_events(self, events: List):
+        timestamps_by_block = get_block_timestamps(
+            self.web3,
+            (event.blockNumber for event in events if event.event != 'BitcoinTransferBatchSending'),
+        )
+        for event, bitcoin_tx_hash in assign_bitcoin_tx_ids(events):
+            if event.event == 'NewBitcoinTransfer':
+                self.db.execute(
+                    'INSERT OR REPLACE INTO transfers VALUES (?, ?, ?, ?, ?, ?, NULL, ?)',
+                    (
+                        to_hex(event.args.transferId),
+                        event.args.rskAddress,
+                        event.args.btcAddress,
+                        event.args.amountSatoshi,
+                        event.args.feeSatoshi,
+                        int(TransferStatus.NEW),
+                        event.blockNumber,
+                    ),
+                )
+                self._store_transition(TransferTransition(
+                    transfer_id=to_hex(event.args.transferId),
+                    old_status=None,
+                    new_status=TransferStatus.NEW,
+                    block_number=event.blockNumber,
+                    timestamp=timestamps_by_block[event.blockNumber],
+                ))
+            elif event.event == 'BitcoinTransferStatusUpdated':
+                status = TransferStatus(event.args.newStatus)
+                transfer_id = to_hex(event.args.transferId)
+                row = self.db.execute('SELECT status FROM transfers WHERE transfer_id = ?', (transfer_id,)).fetchone()
+                self.db.execute('UPDATE transfers SET status = ? WHERE transfer_id = ?', (int(status), transfer_id))
+                self._store_transition(TransferTransition(
+                    transfer_id=transfer_id,
+                    old_status=TransferStatus(row['status']) if row else None,
+                    new_status=status,
+                    block_number=event.blockNumber,
+                    timestamp=timestamps_by_block[event.blockNumber],
+                ))
+                if bitcoin_tx_hash is not None:
+                    self.db.execute(
+                        'UPDATE transfers SET bitcoin_tx_id = ? WHERE transfer_id = ?',
+                        (to_hex(bitcoin_tx_hash)[2:], transfer_id),
+                    )
+
+    def _store_transition(self, transition: TransferTransition):
+        if (transition.old_status, transition.new_status) not in EXPECTED_TRANSITIONS:
+            logger.warning(
+                'unexpected transition of transfer %s from %s to %s in block %s',
+                transition.transfer_id,
+                transition.old_status,
+                transition.new_status,
+                transition.block_number,
+            )
+        self.db.execute(
+            'INSERT INTO transitions VALUES (?, ?, ?, ?)',
+            (transition.transfer_id, int(transition.new_status), transition.block_number, transition.timestamp),
+        )
+        if self.record_transitions:
+            self._batch_transitions.append(transition)
+
+    def on_batch_committed(self):
+        self._new_transitions.extend(self._batch_transitions)
+        self._batch_transitions = []
+
+    def on_batch_rolled_back(self):
+        self._batch_transitions = []
+
+    def get_status_timestamps(self, transfer_id: str) -> Dict[TransferStatus, int]:
+        rows = self.db.execute('SELECT status, timestamp FROM transitions WHERE transfer_id = ?', (transfer_id,))
+        return {TransferStatus(row['status']): row['timestamp'] for row in rows}
+
+    def get_latencies(self, from_status: TransferStatus, to_status: TransferStatus, *, limit: int) -> List[int]:
+        """Seconds between from_status and to_status of the last limit transfers that reached to_status"""
+        rows = self.db.execute(
+            """
+            SELECT t2.timestamp - t1.timestamp AS latency FROM transitions t2
+            JOIN transitions t1 ON t1.transfer_id = t2.transfer_id AND t1.status = ?
+            WHERE t2.status = ?
+            ORDER BY t2.block_number DESC
+            LIMIT ?
+            """,
+            (int(from_status), int(to_status), limit),
+        )
+        return [row['latency'] for row in reversed(rows.fetchall())]
+
+    def get_stuck_transfers(self, *, older_than: int) -> List[Tuple[BitcoinTransfer, int]]:
+        """Transfers in NEW or SENDING since before the timestamp older_than, with the time they got there"""
+        rows = self.db.execute(
+            """
+            SELECT transfers.transfer_id, MAX(transitions.timestamp) AS since FROM transfers
+            JOIN transitions ON transitions.transfer_id = transfers.transfer_id
+                AND transitions.status = transfers.status
+            WHERE transfers.status IN (?, ?)
+            GROUP BY transfers.transfer_id
+            HAVING since < ?
+            """,
+            (int(TransferStatus.NEW), int(TransferStatus.SENDING), older_than),
+        )
+        return [(self.get_transfer(row['transfer_id']), row['since']) for row in rows.fetchall()]
+
+    def get_transfer(self, transfer_id: str) -> Optional[BitcoinTransfer]:
+        transfers = self._query('WHERE transfer_id = ?', (transfer_id.lower(),))
+        return transfers[0] if transfers else None
+
+    def get_transfers(self, *, status: TransferStatus = None) -> List[BitcoinTransfer]:
+        if status is None:
+            return self._query('', ())
+        return self._query('WHERE status = ?', (int(status),))
+
+    def get_transfers_by_rsk_address(self, rsk_address: str) -> List[BitcoinTransfer]:
+        return self._query('WHERE rsk_address = ?', (rsk_address,))
+
+    def get_transfers_by_bitcoin_address(self, bitcoin_address: str) -> List[BitcoinTransfer]:
+        return self._query('WHERE bitcoin_address = ?', (bitcoin_address,))
+
+    def get_transfers_by_bitcoin_tx_id(self, bitcoin_tx_id: str) -> List[BitcoinTransfer]:
+        return self._query('WHERE bitcoin_tx_id = ?', (bitcoin_tx_id.lower().replace('0x', ''),))
+
+    def _query(self, where: str, params: tuple) -> List[BitcoinTransfer]:
+        rows = self.db.execute(f'SELECT * FROM transfers {where} ORDER BY block_number, rowid', params)
+        return [
+            BitcoinTransfer(
+                transfer_id=row['transfer_id'],
+                rsk_address=row['rsk_address'],
+                bitcoin_address=row['bitcoin_address'],
+                total_amount_satoshi=row['net_amount_satoshi'] + row['fee_satoshi'],
+                net_amount_satoshi=row['net_amount_satoshi'],
+                fee_satoshi=row['fee_satoshi'],
+                status=TransferStatus(row['status']),
+                bitcoin_tx_id=row['bitcoin_tx_id'],
+            )
+            for row in rows
+        ]
+
+
+class TransitionLatencies:
+    """Rolling windows of the latencies between transfer statuses"""
+    def __init__(self, *, window: int = 1000):
+        self.window = window
+        self.latencies: Dict[Tuple[TransferStatus, TransferStatus], Deque[int]] = {
+            pair: deque(maxlen=window) for pair in LATENCY_PAIRS
+        }
+
+    def load(self, transfer_index: TransferIndex):
+        for (from_status, to_status), latencies in self.latencies.items():
+            latencies.extend(transfer_index.get_latencies(from_status, to_status, limit=self.window))
+
+    def add(self, transition: TransferTransition, status_timestamps: Dict[TransferStatus, int]):
+        for (from_status, to_status), latencies in self.latencies.items():
+            if transition.new_status == to_status and from_status in status_timestamps:
+                latencies.append(transition.timestamp - status_timestamps[from_status])
+
+    def get_percentiles(self, percentiles=(50, 90, 99)) -> Dict[Tuple[TransferStatus, TransferStatus], np.ndarray]:
+        return {
+            pair: np.percentile(latencies, percentiles) if latencies else np.full(len(percentiles), np.nan)
+            for pair, latencies in self.latencies.items()
+        }
+
+
+def follow(transfer_index: TransferIndex, *, poll_interval: float, stuck_after: int):
+    latencies = TransitionLatencies()
+    latencies.load(transfer_index)
+    reported_stuck_transfer_ids = set()
+    transfer_index.record_transitions = True
+    while True:
+        transfer_index.update()
+        transitions = transfer_index.pop_transitions()
+        for transition in transitions:
+            old_status_name = transition.old_status.name if transition.old_status is not None else '-'
+            print(
+                f"Block {transition.block_number}: transfer {transition.transfer_id} "
+                f"{old_status_name} -> {transition.new_status.name}"
+            )
+            latencies.add(transition, transfer_index.get_status_timestamps(transition.transfer_id))
+        if transitions:
+            for (from_status, to_status), (p50, p90, p99) in latencies.get_percentiles().items():
+                print(f"    {from_status.name} -> {to_status.name} latency: "
+                      f"p50 {p50:.0f}s, p90 {p90:.0f}s, p99 {p99:.0f}s")
+
+        stuck_transfers = transfer_index.get_stuck_transfers(older_than=int(time.time()) - stuck_after)
+        for transfer, since in stuck_transfers:
+            if transfer.transfer_id not in reported_stuck_transfer_ids:
+                print(
+                    f"Transfer {transfer.transfer_id} of {transfer.rsk_address} stuck in {transfer.status.name} "
+                    f"for {(time.time() - since) / 60:.0f} minutes"
+                )
+        reported_stuck_transfer_ids = set(transfer.transfer_id for transfer, _ in stuck_transfers)
+        time.sleep(poll_interval)
+
+
+def main():
+    parser = ArgumentParser(description="Index FastBTC transfers and show them, or follow them as they happen")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--bridge', help='address of the FastBTCBridge contract', required=True)
+    parser.add_argument('--start-block', help='first block to index (on the first run)', type=int, default=0)
+    parser.add_argument('--user', help='show only the transfers of this RSK address')
+    parser.add_argument('--follow', action='store_true', default=False, help='follow new transfers')
+    parser.add_argument('--confirmations', type=int, default=2)
+    parser.add_argument('--poll-interval', help='seconds between polls for new blocks', type=float, default=10)
+    parser.add_argument('--stuck-after', help='minutes after which a transfer in NEW or SENDING is stuck',
+                        type=float, default=60)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    fastbtc_bridge = web3.eth.contract(
+        address=to_address(args.bridge),
+        abi=load_abi('bidirectional-fastbtc/FastBTCBridge'),
+    )
+    transfer_index = TransferIndex(fastbtc_bridge, start_block=args.start_block, confirmations=args.confirmations)
+    transfer_index.update()
+    if args.follow:
+        follow(transfer_index, poll_interval=args.poll_interval, stuck_after=int(args.stuck_after * 60))
+        return
+
+    if args.user:
+        transfers = transfer_index.get_transfers_by_rsk_address(args.user)
+    else:
+        transfers = transfer_index.get_transfers()
+    for transfer in transfers:
+        print(transfer)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Simulate which loans would become liquidatable if token prices changed.
+
+Takes one snapshot of the active loans and one matrix of PriceFeeds rates, and recomputes the margins
+and liquidation amounts of all loans locally, for a whole grid of price shocks at once.
+The margin and liquidation amount formulas mirror the ones the protocol uses in getActiveLoans.
+
+Run like this (simulate WRBTC dropping 5%, 10%, ..., 30%):
+
+    python liquidation_simulator.py --token WRBTC --shocks=-30,-25,-20,-15,-10,-5,0
+"""
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import List, Sequence
+
+import numpy as np
+
+from constants import SOVRYN_PROTOCOL_ADDRESS
+from loan_book import LoanBook, amounts_to_float
+from loans import load_active_loans
+from price_snapshot import PriceSnapshotStore
+from tokens import get_token_registry
+from utils import enable_logging, get_web3, load_abi
+
+# The protocol liquidates loans to this many percentage points above the maintenance margin
+LIQUIDATION_TARGET_MARGIN_BUFFER = 5.0
+
+
+@dataclass
+class ShockSimulationResult:
+    price_multipliers: np.ndarray  # (scenarios, tokens)
+    current_margin: np.ndarray  # (scenarios, loans), percentage
+    liquidatable: np.ndarray  # (scenarios, loans), bool
+    max_liquidatable: np.ndarray  # (scenarios, loans), wei of loan token (float)
+    max_seizable: np.ndarray  # (scenarios, loans), wei of collateral token (float)
+
+    def num_liquidatable(self) -> np.ndarray:
+        return np.count_nonzero(self.liquidatable, axis=1)
+
+    def sum_by_token(self, values: np.ndarray, token_index: np.ndarray, num_tokens: int) -> np.ndarray:
+        """Sum (scenarios, loans) values by token, returning a (scenarios, tokens) array"""
+        totals = np.zeros((values.shape[0], num_tokens))
+        for scenario_totals, scenario_values in zip(totals, values):
+            np.add.at(scenario_totals, token_index, scenario_values)
+        return totals
+
+
+def simulate_price_shocks(
+    *,
+    loan_book: LoanBook,
+    rates: np.ndarray,
+    price_multipliers: np.ndarray,
+    liquidation_incentive_percent: float,
+) -> ShockSimulationResult:
+    """
+    Recompute margins and liquidation amounts for each row of price_multipliers.
+
+    rates is a (tokens, tokens) array where [i, j] is the amount of token j (in wei) per wei of token i,
+    see PriceSnapshot.get_rate_matrix.
+
+    price_multipliers is a (scenarios, tokens) array of multipliers to the price of each token,
+    e.g. 0.85 for a token that drops 15%.
+    """
+    price_multipliers = np.atleast_2d(price_multipliers)
+    loan_index = loan_book.loan_token_index
+    collateral_index = loan_book.collateral_token_index
+    # (scenarios, loans)
+    collateral_to_loan_rate = (
+        rates[collateral_index, loan_index]
+        * price_multipliers[:, collateral_index]
+        / price_multipliers[:, loan_index]
+    )
+    # The simulation itself is approximate, so float64 is exact enough for the amounts
+    principal = amounts_to_float(loan_book.principal)
+    collateral = amounts_to_float(loan_book.collateral)
+    maintenance_margin = loan_book.maintenance_margin
+
+    collateral_in_loan_token = collateral * collateral_to_loan_rate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        current_margin = np.where(
+            (principal > 0) & (collateral_in_loan_token >= principal),
+            (collateral_in_loan_token - principal) * 100 / principal,
+            0.0,
+        )
+        liquidatable = (current_margin <= maintenance_margin) & (collateral_to_loan_rate > 0)
+
+        desired_margin = maintenance_margin + LIQUIDATION_TARGET_MARGIN_BUFFER
+        max_liquidatable = (
+            (desired_margin + 100) * principal / 100 - collateral_in_loan_token
+        ) * 100 / (desired_margin - liquidation_incentive_percent)
+        max_liquidatable = np.clip(max_liquidatable, 0, principal)
+        max_seizable = max_liquidatable * (liquidation_incentive_percent + 100) / 100 / collateral_to_loan_rate
+        max_seizable = np.minimum(max_seizable, collateral)
+
+    # Fully underwater loans are liquidated in whole
+    underwater = current_margin <= liquidation_incentive_percent
+    max_liquidatable = np.where(underwater, principal, max_liquidatable)
+    max_seizable = np.where(underwater, collateral, max_seizable)
+
+    return ShockSimulationResult(
+        price_multipliers=price_multipliers,
+        current_margin=current_margin,
+        liquidatable=liquidatable,
+        max_liquidatable=np.where(liquidatable, max_liquidatable, 0.0),
+        max_seizable=np.where(liquidatable, max_seizable, 0.0),
+    )
+
+
+def get_price_multipliers(*, num_tokens: int, token_index: int, shock_percentages: Sequence[float]) -> np.ndarray:
+    price_multipliers = np.ones((len(shock_percentages), num_tokens))
+    price_multipliers[:, token_index] = 1 + np.asarray(shock_percentages) / 100
+    return price_multipliers
+
+
+def parse_shocks(s: str) -> List[float]:
+    return [float(p) for p in s.split(',') if p.strip()]
+
+
+def main():
+    parser = ArgumentParser(description="Simulate liquidatable loans under price shocks of a token")
+    parser.add_argument('--token', help='symbol or address of the token whose price is shocked', default='WRBTC')
+    parser.add_argument(
+        '--shocks',
+        help='comma-separated price changes in percentages (e.g. -30,-20,-10,0)',
+        type=parse_shocks,
+        default=parse_shocks('-50,-40,-30,-25,-20,-15,-10,-5,0'),
+    )
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    sovryn_protocol = web3.eth.contract(
+        address=SOVRYN_PROTOCOL_ADDRESS,
+        abi=load_abi('loans/SovrynProtocol')
+    )
+    block_number = web3.eth.block_number
+    price_feeds = web3.eth.contract(
+        address=sovryn_protocol.functions.priceFeeds().call(block_identifier=block_number),
+        abi=load_abi('price_feed/PriceFeeds'),
+    )
+    liquidation_incentive_percent = sovryn_protocol.functions.liquidationIncentivePercent().call(
+        block_identifier=block_number
+    ) / 10 ** 18
+
+    loan_book = LoanBook.from_loans(load_active_loans(
+        sovryn_protocol=sovryn_protocol,
+        block_identifier=block_number,
+    ))
+    tokens = get_token_registry(web3).get_many(loan_book.token_addresses)
+    token_index = None
+    for i, address in enumerate(loan_book.token_addresses):
+        if args.token.lower() in (address.lower(), tokens[address].symbol.lower()):
+            token_index = i
+    if token_index is None:
+        raise LookupError(f'Token {args.token!r} not used by any active loan')
+
+    price_snapshot = PriceSnapshotStore(price_feeds).get(loan_book.token_addresses, block_number)
+    rates = price_snapshot.get_rate_matrix(loan_book.token_addresses)
+    result = simulate_price_shocks(
+        loan_book=loan_book,
+        rates=rates,
+        price_multipliers=get_price_multipliers(
+            num_tokens=loan_book.num_tokens,
+            token_index=token_index,
+            shock_percentages=args.shocks,
+        ),
+        liquidation_incentive_percent=liquidation_incentive_percent,
+    )
+    max_seizable_by_token = result.sum_by_token(
+        result.max_seizable,
+        loan_book.collateral_token_index,
+        loan_book.num_tokens,
+    )
+    num_liquidatable = result.num_liquidatable()
+
+    shocked_token = tokens[loan_book.token_addresses[token_index]]
+    print(f"Block {block_number}, {len(loan_book)} active loans, shocking {shocked_token.symbol}")
+    for shock, scenario_num_liquidatable, scenario_max_seizable in zip(
+        args.shocks, num_liquidatable, max_seizable_by_token
+    ):
+        print(f"{shocked_token.symbol} {shock:+.1f}%: {scenario_num_liquidatable} loans liquidatable")
+        for address, amount_wei in zip(loan_book.token_addresses, scenario_max_seizable):
+            if amount_wei > 0:
+                token = tokens[address]
+                print(f'    Max seizable {token.symbol:10} {amount_wei / 10 ** token.decimals:20.6f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Columnar representation of the active loans of the protocol, for fast aggregation with NumPy.
+
+Amounts are kept exact without Python objects: each wei amount is split into two int64 halves,
+[amount >> 32, amount & 0xffffffff], stored as an (n, 2) array. Grouped totals sum each half with NumPy
+and are combined to Python ints only once per token. Margins and rates are only used for comparisons and
+statistics, so they are stored as float64. Token addresses are stored as indexes to the token table.
+"""
+from dataclasses import dataclass, fields
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from loans import Loan
+
+# Amounts are split into a high and a low half at this bit
+AMOUNT_SHIFT = 32
+AMOUNT_LOW_MASK = (1 << AMOUNT_SHIFT) - 1
+# Largest amount (exclusive) whose high half fits in int64
+MAX_AMOUNT = 1 << (63 + AMOUNT_SHIFT)
+
+
+@dataclass
+class LoanBook:
+    token_addresses: List[str]
+    loan_ids: np.ndarray  # S32 (raw bytes of loan id)
+    loan_token_index: np.ndarray  # int32
+    collateral_token_index: np.ndarray  # int32
+    principal: np.ndarray  # (loans, 2) int64, wei split in halves
+    collateral: np.ndarray  # (loans, 2) int64, wei split in halves
+    interest_owed_per_day: np.ndarray  # (loans, 2) int64, wei split in halves
+    interest_deposit_remaining: np.ndarray  # (loans, 2) int64, wei split in halves
+    start_rate: np.ndarray  # float64
+    start_margin: np.ndarray  # float64, percentage
+    maintenance_margin: np.ndarray  # float64, percentage
+    current_margin: np.ndarray  # float64, percentage
+    end_timestamp: np.ndarray  # int64
+    max_liquidatable: np.ndarray  # (loans, 2) int64, wei split in halves
+    max_seizable: np.ndarray  # (loans, 2) int64, wei split in halves
+
+    @classmethod
+    def from_loans(cls, loans: Sequence[Loan]) -> 'LoanBook':
+        token_addresses = sorted(
+            set(loan.loan_token_address for loan in loans) | set(loan.collateral_token_address for loan in loans)
+        )
+        token_index_by_address = {address: i for i, address in enumerate(token_addresses)}
+
+        def amounts(values) -> np.ndarray:
+            return split_amounts(values, count=len(loans))
+
+        def decimals(values) -> np.ndarray:
+            # Loan stores these as on-chain value / 10**18
+            return np.fromiter((float(v) for v in values), dtype=np.float64, count=len(loans))
+
+        return cls(
+            token_addresses=token_addresses,
+            loan_ids=np.array([bytes.fromhex(loan.loan_id[2:]) for loan in loans], dtype='S32'),
+            loan_token_index=np.fromiter(
+                (token_index_by_address[loan.loan_token_address] for loan in loans),
+                dtype=np.int32,
+                count=len(loans),
+            ),
+            collateral_token_index=np.fromiter(
+                (token_index_by_address[loan.collateral_token_address] for loan in loans),
+                dtype=np.int32,
+                count=len(loans),
+            ),
+            principal=amounts(loan.principal_wei for loan in loans),
+            collateral=amounts(loan.collateral_wei for loan in loans),
+            interest_owed_per_day=amounts(loan.interest_owed_per_day_wei for loan in loans),
+            interest_deposit_remaining=amounts(loan.interest_deposit_remaining_wei for loan in loans),
+            start_rate=decimals(loan.start_rate for loan in loans),
+            start_margin=decimals(loan.start_margin for loan in loans),
+            maintenance_margin=decimals(loan.maintenance_margin for loan in loans),
+            current_margin=decimals(loan.current_margin for loan in loans),
+            end_timestamp=np.fromiter((loan.end_timestamp for loan in loans), dtype=np.int64, count=len(loans)),
+            max_liquidatable=amounts(loan.max_liquidatable_wei for loan in loans),
+            max_seizable=amounts(loan.max_seizable_wei for loan in loans),
+        )
+
+    def save(self, path: str):
+        data = {f.name: getattr(self, f.name) for f in fields(self)}
+        data['token_addresses'] = np.array(self.token_addresses, dtype='U42')
+        np.savez_compressed(path, **data)
+
+    @classmethod
+    def load(cls, path: str) -> 'LoanBook':
+        with np.load(path) as data:
+            kwargs = {f.name: data[f.name] for f in fields(cls)}
+        kwargs['token_addresses'] = kwargs['token_addresses'].tolist()
+        return cls(**kwargs)
+
+    def __len__(self) -> int:
+        return len(self.loan_ids)
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.token_addresses)
+
+    def liquidatable_mask(self) -> np.ndarray:
+        return np.any(self.max_seizable > 0, axis=1)
+
+    def num_liquidatable(self) -> int:
+        return int(np.count_nonzero(self.liquidatable_mask()))
+
+    def sum_by_token(self, values: np.ndarray, token_index: np.ndarray) -> np.ndarray:
+        """Sum split wei amounts grouped by token index. Returns a (tokens, 2) array of split totals"""
+        # The high halves are < 2**63 each, but their sum may not be. Check it with (exact enough) float sums,
+        # leaving a factor of 2 for the rounding errors, before summing them in int64.
+        high_float_totals = np.bincount(token_index, weights=values[:, 0], minlength=self.num_tokens)
+        if np.any(high_float_totals >= 2.0 ** 62):
+            raise OverflowError('Total amount of a token too large for the split int64 representation')
+        totals = np.zeros((self.num_tokens, 2), dtype=np.int64)
+        np.add.at(totals, token_index, values)
+        # Carry the overflow of the low halves (at most one bit per loan) to the high halves
+        totals[:, 0] += totals[:, 1] >> AMOUNT_SHIFT
+        totals[:, 1] &= AMOUNT_LOW_MASK
+        return totals
+
+    def count_by_token(self, token_index: np.ndarray, mask: np.ndarray = None) -> np.ndarray:
+        if mask is not None:
+            token_index = token_index[mask]
+        return np.bincount(token_index, minlength=self.num_tokens)
+
+    def max_liquidatable_by_loan_token(self) -> Dict[str, int]:
+        """Total max liquidatable amount (in wei) by loan token address"""
+        return self.to_wei_by_token(self.sum_by_token(self.max_liquidatable, self.loan_token_index))
+
+    def max_seizable_by_collateral_token(self) -> Dict[str, int]:
+        """Total max seizable amount (in wei) by collateral token address"""
+        return self.to_wei_by_token(self.sum_by_token(self.max_seizable, self.collateral_token_index))
+
+    def margin_histogram(self, bins: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Histogram of the current margins. Bins are given in percentages, e.g. [0, 10, 20, 50]"""
+        return np.histogram(self.current_margin, bins=bins)
+
+    def to_wei_by_token(self, totals: np.ndarray) -> Dict[str, int]:
+        return {
+            address: combine_amount(total)
+            for address, total in zip(self.token_addresses, totals)
+        }
+
+
+def split_amounts(values: Iterable[int], *, count: int) -> np.ndarray:
+    """Split non-negative wei amounts into an (n, 2) int64 array of [high, low] halves"""
+    values = [int(value) for value in values]
+    if values and not (min(values) >= 0 and max(values) < MAX_AMOUNT):
+        raise OverflowError('Amount out of range for the split int64 representation')
+    ret = np.empty((count, 2), dtype=np.int64)
+    ret[:, 0] = np.fromiter((value >> AMOUNT_SHIFT for value in values), dtype=np.int64, count=count)
+    ret[:, 1] = np.fromiter((value & AMOUNT_LOW_MASK for value in values), dtype=np.int64, count=count)
+    return ret
+
+
+def combine_amount(split_amount: np.ndarray) -> int:
+    """Exact Python int of one split amount"""
+    return (int(split_amount[0]) << AMOUNT_SHIFT) + int(split_amount[1])
+
+
+def amounts_to_float(split_amounts: np.ndarray) -> np.ndarray:
+    """Approximate float64 values of split amounts, for statistics and simulations"""
+    return split_amounts[..., 0] * float(1 << AMOUNT_SHIFT) + split_amounts[..., 1]
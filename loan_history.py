@@ -0,0 +1,226 @@
+"""
+Sample the loan book of the protocol at many historical blocks (e.g. one per day) from an archive node.
+
+The samples are loaded concurrently and each (immutable) snapshot is cached on disk, so only new
+samples are ever fetched. The result is a compact columnar history of principal, collateral and
+margin by token, written as .npz (and optionally as CSV).
+
+Run like this:
+
+    python loan_history.py --chain rsk_mainnet_local --start 2022-01-01 --end 2022-06-30 -o history.npz
+"""
+import csv
+import json
+import logging
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Sequence
+
+import numpy as np
+
+from constants import SOVRYN_PROTOCOL_ADDRESS
+from loan_book import LoanBook, amounts_to_float, combine_amount
+from loans import load_active_loans
+from tokens import get_token_registry
+from utils import enable_logging, get_cache_path, get_closest_block, get_web3, load_abi, utcnow, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LoanHistory:
+    block_numbers: np.ndarray  # (samples,) int64
+    timestamps: np.ndarray  # (samples,) int64
+    token_addresses: List[str]
+    num_loans: np.ndarray  # (samples, tokens) int64, by loan token
+    principal: np.ndarray  # (samples, tokens, 2) int64, wei split in halves (see loan_book), by loan token
+    collateral: np.ndarray  # (samples, tokens, 2) int64, wei split in halves, by collateral token
+    mean_margin: np.ndarray  # (samples, tokens) float64, principal-weighted percentage, by loan token
+    num_liquidatable: np.ndarray  # (samples,) int64
+
+    @classmethod
+    def from_loan_books(
+        cls,
+        *,
+        block_numbers: Sequence[int],
+        timestamps: Sequence[int],
+        loan_books: Sequence[LoanBook],
+    ) -> 'LoanHistory':
+        token_addresses = sorted(set(a for loan_book in loan_books for a in loan_book.token_addresses))
+        token_index_by_address = {address: i for i, address in enumerate(token_addresses)}
+        shape = (len(loan_books), len(token_addresses))
+        num_loans = np.zeros(shape, dtype=np.int64)
+        principal = np.zeros(shape + (2,), dtype=np.int64)
+        collateral = np.zeros(shape + (2,), dtype=np.int64)
+        weighted_margin = np.zeros(shape)
+        for i, loan_book in enumerate(loan_books):
+            # Map the token indexes of this loan book to the common token table
+            columns = np.array([token_index_by_address[a] for a in loan_book.token_addresses], dtype=np.int64)
+            num_loans[i, columns] = loan_book.count_by_token(loan_book.loan_token_index)
+            principal[i, columns] = loan_book.sum_by_token(loan_book.principal, loan_book.loan_token_index)
+            collateral[i, columns] = loan_book.sum_by_token(loan_book.collateral, loan_book.collateral_token_index)
+            np.add.at(
+                weighted_margin[i],
+                columns[loan_book.loan_token_index],
+                loan_book.current_margin * amounts_to_float(loan_book.principal),
+            )
+        principal_float = amounts_to_float(principal)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_margin = np.where(principal_float > 0, weighted_margin / principal_float, np.nan)
+        return cls(
+            block_numbers=np.asarray(block_numbers, dtype=np.int64),
+            timestamps=np.asarray(timestamps, dtype=np.int64),
+            token_addresses=token_addresses,
+            num_loans=num_loans,
+            principal=principal,
+            collateral=collateral,
+            mean_margin=mean_margin,
+            num_liquidatable=np.array([loan_book.num_liquidatable() for loan_book in loan_books], dtype=np.int64),
+        )
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            block_numbers=self.block_numbers,
+            timestamps=self.timestamps,
+            token_addresses=np.array(self.token_addresses, dtype='U42'),
+            num_loans=self.num_loans,
+            principal=self.principal,
+            collateral=self.collateral,
+            mean_margin=self.mean_margin,
+            num_liquidatable=self.num_liquidatable,
+        )
+
+
+def get_sample_blocks(web3, sample_datetimes: Sequence[datetime], *, max_workers: int = 8) -> List[dict]:
+    """Resolve the closest block for each datetime concurrently, caching the resolved blocks on disk"""
+    cache_path = get_cache_path('closest_blocks', f'{web3.eth.chain_id}.json')
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    def get_sample_block(sample_datetime: datetime) -> dict:
+        key = sample_datetime.isoformat()
+        if key not in cache:
+            block = get_closest_block(web3, sample_datetime)
+            cache[key] = {'number': block['number'], 'timestamp': block['timestamp']}
+        return cache[key]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        blocks = list(executor.map(get_sample_block, sample_datetimes))
+    write_json_atomic(cache_path, cache)
+    return blocks
+
+
+def load_loan_book_at(*, sovryn_protocol, block_number: int, chain_id: int, max_workers: int = 4) -> LoanBook:
+    cache_path = get_cache_path('loan_books', str(chain_id), f'{block_number}.npz')
+    if os.path.exists(cache_path):
+        return LoanBook.load(cache_path)
+    logger.info('loading loan book at block %s', block_number)
+    loan_book = LoanBook.from_loans(load_active_loans(
+        sovryn_protocol=sovryn_protocol,
+        block_identifier=block_number,
+        max_workers=max_workers,
+    ))
+    tmp_path = f'{cache_path}.tmp.npz'
+    loan_book.save(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return loan_book
+
+
+def load_loan_history(
+    *,
+    sovryn_protocol,
+    sample_datetimes: Sequence[datetime],
+    max_workers: int = 8,
+) -> LoanHistory:
+    chain_id = sovryn_protocol.web3.eth.chain_id
+    blocks = get_sample_blocks(sovryn_protocol.web3, sample_datetimes, max_workers=max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        loan_books = list(executor.map(
+            lambda block: load_loan_book_at(
+                sovryn_protocol=sovryn_protocol,
+                block_number=block['number'],
+                chain_id=chain_id,
+            ),
+            blocks,
+        ))
+    return LoanHistory.from_loan_books(
+        block_numbers=[block['number'] for block in blocks],
+        timestamps=[block['timestamp'] for block in blocks],
+        loan_books=loan_books,
+    )
+
+
+def parse_date(s: str) -> datetime:
+    return datetime.strptime(s, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+
+def main():
+    parser = ArgumentParser(description="Sample the loan book of the protocol at historical blocks")
+    parser.add_argument('--chain', help='chain name (use an archive node)', default='rsk_mainnet')
+    parser.add_argument('--start', help='first sample date (YYYY-MM-DD)', type=parse_date, required=True)
+    parser.add_argument('--end', help='last sample date (YYYY-MM-DD), defaults to today', type=parse_date)
+    parser.add_argument('--interval-days', help='days between samples', type=int, default=1)
+    parser.add_argument('--max-workers', help='number of samples to load concurrently', type=int, default=8)
+    parser.add_argument('-o', '--outfile', help='path of .npz file to write the history to')
+    parser.add_argument('--csv-outfile', help='path of CSV file to write the history to')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    sovryn_protocol = web3.eth.contract(
+        address=SOVRYN_PROTOCOL_ADDRESS,
+        abi=load_abi('loans/SovrynProtocol')
+    )
+    end = args.end or utcnow()
+    sample_datetimes = []
+    sample_datetime = args.start
+    while sample_datetime <= end:
+        sample_datetimes.append(sample_datetime)
+        sample_datetime += timedelta(days=args.interval_days)
+    print(f"Loading {len(sample_datetimes)} samples from {args.start} to {end}")
+
+    history = load_loan_history(
+        sovryn_protocol=sovryn_protocol,
+        sample_datetimes=sample_datetimes,
+        max_workers=args.max_workers,
+    )
+    tokens = get_token_registry(web3).get_many(history.token_addresses)
+
+    rows = []
+    for i, (block_number, timestamp) in enumerate(zip(history.block_numbers, history.timestamps)):
+        date = datetime.fromtimestamp(int(timestamp), timezone.utc).date().isoformat()
+        for j, address in enumerate(history.token_addresses):
+            token = tokens[address]
+            rows.append({
+                'date': date,
+                'block_number': int(block_number),
+                'token': token.symbol,
+                'num_loans': int(history.num_loans[i, j]),
+                'principal': token.to_decimal(combine_amount(history.principal[i, j])),
+                'collateral': token.to_decimal(combine_amount(history.collateral[i, j])),
+                'mean_margin': float(history.mean_margin[i, j]),
+            })
+        print(f"{date} (block {block_number}): {int(history.num_liquidatable[i])} loans liquidatable")
+
+    if args.outfile:
+        print(f"Writing history to {args.outfile}")
+        history.save(args.outfile)
+    if args.csv_outfile:
+        print(f"Writing history in CSV form to {args.csv_outfile}")
+        with open(args.csv_outfile, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=list(rows[0].keys()) if rows else [])
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
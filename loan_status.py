@@ -1,47 +1,92 @@
-from collections import defaultdict
-from decimal import Decimal
+import logging
+from argparse import ArgumentParser
 from pprint import pprint
 from dataclasses import asdict
-from utils import get_web3, load_abi, enable_logging, get_erc20_contract
+from web3.exceptions import BadFunctionCallOutput
+from utils import get_web3, load_abi, enable_logging
 from constants import SOVRYN_PROTOCOL_ADDRESS
-from loans import load_active_loans
+from loan_book import LoanBook
+from loans import count_active_loans, load_active_loans
+from tokens import get_token_registry
+
+logger = logging.getLogger(__name__)
 
 
 def main():
+    parser = ArgumentParser(description="Show liquidation summary of active loans")
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument('--full', action='store_true', default=False,
+                            help='load all active loans instead of only the unsafe ones')
+    mode_group.add_argument('--cross-check', action='store_true', default=False,
+                            help='load only the unsafe loans, but check the result against all active loans')
+    args = parser.parse_args()
+
     web3 = get_web3('rsk_mainnet')
     sovryn_protocol = web3.eth.contract(
         address=SOVRYN_PROTOCOL_ADDRESS,
         abi=load_abi('loans/SovrynProtocol')
     )
 
-    loans = load_active_loans(
-        sovryn_protocol=sovryn_protocol
+    block_number = web3.eth.block_number
+    num_loans = count_active_loans(
+        sovryn_protocol=sovryn_protocol,
+        block_identifier=block_number,
     )
-
-    num_liquidatable = 0
-    token_addresses = set()
-    max_liquidatable = defaultdict(int)
-    max_seizable = defaultdict(int)
-    for loan in loans:
-        if loan.max_seizable_wei:
-            num_liquidatable += 1
-        max_liquidatable[loan.loan_token_address] += loan.max_liquidatable_wei
-        max_seizable[loan.collateral_token_address] += loan.max_seizable_wei
-        token_addresses |= {loan.loan_token_address, loan.collateral_token_address}
-
-    for token_address in token_addresses:
-        token = get_erc20_contract(
-            token_address=token_address,
-            web3=web3,
+    cross_check = args.cross_check
+    if args.full:
+        loans = load_active_loans(
+            sovryn_protocol=sovryn_protocol,
+            block_identifier=block_number,
+            num_loans=num_loans,
         )
-        print(f'{token.functions.name().call()} ({token.functions.symbol().call()})')
-        decimals = token.functions.decimals().call()
-        max_liquidatable_decimal = Decimal(max_liquidatable[token_address]) / 10**decimals
-        max_seizable_decimal = Decimal(max_seizable[token_address]) / 10**decimals
+    else:
+        try:
+            loans = load_active_loans(
+                sovryn_protocol=sovryn_protocol,
+                block_identifier=block_number,
+                num_loans=num_loans,
+                unsafe_only=True,
+            )
+        except (ValueError, BadFunctionCallOutput) as e:
+            # Reverted calls and JSON-RPC errors raise ValueError, undecodable results BadFunctionCallOutput
+            logger.warning('Loading unsafe loans failed, falling back to loading all loans: %s', e)
+            cross_check = False
+            loans = load_active_loans(
+                sovryn_protocol=sovryn_protocol,
+                block_identifier=block_number,
+                num_loans=num_loans,
+            )
+        if cross_check:
+            all_loans = load_active_loans(
+                sovryn_protocol=sovryn_protocol,
+                block_identifier=block_number,
+                num_loans=num_loans,
+            )
+            unsafe_loan_ids = set(loan.loan_id for loan in loans)
+            expected_unsafe_loan_ids = set(loan.loan_id for loan in all_loans if loan.max_liquidatable_wei)
+            if unsafe_loan_ids == expected_unsafe_loan_ids:
+                print("Cross-check OK: unsafe loans match the liquidatable loans of all loans")
+            else:
+                print("Cross-check FAILED, using all loans instead")
+                print("Unsafe loans not liquidatable:", sorted(unsafe_loan_ids - expected_unsafe_loan_ids))
+                print("Liquidatable loans not unsafe:", sorted(expected_unsafe_loan_ids - unsafe_loan_ids))
+                loans = all_loans
+
+    loan_book = LoanBook.from_loans(loans)
+    num_liquidatable = loan_book.num_liquidatable()
+    max_liquidatable = loan_book.max_liquidatable_by_loan_token()
+    max_seizable = loan_book.max_seizable_by_collateral_token()
+
+    tokens = get_token_registry(web3).get_many(loan_book.token_addresses)
+    for token_address in loan_book.token_addresses:
+        token = tokens[token_address]
+        print(f'{token.name} ({token.symbol})')
+        max_liquidatable_decimal = token.to_decimal(max_liquidatable[token_address])
+        max_seizable_decimal = token.to_decimal(max_seizable[token_address])
         print(f'Max liquidatable: {max_liquidatable_decimal:20.6f}')
         print(f'Max seizable:     {max_seizable_decimal:20.6f}')
         print('')
-    print("Total", num_liquidatable, "loans liquidatable (out of", len(loans), "loans in total)")
+    print("Total", num_liquidatable, "loans liquidatable (out of", num_loans, "loans in total)")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,195 @@
+"""
+Track the active loans of the protocol incrementally, to find liquidation candidates quickly.
+
+The loan book is loaded once, after which it's kept up to date block by block:
+
+- Loans touched by Borrow, Trade, Liquidate, CloseWithSwap, CloseWithDeposit and LoanSwap events are re-queried
+  with getLoan
+- A PriceFeeds rate snapshot of the tokens in use is fetched every block (in one batch). When a rate changes,
+  the margins of the loans of that pair are recomputed locally, and only the loans that become unsafe (or stop
+  being unsafe) are re-queried. ExternalSwap events mark the rates of their tokens as changed too.
+
+Run like this:
+
+    python loan_tracker.py --poll-interval 10
+"""
+import logging
+import time
+from argparse import ArgumentParser
+from typing import Dict, Iterable, List, Set
+
+from eth_utils import to_bytes
+
+from constants import SOVRYN_PROTOCOL_ADDRESS
+from loans import Loan, load_active_loans
+from price_snapshot import PriceSnapshot, PriceSnapshotStore
+from utils import batch_call, enable_logging, get_contract_events, get_web3, load_abi
+
+logger = logging.getLogger(__name__)
+
+LOAN_EVENT_NAMES = [
+    'Borrow',
+    'Trade',
+    'Liquidate',
+    'CloseWithSwap',
+    'CloseWithDeposit',
+    'LoanSwap',
+    'ExternalSwap',
+]
+
+
+class LoanTracker:
+    def __init__(self, *, sovryn_protocol, price_feeds):
+        self.sovryn_protocol = sovryn_protocol
+        self.price_feeds = price_feeds
+        self.price_snapshots = PriceSnapshotStore(price_feeds)
+        self.web3 = sovryn_protocol.web3
+        self.block_number = None
+        self.loans: Dict[str, Loan] = {}
+        self.price_snapshot: PriceSnapshot = None
+
+    def initialize(self, block_number: int = None):
+        if block_number is None:
+            block_number = self.web3.eth.block_number
+        loans = load_active_loans(
+            sovryn_protocol=self.sovryn_protocol,
+            block_identifier=block_number,
+        )
+        self.loans = {loan.loan_id: loan for loan in loans}
+        self.price_snapshot = self.price_snapshots.get(self._get_tokens(), block_number)
+        self.block_number = block_number
+        logger.info('initialized with %s loans at block %s', len(self.loans), block_number)
+
+    def update(self, to_block: int = None) -> Set[str]:
+        """Update the loan book to to_block (latest by default). Returns the ids of the updated loans."""
+        if to_block is None:
+            to_block = self.web3.eth.block_number
+        if to_block <= self.block_number:
+            return set()
+
+        events = get_contract_events(
+            contract=self.sovryn_protocol,
+            event_names=LOAN_EVENT_NAMES,
+            from_block=self.block_number + 1,
+            to_block=to_block,
+        )
+        touched_loan_ids = set()
+        swapped_tokens = set()
+        for event in events:
+            if event.event == 'ExternalSwap':
+                swapped_tokens |= {event.args.sourceToken, event.args.destToken}
+            else:
+                touched_loan_ids.add('0x' + event.args.loanId.hex())
+
+        previous_price_snapshot = self.price_snapshot
+        self.price_snapshot = self.price_snapshots.get(self._get_tokens(), to_block)
+        for loan in self.loans.values():
+            pair = (loan.collateral_token_address, loan.loan_token_address)
+            if loan.loan_id in touched_loan_ids:
+                continue
+            rate_changed = (
+                not previous_price_snapshot.has_pair(*pair)
+                or previous_price_snapshot.get_raw_rate(*pair) != self.price_snapshot.get_raw_rate(*pair)
+                or swapped_tokens.intersection(pair)
+            )
+            if not rate_changed:
+                continue
+            try:
+                current_margin = self._get_current_margin(loan)
+            except LookupError as e:
+                logger.warning('cannot check the margin of loan %s: %s', loan.loan_id, e)
+                continue
+            is_unsafe = current_margin <= int(loan.maintenance_margin * 10 ** 18)
+            if is_unsafe or loan.max_seizable_wei > 0:
+                touched_loan_ids.add(loan.loan_id)
+
+        self._refresh_loans(touched_loan_ids, to_block)
+        self.block_number = to_block
+        return touched_loan_ids
+
+    def get_liquidatable_loans(self) -> List[Loan]:
+        return [loan for loan in self.loans.values() if loan.max_seizable_wei > 0]
+
+    def _refresh_loans(self, loan_ids: Iterable[str], block_number: int):
+        loan_ids = sorted(loan_ids)
+        if not loan_ids:
+            return
+        logger.info('re-querying %s loans at block %s', len(loan_ids), block_number)
+        results = batch_call(
+            self.web3,
+            [self.sovryn_protocol.functions.getLoan(to_bytes(hexstr=loan_id)) for loan_id in loan_ids],
+            block_identifier=block_number,
+        )
+        for loan_id, raw in zip(loan_ids, results):
+            loan = Loan.from_raw(raw)
+            if loan.principal_wei == 0:
+                # Closed
+                self.loans.pop(loan_id, None)
+                continue
+            # Use the requested id as the key, getLoan returns an empty id for unknown loans
+            loan.loan_id = loan_id
+            self.loans[loan_id] = loan
+        # Only fetches the rates of new tokens, if any
+        self.price_snapshot = self.price_snapshots.get(self._get_tokens(), block_number)
+
+    def _get_tokens(self) -> Set[str]:
+        return set(
+            token
+            for loan in self.loans.values()
+            for token in (loan.collateral_token_address, loan.loan_token_address)
+        )
+
+    def _get_current_margin(self, loan: Loan) -> int:
+        """Current margin of the loan with the latest rates, scaled by 10**18 like PriceFeeds.getCurrentMargin"""
+        collateral_to_loan_amount = self.price_snapshot.convert(
+            loan.collateral_token_address,
+            loan.loan_token_address,
+            loan.collateral_wei,
+        )
+        if loan.principal_wei == 0 or collateral_to_loan_amount < loan.principal_wei:
+            return 0
+        return (collateral_to_loan_amount - loan.principal_wei) * 10 ** 20 // loan.principal_wei
+
+
+def main():
+    parser = ArgumentParser(description="Track active loans and show liquidation candidates as they appear")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--poll-interval', help='seconds between polls for new blocks', type=float, default=10)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    sovryn_protocol = web3.eth.contract(
+        address=SOVRYN_PROTOCOL_ADDRESS,
+        abi=load_abi('loans/SovrynProtocol')
+    )
+    price_feeds = web3.eth.contract(
+        address=sovryn_protocol.functions.priceFeeds().call(),
+        abi=load_abi('price_feed/PriceFeeds'),
+    )
+    tracker = LoanTracker(sovryn_protocol=sovryn_protocol, price_feeds=price_feeds)
+    tracker.initialize()
+    liquidatable_loan_ids = set()
+    while True:
+        tracker.update()
+        liquidatable_loans = tracker.get_liquidatable_loans()
+        for loan in liquidatable_loans:
+            if loan.loan_id not in liquidatable_loan_ids:
+                print(
+                    f"Block {tracker.block_number}: loan {loan.loan_id} is liquidatable "
+                    f"(margin {loan.current_margin:.2f}% <= {loan.maintenance_margin:.2f}%, "
+                    f"max liquidatable {loan.max_liquidatable_wei} wei of {loan.loan_token_address}, "
+                    f"max seizable {loan.max_seizable_wei} wei of {loan.collateral_token_address})"
+                )
+        new_liquidatable_loan_ids = set(loan.loan_id for loan in liquidatable_loans)
+        for loan_id in liquidatable_loan_ids - new_liquidatable_loan_ids:
+            print(f"Block {tracker.block_number}: loan {loan_id} is no longer liquidatable")
+        liquidatable_loan_ids = new_liquidatable_loan_ids
+        time.sleep(args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
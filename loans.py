@@ -1,10 +1,13 @@
 import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from decimal import Decimal
-from typing import List
+from typing import Dict, List
 
 from eth_utils import to_hex
 
+from utils import batch_call
+
 
 logger = logging.getLogger(__name__)
 
@@ -49,25 +52,108 @@ class Loan:
         )
 
 
-def load_active_loans(*, sovryn_protocol, block_identifier='latest') -> List[Loan]:
-    start = 0
-    count = 250
-    raw_loans = []
-    while True:
-        end = start + count
-        logger.info(f"Fetching active loans (batch: {start}-{end - 1})")
-        batch = sovryn_protocol.functions.getActiveLoans(
-            start,
-            count,
-            False
-        ).call(block_identifier=block_identifier)
-        logger.info(f"Got {len(batch)} loans in batch")
-        raw_loans.extend(batch)
-        if len(batch) < count:
-            break
-        start += count
-    logger.info(f"Got {len(raw_loans)} loans in total")
-    return [
-        Loan.from_raw(raw)
-        for raw in raw_loans
+def load_active_loans(
+    *,
+    sovryn_protocol,
+    block_identifier='latest',
+    unsafe_only: bool = False,
+    num_loans: int = None,
+    page_size: int = 250,
+    max_workers: int = 8,
+) -> List[Loan]:
+    """
+    Load all active loans from the protocol, or only the unsafe (liquidatable) ones if unsafe_only is True.
+
+    The number of active loans is determined first (unless given as num_loans), after which the pages are
+    fetched concurrently (all pinned to the same block) and decoded as they arrive. Pages that fail to load
+    (e.g. because of the gas limit of eth_call) are split in half and retried.
+
+    With unsafe_only, the protocol filters out the safe loans of each page, so only the unsafe loans
+    are transferred and decoded.
+    """
+    if block_identifier == 'latest':
+        # Pin all calls to the same block so that the pages are consistent
+        block_identifier = sovryn_protocol.web3.eth.block_number
+    if num_loans is None:
+        num_loans = count_active_loans(
+            sovryn_protocol=sovryn_protocol,
+            block_identifier=block_identifier,
+        )
+        logger.info(f"Found {num_loans} active loans at block {block_identifier}")
+    if num_loans == 0:
+        return []
+
+    # Spread the loans evenly over the workers, but don't exceed page_size
+    page_size = max(1, min(page_size, -(-num_loans // max_workers)))
+    loans_by_start: Dict[int, List[Loan]] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(start: int, count: int):
+            logger.info(f"Fetching active loans (batch: {start}-{start + count - 1})")
+            future = executor.submit(
+                sovryn_protocol.functions.getActiveLoans(start, count, unsafe_only).call,
+                block_identifier=block_identifier,
+            )
+            pending[future] = (start, count)
+
+        pending = {}
+        for start in range(0, num_loans, page_size):
+            submit(start, min(page_size, num_loans - start))
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, count = pending.pop(future)
+                try:
+                    batch = future.result()
+                except Exception as e:
+                    if count == 1:
+                        raise
+                    logger.warning(f"Error fetching batch {start}-{start + count - 1}, splitting it: {e}")
+                    half = count // 2
+                    submit(start, half)
+                    submit(start + half, count - half)
+                    continue
+                logger.info(f"Got {len(batch)} loans in batch {start}-{start + count - 1}")
+                loans_by_start[start] = [Loan.from_raw(raw) for raw in batch]
+
+    loans = [
+        loan
+        for start in sorted(loans_by_start.keys())
+        for loan in loans_by_start[start]
     ]
+    logger.info(f"Got {len(loans)} loans in total")
+    return loans
+
+
+def count_active_loans(*, sovryn_protocol, block_identifier='latest', probes_per_round: int = 64) -> int:
+    """
+    Count the active loans of the protocol.
+
+    The protocol doesn't expose the count, so it's searched for by probing getActiveLoans(index, 1)
+    at many indexes at once in a single batch request per round.
+    """
+    # Invariant: the loan at index `present` exists (or present is -1) and the loan at index `missing` doesn't
+    present = -1
+    missing = None
+    # First round: exponentially spaced probes to find an upper bound
+    probe_indexes = [2 ** i - 1 for i in range(48)]
+    while missing is None or missing - present > 1:
+        results = batch_call(
+            sovryn_protocol.web3,
+            [
+                sovryn_protocol.functions.getActiveLoans(index, 1, False)
+                for index in probe_indexes
+            ],
+            block_identifier=block_identifier,
+        )
+        for index, result in zip(probe_indexes, results):
+            if result:
+                present = max(present, index)
+            elif missing is None or index < missing:
+                missing = index
+        if missing is None:
+            raise ValueError('Unable to find an upper bound for the number of active loans')
+        num_candidates = missing - present - 1
+        step = max(1, -(-num_candidates // probes_per_round))
+        probe_indexes = list(range(present + step, missing, step))
+    return missing
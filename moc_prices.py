@@ -0,0 +1,208 @@
+"""
+Index the price history of a Money on Chain medianizer (e.g. the BTC/USD price used by MoC and Sovryn).
+
+The medianizer emits LogValue(val) whenever poke() changes the price. These events are indexed into a compact
+on-disk time series of (block number, timestamp, value), which is updated incrementally, so that prices at
+historical blocks or times and OHLC candles can be looked up locally instead of calling peek() on an archive
+node for every block.
+
+Values are stored as int64 in units of 10**-9 (the medianizer values are 10**18-scaled).
+
+Run like this:
+
+    python moc_prices.py --medianizer 0x... --start-block 1000000 --at 2022-06-01 --ohlc-days 1
+"""
+import logging
+import os
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Optional, Union
+
+import numpy as np
+
+from utils import (
+    enable_logging,
+    get_block_timestamps,
+    get_cache_path,
+    get_contract_events,
+    get_web3,
+    load_abi,
+    to_address,
+    utcnow,
+)
+
+logger = logging.getLogger(__name__)
+
+MEDIANIZER_ABI = load_abi('moc/MoCMedianizer')
+VALUE_SCALE = 10 ** 9
+
+
+@dataclass
+class OHLC:
+    timestamps: np.ndarray  # (intervals,) int64, start of each interval
+    open: np.ndarray  # (intervals,) int64, scaled value
+    high: np.ndarray  # (intervals,) int64, scaled value
+    low: np.ndarray  # (intervals,) int64, scaled value
+    close: np.ndarray  # (intervals,) int64, scaled value
+
+
+class PriceHistory:
+    def __init__(self, medianizer, *, path: str = None, start_block: int = 0, confirmations: int = 10):
+        self.medianizer = medianizer
+        self.web3 = medianizer.web3
+        self.confirmations = confirmations
+        if path is None:
+            path = get_cache_path('moc_prices', str(self.web3.eth.chain_id), f'{medianizer.address.lower()}.npz')
+        self.path = path
+        # Last block that has been indexed
+        self.block_number = start_block - 1
+        self.block_numbers = np.zeros(0, dtype=np.int64)
+        self.timestamps = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.int64)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                self.block_number = int(data['block_number'])
+                self.block_numbers = data['block_numbers']
+                self.timestamps = data['timestamps']
+                self.values = data['values']
+
+    def __len__(self):
+        return len(self.values)
+
+    def update(self, to_block: int = None, *, batch_size: int = 10000):
+        """Index the LogValue events up to to_block (latest block minus confirmations by default)"""
+        if to_block is None:
+            to_block = self.web3.eth.block_number - self.confirmations
+        if to_block <= self.block_number:
+            return
+        events = get_contract_events(
+            contract=self.medianizer,
+            event_names=['LogValue'],
+            from_block=self.block_number + 1,
+            to_block=to_block,
+            batch_size=batch_size,
+        )
+        timestamps_by_block = get_block_timestamps(self.web3, (event.blockNumber for event in events))
+        self.block_numbers = np.concatenate([
+            self.block_numbers,
+            np.array([event.blockNumber for event in events], dtype=np.int64),
+        ])
+        self.timestamps = np.concatenate([
+            self.timestamps,
+            np.array([timestamps_by_block[event.blockNumber] for event in events], dtype=np.int64),
+        ])
+        self.values = np.concatenate([
+            self.values,
+            np.array([int.from_bytes(event.args.val, 'big') // VALUE_SCALE for event in events], dtype=np.int64),
+        ])
+        logger.info('indexed %s price updates up to block %s', len(events), to_block)
+        self.block_number = to_block
+        self.save()
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp.npz'
+        np.savez_compressed(
+            tmp_path,
+            block_number=self.block_number,
+            block_numbers=self.block_numbers,
+            timestamps=self.timestamps,
+            values=self.values,
+        )
+        os.replace(tmp_path, self.path)
+
+    def value_at_block(self, block_numbers: Union[int, np.ndarray]) -> np.ndarray:
+        """Scaled value in effect at the end of each block, -1 for blocks before the first indexed value"""
+        return self._value_at(self.block_numbers, block_numbers)
+
+    def value_at_time(self, timestamps: Union[int, np.ndarray]) -> np.ndarray:
+        """Scaled value in effect at each timestamp, -1 for timestamps before the first indexed value"""
+        return self._value_at(self.timestamps, timestamps)
+
+    def price_at_block(self, block_number: int) -> Optional[Decimal]:
+        return to_decimal(self.value_at_block(block_number))
+
+    def price_at_time(self, dt: datetime) -> Optional[Decimal]:
+        return to_decimal(self.value_at_time(int(dt.timestamp())))
+
+    def ohlc(self, *, start: int, end: int, interval: int) -> OHLC:
+        """OHLC candles of interval seconds from timestamp start until timestamp end"""
+        interval_starts = np.arange(start, end, interval, dtype=np.int64)
+        open_ = self.value_at_time(interval_starts - 1)
+        close = self.value_at_time(np.minimum(interval_starts + interval, end) - 1)
+        high = open_.copy()
+        low = open_.copy()
+        # Indexes of the first value set in each interval, and of the first value after the last interval
+        bounds = np.searchsorted(self.timestamps, np.append(interval_starts, end))
+        for i, (first, last) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if last > first:
+                values = self.values[first:last]
+                if open_[i] < 0:
+                    high[i] = low[i] = values[0]
+                high[i] = max(high[i], values.max())
+                low[i] = min(low[i], values.min())
+        return OHLC(timestamps=interval_starts, open=open_, high=high, low=low, close=close)
+
+    def _value_at(self, keys: np.ndarray, queries: Union[int, np.ndarray]) -> np.ndarray:
+        indexes = np.searchsorted(keys, queries, side='right') - 1
+        return np.where(indexes >= 0, self.values[np.maximum(indexes, 0)] if len(self.values) else -1, -1)
+
+
+def to_decimal(value) -> Optional[Decimal]:
+    """Convert a scaled value to a decimal price, None for missing (negative) values"""
+    value = int(value)
+    if value < 0:
+        return None
+    return Decimal(value) / VALUE_SCALE
+
+
+def parse_datetime(s: str) -> datetime:
+    return datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
+
+
+def main():
+    parser = ArgumentParser(description="Index the price history of a MoC medianizer and query it")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--medianizer', help='address of the medianizer', required=True)
+    parser.add_argument('--start-block', help='first block to index (on the first run)', type=int, default=0)
+    parser.add_argument('--at', help='show the price at this UTC time (ISO format)', type=parse_datetime)
+    parser.add_argument('--block', help='show the price at this block', type=int)
+    parser.add_argument('--ohlc-days', help='show OHLC candles of this many days over the last --days', type=int)
+    parser.add_argument('--days', help='number of days to show OHLC candles for', type=int, default=30)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    medianizer = web3.eth.contract(address=to_address(args.medianizer), abi=MEDIANIZER_ABI)
+    history = PriceHistory(medianizer, start_block=args.start_block)
+    history.update()
+    print(f"{len(history)} price updates indexed up to block {history.block_number}")
+
+    if args.at:
+        print(f"Price at {args.at.isoformat()}: {history.price_at_time(args.at)}")
+    if args.block is not None:
+        if args.block > history.block_number:
+            print(f"Block {args.block} is not indexed yet")
+        else:
+            print(f"Price at block {args.block}: {history.price_at_block(args.block)}")
+    if args.ohlc_days:
+        end = utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = end - timedelta(days=args.days)
+        candles = history.ohlc(
+            start=int(start.timestamp()),
+            end=int(end.timestamp()),
+            interval=args.ohlc_days * 24 * 60 * 60,
+        )
+        print(f"{'date':10} {'open':>14} {'high':>14} {'low':>14} {'close':>14}")
+        for timestamp, *values in zip(candles.timestamps, candles.open, candles.high, candles.low, candles.close):
+            date = datetime.fromtimestamp(int(timestamp), timezone.utc).date().isoformat()
+            prices = [to_decimal(value) for value in values]
+            print(date, *(f'{price:14.2f}' if price is not None else f'{"-":>14}' for price in prices))
+
+
+if __name__ == '__main__':
+    main()
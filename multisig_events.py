@@ -0,0 +1,301 @@
+"""
+Index the events of a Gnosis-style Multisig (e.g. the FastBTC-in multisig) to answer confirmation status locally.
+
+Submission, Confirmation, Revocation, Execution and ExecutionFailure events are stored per transaction, with the
+confirmations as a bitmap over the owners (every owner ever seen gets its own bit). OwnerAddition, OwnerRemoval
+and RequirementChange keep the current owners and requirement up to date. These are read from the contract once,
+after the first update, since the owners set in the constructor don't emit events.
+
+Run like this (show the missing signers of all pending transactions, then follow new events):
+
+    python multisig_events.py --start-block 3000000 --pending --follow
+"""
+import logging
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from check_fastbtc_in_tx import FEDS, MULTISIG_ADDRESS
+from event_index import EventIndex, chunked
+from utils import batch_call, enable_logging, get_cache_path, get_contract, get_web3, to_address
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MultisigTransactionStatus:
+    transaction_id: int
+    status: str  # 'pending', 'executed' or 'failed' (the last execution attempt failed)
+    confirmed_by: List[str]  # current owners that have confirmed
+    missing_owners: List[str]  # current owners that haven't
+    required: int
+    submission_block: Optional[int]
+    execution_block: Optional[int]
+
+    @property
+    def is_confirmed(self) -> bool:
+        return len(self.confirmed_by) >= self.required
+
+
+class MultisigEventIndex(EventIndex):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS owners (
+            address TEXT PRIMARY KEY,
+            bit INTEGER NOT NULL UNIQUE,
+            is_owner INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL,
+            confirmations TEXT NOT NULL,
+            submission_block INTEGER,
+            execution_block INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS transactions_status ON transactions (status);
+    """
+    EVENT_NAMES = [
+        'Submission',
+        'Confirmation',
+        'Revocation',
+        'Execution',
+        'ExecutionFailure',
+        'OwnerAddition',
+        'OwnerRemoval',
+        'RequirementChange',
+    ]
+
+    def __init__(self, multisig, *, path: str = None, **kwargs):
+        if path is None:
+            path = get_cache_path(
+                'multisig_events',
+                str(multisig.web3.eth.chain_id),
+                f'{multisig.address.lower()}.sqlite',
+            )
+        super().__init__(contract=multisig, path=path, **kwargs)
+        self._bits_by_owner: Dict[str, int] = {}
+        self._reload_owner_bits()
+        # (transaction id, block number) of the failed executions since the last call of pop_execution_failures
+        self._new_execution_failures: List[Tuple[int, int]] = []
+        # Failed executions of the batch being stored, published when it's committed
+        self._batch_execution_failures: List[Tuple[int, int]] = []
+
+    @property
+    def required(self) -> Optional[int]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'required'").fetchone()
+        return int(row['value']) if row else None
+
+    @property
+    def owners_loaded(self) -> bool:
+        """Whether the owners and the requirement have been read from the contract"""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'owners_loaded'").fetchone()
+        return row is not None
+
+    def update(self, to_block: int = None) -> int:
+        num_events = super().update(to_block)
+        if not self.owners_loaded and self.block_number >= self.start_block:
+            self._load_owners()
+        return num_events
+
+    def on_batch_committed(self):
+        self._new_execution_failures.extend(self._batch_execution_failures)
+        self._batch_execution_failures = []
+
+    def on_batch_rolled_back(self):
+        self._batch_execution_failures = []
+        self._reload_owner_bits()
+
+    def pop_execution_failures(self) -> List[Tuple[int, int]]:
+        """(transaction id, block number) of the execution failures indexed since the last call"""
+        failures = self._new_execution_failures
+        self._new_execution_failures = []
+        return failures
+
+    def store_events(self, events: List):
+        for event in events:
+            if event.event == 'Submission':
+                self.db.execute(
+                    """
+                    INSERT INTO transactions VALUES (?, 'pending', '0x0', ?, NULL)
+                    ON CONFLICT (transaction_id) DO UPDATE SET submission_block = excluded.submission_block
+                    """,
+                    (event.args.transactionId, event.blockNumber),
+                )
+            elif event.event in ('Confirmation', 'Revocation'):
+                confirmations = self._get_confirmations(event.args.transactionId)
+                bit = 1 << self._get_owner_bit(event.args.sender)
+                if event.event == 'Confirmation':
+                    confirmations |= bit
+                else:
+                    confirmations &= ~bit
+                self._set_transaction(event.args.transactionId, confirmations=hex(confirmations))
+            elif event.event == 'Execution':
+                self._set_transaction(event.args.transactionId, status='executed', execution_block=event.blockNumber)
+            elif event.event == 'ExecutionFailure':
+                logger.warning('execution of multisig transaction %s failed in block %s',
+                               event.args.transactionId, event.blockNumber)
+                self._set_transaction(event.args.transactionId, status='failed')
+                self._batch_execution_failures.append((event.args.transactionId, event.blockNumber))
+            elif event.event in ('OwnerAddition', 'OwnerRemoval'):
+                self._get_owner_bit(event.args.owner)
+                self.db.execute(
+                    'UPDATE owners SET is_owner = ? WHERE address = ?',
+                    (int(event.event == 'OwnerAddition'), to_address(event.args.owner)),
+                )
+            elif event.event == 'RequirementChange':
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('required', ?)",
+                    (str(event.args.required),),
+                )
+
+    def get_statuses(self, transaction_ids: Iterable[int]) -> Dict[int, MultisigTransactionStatus]:
+        """Statuses of transactions by id. Transactions without any indexed events are missing from the result."""
+        required = self.required
+        owners = self.get_owners()
+        ret = {}
+        for chunk in chunked(list(transaction_ids)):
+            rows = self.db.execute(
+                f"SELECT * FROM transactions WHERE transaction_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for row in rows:
+                ret[row['transaction_id']] = self._to_status(row, owners=owners, required=required)
+        return ret
+
+    def get_pending_statuses(self) -> List[MultisigTransactionStatus]:
+        """Statuses of the transactions that haven't been executed (including failed ones), oldest first"""
+        required = self.required
+        owners = self.get_owners()
+        rows = self.db.execute(
+            "SELECT * FROM transactions WHERE status != 'executed' ORDER BY transaction_id"
+        )
+        return [self._to_status(row, owners=owners, required=required) for row in rows]
+
+    def get_owners(self) -> List[str]:
+        return [row['address'] for row in self.db.execute('SELECT address FROM owners WHERE is_owner ORDER BY bit')]
+
+    def _to_status(self, row, *, owners: List[str], required: int) -> MultisigTransactionStatus:
+        confirmations = int(row['confirmations'], 16)
+        confirmed_by = [owner for owner in owners if confirmations >> self._bits_by_owner[owner] & 1]
+        return MultisigTransactionStatus(
+            transaction_id=row['transaction_id'],
+            status=row['status'],
+            confirmed_by=confirmed_by,
+            missing_owners=[owner for owner in owners if owner not in confirmed_by],
+            required=required,
+            submission_block=row['submission_block'],
+            execution_block=row['execution_block'],
+        )
+
+    def _get_confirmations(self, transaction_id: int) -> int:
+        row = self.db.execute(
+            'SELECT confirmations FROM transactions WHERE transaction_id = ?',
+            (transaction_id,),
+        ).fetchone()
+        return int(row['confirmations'], 16) if row else 0
+
+    def _set_transaction(self, transaction_id: int, **values):
+        # Transactions submitted before the start block only show up through their later events
+        self.db.execute(
+            "INSERT OR IGNORE INTO transactions VALUES (?, 'pending', '0x0', NULL, NULL)",
+            (transaction_id,),
+        )
+        self.db.execute(
+            f"UPDATE transactions SET {', '.join(f'{key} = ?' for key in values)} WHERE transaction_id = ?",
+            tuple(values.values()) + (transaction_id,),
+        )
+
+    def _get_owner_bit(self, address: str) -> int:
+        # New owners are added to _bits_by_owner inside the transaction, which is reloaded if it's rolled back
+        address = to_address(address)
+        bit = self._bits_by_owner.get(address)
+        if bit is None:
+            bit = len(self._bits_by_owner)
+            self.db.execute('INSERT INTO owners VALUES (?, ?, 1)', (address, bit))
+            self._bits_by_owner[address] = bit
+        return bit
+
+    def _reload_owner_bits(self):
+        self._bits_by_owner = {
+            row['address']: row['bit'] for row in self.db.execute('SELECT address, bit FROM owners')
+        }
+
+    def _load_owners(self):
+        """Read the owners and the requirement from the contract at the last indexed block"""
+        required, owners = batch_call(
+            self.web3,
+            [self.contract.functions.required(), self.contract.functions.getOwners()],
+            block_identifier=self.block_number,
+        )
+        try:
+            with self.db:
+                self.db.execute('UPDATE owners SET is_owner = 0')
+                for owner in owners:
+                    self._get_owner_bit(owner)
+                    self.db.execute('UPDATE owners SET is_owner = 1 WHERE address = ?', (to_address(owner),))
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('required', ?)", (str(required),))
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('owners_loaded', '1')")
+        except BaseException:
+            self._reload_owner_bits()
+            raise
+
+
+def show_status(status: MultisigTransactionStatus, names_by_address: Dict[str, str]):
+    print(
+        f"Transaction {status.transaction_id}: {status.status}, "
+        f"{len(status.confirmed_by)} out of {status.required} confirmations"
+    )
+    if status.status != 'executed' and not status.is_confirmed:
+        for address in status.missing_owners:
+            print(f"    missing: {names_by_address.get(address, '(unknown)')} `{address}`")
+
+
+def follow(index: MultisigEventIndex, *, poll_interval: float, names_by_address: Dict[str, str]):
+    while True:
+        index.update()
+        for transaction_id, block_number in index.pop_execution_failures():
+            print(f"Block {block_number}: execution of transaction {transaction_id} FAILED")
+            show_status(index.get_statuses([transaction_id])[transaction_id], names_by_address)
+        time.sleep(poll_interval)
+
+
+def main():
+    parser = ArgumentParser(description="Index multisig events and show the confirmation status of transactions")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--multisig', help='address of the multisig', default=MULTISIG_ADDRESS)
+    parser.add_argument('--start-block', help='first block to index (on the first run)', type=int, default=0)
+    parser.add_argument('--tx', help='show the status of this transaction id', type=int, action='append', default=[])
+    parser.add_argument('--pending', action='store_true', default=False,
+                        help='show the status of all transactions that are not executed')
+    parser.add_argument('--follow', action='store_true', default=False, help='follow and show execution failures')
+    parser.add_argument('--confirmations', type=int, default=2)
+    parser.add_argument('--poll-interval', help='seconds between polls for new blocks', type=float, default=10)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    multisig = get_contract(web3=web3, abi_name='fastbtc/Multisig', address=args.multisig)
+    index = MultisigEventIndex(multisig, start_block=args.start_block, confirmations=args.confirmations)
+    index.update()
+    index.pop_execution_failures()
+    print(f"Multisig events indexed up to block {index.block_number}")
+    names_by_address = {address: name for name, address in FEDS}
+
+    statuses = index.get_statuses(args.tx)
+    for transaction_id in args.tx:
+        if transaction_id in statuses:
+            show_status(statuses[transaction_id], names_by_address)
+        else:
+            print(f"Transaction {transaction_id}: not indexed")
+    if args.pending:
+        for status in index.get_pending_statuses():
+            show_status(status, names_by_address)
+    if args.follow:
+        follow(index, poll_interval=args.poll_interval, names_by_address=names_by_address)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Snapshots of the PriceFeeds rate matrix, shared by everything that needs oracle prices in a run.
+
+PriceFeeds.pricesFeeds is a mapping that can't be enumerated on chain (and setting feeds emits no events),
+so the tokens of a snapshot are given by the caller, e.g. the tokens of the loan book or of the AMM pools.
+The rates of all token pairs are fetched with one batch of queryRate calls and cached per block: in memory,
+and on disk for blocks that are deep enough to not be reorged. Requesting more tokens for a cached block
+only fetches the missing pairs. Pairs whose queryRate reverts have no price feed; any other error
+(e.g. a node timeout) raises, so that a snapshot with unresolved pairs is never cached.
+
+Run like this:
+
+    python price_snapshot.py --token 0x... --token 0x... --block 4500000
+"""
+import json
+import logging
+import os
+import threading
+from argparse import ArgumentParser
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from constants import SOVRYN_PROTOCOL_ADDRESS
+from tokens import get_token_registry
+from utils import batch_call, enable_logging, get_cache_path, get_web3, load_abi, to_address, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+Pair = Tuple[str, str]
+
+
+class PriceSnapshot:
+    def __init__(self, *, block_number: int, rates: Dict[Pair, Optional[Tuple[int, int]]]):
+        self.block_number = block_number
+        # (source token, target token) -> (rate, precision), or None if the pair has no price feed
+        self.rates = rates
+
+    @property
+    def token_addresses(self) -> List[str]:
+        return sorted(set(token for pair in self.rates for token in pair))
+
+    def has_pair(self, source_token: str, target_token: str) -> bool:
+        return source_token == target_token or (source_token, target_token) in self.rates
+
+    def get_raw_rate(self, source_token: str, target_token: str) -> Optional[Tuple[int, int]]:
+        """(rate, precision) of the pair as returned by queryRate, or None if the pair has no price feed"""
+        if source_token == target_token:
+            return 1, 1
+        return self.rates[(source_token, target_token)]
+
+    def get_rate(self, source_token: str, target_token: str) -> Optional[float]:
+        """Amount of target token wei per source token wei, or None if the pair has no price feed"""
+        raw_rate = self.get_raw_rate(source_token, target_token)
+        if raw_rate is None:
+            return None
+        rate, precision = raw_rate
+        return rate / precision
+
+    def convert(self, source_token: str, target_token: str, amount: int) -> int:
+        """Convert amount of source token wei to target token wei, like PriceFeeds.queryReturn"""
+        raw_rate = self.get_raw_rate(source_token, target_token)
+        if raw_rate is None:
+            raise LookupError(f'No price feed for {source_token} -> {target_token}')
+        rate, precision = raw_rate
+        return amount * rate // precision
+
+    def get_rate_matrix(self, token_addresses: List[str]) -> np.ndarray:
+        """(tokens, tokens) array where [i, j] is the amount of token j wei per token i wei, NaN without a feed"""
+        rates = np.full((len(token_addresses), len(token_addresses)), np.nan)
+        for i, source_token in enumerate(token_addresses):
+            for j, target_token in enumerate(token_addresses):
+                rate = self.get_rate(source_token, target_token)
+                if rate is not None:
+                    rates[i, j] = rate
+        return rates
+
+    def to_json(self) -> dict:
+        return {
+            'block_number': self.block_number,
+            'rates': [
+                [source_token, target_token, list(raw_rate) if raw_rate else None]
+                for (source_token, target_token), raw_rate in sorted(self.rates.items())
+            ]
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'PriceSnapshot':
+        return cls(
+            block_number=data['block_number'],
+            rates={
+                (source_token, target_token): tuple(raw_rate) if raw_rate else None
+                for source_token, target_token, raw_rate in data['rates']
+            },
+        )
+
+
+class PriceSnapshotStore:
+    def __init__(self, price_feeds, *, confirmations: int = 10, max_blocks_in_memory: int = 16):
+        self.price_feeds = price_feeds
+        self.web3 = price_feeds.web3
+        self.confirmations = confirmations
+        self.max_blocks_in_memory = max_blocks_in_memory
+        self._snapshots: 'OrderedDict[int, PriceSnapshot]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token_addresses: Iterable[str], block_identifier='latest') -> PriceSnapshot:
+        """Get a snapshot of the rates between all of the tokens at the block"""
+        if isinstance(block_identifier, int):
+            block_number = block_identifier
+        else:
+            block_number = self.web3.eth.get_block(block_identifier)['number']
+        token_addresses = sorted(set(to_address(a) for a in token_addresses))
+
+        with self._lock:
+            snapshot = self._snapshots.get(block_number)
+            if snapshot is None:
+                snapshot = self._load(block_number)
+            self._snapshots[block_number] = snapshot
+            self._snapshots.move_to_end(block_number)
+            while len(self._snapshots) > self.max_blocks_in_memory:
+                self._snapshots.popitem(last=False)
+
+            missing_pairs = [
+                (source_token, target_token)
+                for source_token in token_addresses
+                for target_token in token_addresses
+                if not snapshot.has_pair(source_token, target_token)
+            ]
+            if missing_pairs:
+                logger.info('fetching %s rates at block %s', len(missing_pairs), block_number)
+                results = batch_call(
+                    self.web3,
+                    [self.price_feeds.functions.queryRate(*pair) for pair in missing_pairs],
+                    block_identifier=block_number,
+                    allow_revert=True,
+                )
+                for pair, result in zip(missing_pairs, results):
+                    snapshot.rates[pair] = tuple(result) if result is not None else None
+                if block_number <= self.web3.eth.block_number - self.confirmations:
+                    write_json_atomic(self._get_path(block_number), snapshot.to_json())
+            return snapshot
+
+    def _load(self, block_number: int) -> PriceSnapshot:
+        path = self._get_path(block_number)
+        if os.path.exists(path):
+            with open(path) as f:
+                return PriceSnapshot.from_json(json.load(f))
+        return PriceSnapshot(block_number=block_number, rates={})
+
+    def _get_path(self, block_number: int) -> str:
+        return get_cache_path(
+            'price_snapshots',
+            str(self.web3.eth.chain_id),
+            self.price_feeds.address.lower(),
+            f'{block_number}.json',
+        )
+
+
+def main():
+    parser = ArgumentParser(description="Show the PriceFeeds rates between tokens at a block")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--token', help='address of a token to include', action='append', required=True)
+    parser.add_argument('--block', help='block number (latest by default)', type=int)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    sovryn_protocol = web3.eth.contract(
+        address=SOVRYN_PROTOCOL_ADDRESS,
+        abi=load_abi('loans/SovrynProtocol')
+    )
+    block_identifier = args.block if args.block is not None else 'latest'
+    price_feeds = web3.eth.contract(
+        address=sovryn_protocol.functions.priceFeeds().call(block_identifier=block_identifier),
+        abi=load_abi('price_feed/PriceFeeds'),
+    )
+    snapshot = PriceSnapshotStore(price_feeds).get(args.token, block_identifier)
+    tokens = get_token_registry(web3).get_many(snapshot.token_addresses)
+    print(f"Rates at block {snapshot.block_number}:")
+    for source_token in snapshot.token_addresses:
+        for target_token in snapshot.token_addresses:
+            if source_token == target_token:
+                continue
+            source_info = tokens[source_token]
+            target_info = tokens[target_token]
+            if snapshot.get_raw_rate(source_token, target_token) is None:
+                print(f"{source_info.symbol} -> {target_info.symbol}: no price feed")
+                continue
+            converted = snapshot.convert(source_token, target_token, 10 ** source_info.decimals)
+            print(f"1 {source_info.symbol} = {target_info.to_decimal(converted)} {target_info.symbol}")
+
+
+if __name__ == '__main__':
+    main()
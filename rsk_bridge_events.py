@@ -0,0 +1,306 @@
+"""
+Index the peg-in and peg-out events of the RSK bridge precompiled contract, to look up the status of
+many peg-ins and peg-outs at once from local data.
+
+Peg-ins are looked up by bitcoin transaction id (lock_btc, pegin_btc, rejected_pegin and unrefundable_pegin)
+and peg-outs by the hash of the RSK transaction that requested the release (release_requested and release_btc).
+
+Run like this (show the status of the peg-ins listed in a file, one bitcoin tx id per line):
+
+    python rsk_bridge_events.py --pegins btc_txids.txt
+"""
+import hashlib
+import json
+import logging
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from event_index import EventIndex, chunked
+from utils import enable_logging, get_cache_path, get_contract, get_web3, to_address
+
+logger = logging.getLogger(__name__)
+
+RSK_BRIDGE_ADDRESS = to_address('0x0000000000000000000000000000000001000006')
+
+
+@dataclass
+class PeginStatus:
+    btc_tx_hash: str
+    status: str  # 'registered', 'rejected' or 'unrefundable'
+    rsk_tx_hash: str
+    block_number: int
+    receiver: Optional[str]
+    amount_satoshi: Optional[int]
+    reason: Optional[int]
+
+
+@dataclass
+class PegoutStatus:
+    rsk_tx_hash: str
+    status: str  # 'requested' or 'released'
+    btc_tx_hash: Optional[str]
+    amount_satoshi: Optional[int]
+    block_number: int
+
+
+class RSKBridgeEventIndex(EventIndex):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bridge_events (
+            block_number INTEGER NOT NULL,
+            transaction_index INTEGER NOT NULL,
+            log_index INTEGER NOT NULL,
+            transaction_hash TEXT NOT NULL,
+            event TEXT NOT NULL,
+            btc_tx_hash TEXT,
+            rsk_tx_hash TEXT,
+            address TEXT,
+            amount INTEGER,
+            reason INTEGER,
+            data TEXT,
+            PRIMARY KEY (block_number, transaction_index, log_index)
+        );
+        CREATE INDEX IF NOT EXISTS bridge_events_btc_tx_hash ON bridge_events (btc_tx_hash);
+        CREATE INDEX IF NOT EXISTS bridge_events_rsk_tx_hash ON bridge_events (rsk_tx_hash);
+    """
+    EVENT_NAMES = [
+        'lock_btc',
+        'pegin_btc',
+        'rejected_pegin',
+        'unrefundable_pegin',
+        'release_request_received',
+        'release_request_rejected',
+        'release_requested',
+        'release_btc',
+    ]
+
+    def __init__(self, web3, *, path: str = None, **kwargs):
+        if path is None:
+            path = get_cache_path('rsk_bridge_events', f'{web3.eth.chain_id}.sqlite')
+        super().__init__(
+            contract=get_contract(web3=web3, abi_name='precompiled/RSKBridge', address=RSK_BRIDGE_ADDRESS),
+            path=path,
+            **kwargs
+        )
+
+    def store_events(self, events: List):
+        rows = []
+        for event in events:
+            args = event.args
+            row = {
+                'block_number': event.blockNumber,
+                'transaction_index': event.transactionIndex,
+                'log_index': event.logIndex,
+                'transaction_hash': normalize_rsk_tx_hash(event.transactionHash.hex()),
+                'event': event.event,
+                'btc_tx_hash': None,
+                'rsk_tx_hash': None,
+                'address': None,
+                'amount': None,
+                'reason': None,
+                'data': None,
+            }
+            if event.event in ('lock_btc', 'pegin_btc'):
+                row.update(
+                    btc_tx_hash=normalize_btc_tx_hash(args.btcTxHash.hex()),
+                    address=args.receiver,
+                    amount=args.amount,
+                )
+                if event.event == 'lock_btc':
+                    row['data'] = json.dumps({'senderBtcAddress': args.senderBtcAddress})
+                else:
+                    row['data'] = json.dumps({'protocolVersion': args.protocolVersion})
+            elif event.event in ('rejected_pegin', 'unrefundable_pegin'):
+                row.update(btc_tx_hash=normalize_btc_tx_hash(args.btcTxHash.hex()), reason=args.reason)
+            elif event.event == 'release_request_received':
+                row.update(
+                    rsk_tx_hash=row['transaction_hash'],
+                    address=args.sender,
+                    amount=args.amount,
+                    data=json.dumps({'btcDestinationAddress': args.btcDestinationAddress.hex()}),
+                )
+            elif event.event == 'release_request_rejected':
+                row.update(
+                    rsk_tx_hash=row['transaction_hash'],
+                    address=args.sender,
+                    amount=args.amount,
+                    reason=args.reason,
+                )
+            elif event.event == 'release_requested':
+                row.update(
+                    rsk_tx_hash=normalize_rsk_tx_hash(args.rskTxHash.hex()),
+                    btc_tx_hash=normalize_btc_tx_hash(args.btcTxHash.hex()),
+                    amount=args.amount,
+                )
+            elif event.event == 'release_btc':
+                row.update(
+                    rsk_tx_hash=normalize_rsk_tx_hash(args.releaseRskTxHash.hex()),
+                    btc_tx_hash=get_btc_txid(args.btcRawTransaction),
+                )
+            rows.append(row)
+        self.db.executemany(
+            """
+            INSERT OR REPLACE INTO bridge_events VALUES (
+                :block_number, :transaction_index, :log_index, :transaction_hash, :event,
+                :btc_tx_hash, :rsk_tx_hash, :address, :amount, :reason, :data
+            )
+            """,
+            rows,
+        )
+
+    def get_pegin_statuses(self, btc_tx_hashes: Iterable[str]) -> Dict[str, PeginStatus]:
+        """Statuses of peg-ins by bitcoin tx id. Peg-ins the bridge has not seen are missing from the result."""
+        ret = {}
+        for chunk in chunked([normalize_btc_tx_hash(h) for h in btc_tx_hashes]):
+            rows = self.db.execute(
+                f"""
+                SELECT * FROM bridge_events
+                WHERE btc_tx_hash IN ({','.join('?' * len(chunk))})
+                AND event IN ('lock_btc', 'pegin_btc', 'rejected_pegin', 'unrefundable_pegin')
+                ORDER BY block_number, transaction_index, log_index
+                """,
+                chunk,
+            )
+            for row in rows:
+                # The last event wins, e.g. registered after an earlier rejection
+                ret[row['btc_tx_hash']] = PeginStatus(
+                    btc_tx_hash=row['btc_tx_hash'],
+                    status={
+                        'lock_btc': 'registered',
+                        'pegin_btc': 'registered',
+                        'rejected_pegin': 'rejected',
+                        'unrefundable_pegin': 'unrefundable',
+                    }[row['event']],
+                    rsk_tx_hash=row['transaction_hash'],
+                    block_number=row['block_number'],
+                    receiver=row['address'],
+                    amount_satoshi=row['amount'],
+                    reason=row['reason'],
+                )
+        return ret
+
+    def get_pegout_statuses(self, rsk_tx_hashes: Iterable[str]) -> Dict[str, PegoutStatus]:
+        """Statuses of peg-outs by the hash of the RSK transaction that requested them"""
+        ret = {}
+        for chunk in chunked([normalize_rsk_tx_hash(h) for h in rsk_tx_hashes]):
+            rows = self.db.execute(
+                f"""
+                SELECT * FROM bridge_events
+                WHERE rsk_tx_hash IN ({','.join('?' * len(chunk))})
+                AND event IN ('release_requested', 'release_btc')
+                ORDER BY block_number, transaction_index, log_index
+                """,
+                chunk,
+            )
+            for row in rows:
+                previous = ret.get(row['rsk_tx_hash'])
+                ret[row['rsk_tx_hash']] = PegoutStatus(
+                    rsk_tx_hash=row['rsk_tx_hash'],
+                    status='released' if row['event'] == 'release_btc' else 'requested',
+                    btc_tx_hash=row['btc_tx_hash'],
+                    amount_satoshi=row['amount'] if row['amount'] is not None else (
+                        previous.amount_satoshi if previous else None
+                    ),
+                    block_number=row['block_number'],
+                )
+        return ret
+
+
+def normalize_btc_tx_hash(h: str) -> str:
+    """Bitcoin tx ids are stored as lowercase hex without 0x, like bitcoin shows them"""
+    h = h.strip().lower()
+    return h[2:] if h.startswith('0x') else h
+
+
+def normalize_rsk_tx_hash(h: str) -> str:
+    """RSK tx hashes are stored as lowercase hex with 0x"""
+    h = h.strip().lower()
+    return h if h.startswith('0x') else '0x' + h
+
+
+def get_btc_txid(raw_transaction: bytes) -> str:
+    """The bitcoin transaction id (in the usual, byte-reversed, form) of a serialized transaction"""
+    if len(raw_transaction) > 5 and raw_transaction[4] == 0 and raw_transaction[5] != 0:
+        raw_transaction = strip_witness(raw_transaction)
+    return hashlib.sha256(hashlib.sha256(raw_transaction).digest()).digest()[::-1].hex()
+
+
+def strip_witness(raw_transaction: bytes) -> bytes:
+    """Serialize a segwit transaction without the marker, flag and witnesses, as used for the txid"""
+    position = 6
+
+    def read_varint() -> int:
+        nonlocal position
+        prefix = raw_transaction[position]
+        size = {0xfd: 2, 0xfe: 4, 0xff: 8}.get(prefix, 0)
+        if not size:
+            position += 1
+            return prefix
+        value = int.from_bytes(raw_transaction[position + 1:position + 1 + size], 'little')
+        position += 1 + size
+        return value
+
+    def skip_script():
+        nonlocal position
+        length = read_varint()
+        position += length
+
+    num_inputs = read_varint()
+    for _ in range(num_inputs):
+        position += 36  # outpoint
+        skip_script()
+        position += 4  # sequence
+    num_outputs = read_varint()
+    for _ in range(num_outputs):
+        position += 8  # value
+        skip_script()
+    outputs_end = position
+    return raw_transaction[:4] + raw_transaction[6:outputs_end] + raw_transaction[-4:]
+
+
+def main():
+    parser = ArgumentParser(description="Index RSK bridge events and show the status of peg-ins and peg-outs")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--start-block', help='first block to index (on the first run)', type=int, default=0)
+    parser.add_argument('--pegins', help='file of bitcoin tx ids of peg-ins, one per line')
+    parser.add_argument('--pegouts', help='file of RSK tx hashes of peg-out requests, one per line')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    index = RSKBridgeEventIndex(web3, start_block=args.start_block)
+    index.update()
+    print(f"Bridge events indexed up to block {index.block_number}")
+
+    if args.pegins:
+        with open(args.pegins) as f:
+            btc_tx_hashes = [normalize_btc_tx_hash(line) for line in f if line.strip()]
+        statuses = index.get_pegin_statuses(btc_tx_hashes)
+        for btc_tx_hash in btc_tx_hashes:
+            status = statuses.get(btc_tx_hash)
+            if status is None:
+                print(f"{btc_tx_hash}: not seen by the bridge")
+            elif status.status == 'registered':
+                print(f"{btc_tx_hash}: registered in block {status.block_number}, "
+                      f"{status.amount_satoshi} satoshi to {status.receiver}")
+            else:
+                print(f"{btc_tx_hash}: {status.status} in block {status.block_number} (reason {status.reason})")
+
+    if args.pegouts:
+        with open(args.pegouts) as f:
+            rsk_tx_hashes = [normalize_rsk_tx_hash(line) for line in f if line.strip()]
+        statuses = index.get_pegout_statuses(rsk_tx_hashes)
+        for rsk_tx_hash in rsk_tx_hashes:
+            status = statuses.get(rsk_tx_hash)
+            if status is None:
+                print(f"{rsk_tx_hash}: no release requested")
+            else:
+                print(f"{rsk_tx_hash}: {status.status} in block {status.block_number}, "
+                      f"bitcoin tx {status.btc_tx_hash}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Quote conversions through the AMM for many amounts and candidate paths at once.
+
+A route graph of reserve tokens and the pools (anchors) between them is built from the converters of the
+local pool state mirror (see amm.py). All candidate paths between two tokens are then evaluated for a vector
+of input amounts in one pass: with exact integer math when all pools of a path are mirrored locally, and
+with batched SovrynSwapNetwork.rateByPath calls otherwise.
+
+Paths are in the format used by SovrynSwapNetwork: [source token, anchor, token, anchor, ..., target token].
+
+Run like this:
+
+    python swap_routes.py --source 0x... --target 0x... --amounts 0.1,1,10 --swap-network 0x...
+"""
+from argparse import ArgumentParser
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from amm import PoolState, PoolStateMirror
+from tokens import get_token_registry
+from utils import batch_call, enable_logging, get_web3, load_abi, to_address
+
+Path = Tuple[str, ...]
+
+
+class RouteGraph:
+    def __init__(self, pools: Sequence[PoolState]):
+        self.pools_by_anchor: Dict[str, PoolState] = {pool.anchor_address: pool for pool in pools}
+        # token -> [(anchor, other token)]
+        self.edges: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        for pool in pools:
+            for source_token in pool.reserve_tokens:
+                for target_token in pool.reserve_tokens:
+                    if source_token != target_token:
+                        self.edges[source_token].append((pool.anchor_address, target_token))
+
+    def get_paths(self, source_token: str, target_token: str, *, max_hops: int = 3) -> List[Path]:
+        """All paths from source_token to target_token through at most max_hops pools, not visiting tokens twice"""
+        paths = []
+
+        def visit(path: Path, visited: frozenset):
+            token = path[-1]
+            if token == target_token:
+                paths.append(path)
+                return
+            if len(path) // 2 >= max_hops:
+                return
+            for anchor, next_token in self.edges.get(token, ()):
+                if next_token not in visited:
+                    visit(path + (anchor, next_token), visited | {next_token})
+
+        visit((source_token,), frozenset([source_token]))
+        return sorted(paths, key=len)
+
+
+@dataclass
+class QuoteResult:
+    paths: List[Path]
+    amounts: np.ndarray  # (amounts,) object (int)
+    returns: np.ndarray  # (paths, amounts) object (int), 0 where the conversion fails
+
+    def best_path_indexes(self) -> np.ndarray:
+        """Index of the path with the highest return for each amount, comparing the exact integer returns"""
+        if not self.paths:
+            raise LookupError('No paths to quote')
+        return np.array([
+            max(range(len(self.paths)), key=lambda i: self.returns[i, j])
+            for j in range(len(self.amounts))
+        ], dtype=np.int64)
+
+    def best_returns(self) -> List[Tuple[Path, int]]:
+        return [
+            (self.paths[path_index], int(self.returns[path_index, i]))
+            for i, path_index in enumerate(self.best_path_indexes())
+        ]
+
+
+class QuoteEngine:
+    def __init__(self, *, route_graph: RouteGraph, swap_network=None, block_identifier='latest'):
+        self.route_graph = route_graph
+        self.swap_network = swap_network
+        self.block_identifier = block_identifier
+
+    def quote(
+        self,
+        source_token: str,
+        target_token: str,
+        amounts: Sequence[int],
+        *,
+        max_hops: int = 3,
+        extra_paths: Sequence[Path] = (),
+    ) -> QuoteResult:
+        paths = self.route_graph.get_paths(source_token, target_token, max_hops=max_hops)
+        paths.extend(tuple(p) for p in extra_paths if tuple(p) not in paths)
+        amounts = np.array([int(a) for a in amounts], dtype=object)
+        returns = np.zeros((len(paths), len(amounts)), dtype=object)
+
+        remote_path_indexes = []
+        for i, path in enumerate(paths):
+            local_returns = self._quote_locally(path, amounts)
+            if local_returns is None:
+                remote_path_indexes.append(i)
+            else:
+                returns[i] = local_returns
+
+        if remote_path_indexes:
+            if self.swap_network is None:
+                raise LookupError('Not all paths can be quoted locally and no swap network given')
+            calls = [(i, j) for i in remote_path_indexes for j in range(len(amounts))]
+            results = batch_call(
+                self.swap_network.web3,
+                [self.swap_network.functions.rateByPath(list(paths[i]), int(amounts[j])) for i, j in calls],
+                block_identifier=self.block_identifier,
+                allow_revert=True,
+            )
+            for (i, j), result in zip(calls, results):
+                returns[i, j] = result or 0
+
+        return QuoteResult(paths=paths, amounts=amounts, returns=returns)
+
+    def _quote_locally(self, path: Path, amounts: np.ndarray) -> Optional[np.ndarray]:
+        """Quote the path for all amounts with exact integer math, or return None if a pool is not mirrored"""
+        pools = []
+        for anchor in path[1::2]:
+            pool = self.route_graph.pools_by_anchor.get(anchor)
+            if pool is None:
+                return None
+            pools.append(pool)
+
+        current_amounts = amounts
+        for pool, source_token, target_token in zip(pools, path[0::2], path[2::2]):
+            source_balance = pool.balances[source_token]
+            target_balance = pool.balances[target_token]
+            if pool.weights[source_token] != pool.weights[target_token]:
+                current_amounts = np.array([
+                    pool.get_return(source_token, target_token, int(amount))[0]
+                    for amount in current_amounts
+                ], dtype=object)
+                continue
+            # Vectorized version of PoolState.get_return for equal weights
+            target_amounts = target_balance * current_amounts // (source_balance + current_amounts)
+            current_amounts = target_amounts - target_amounts * pool.conversion_fee // 1_000_000
+        return current_amounts
+
+
+def parse_amounts(s: str) -> List[Decimal]:
+    return [Decimal(p) for p in s.split(',') if p.strip()]
+
+
+def main():
+    parser = ArgumentParser(description="Quote conversions through the AMM for many amounts")
+    parser.add_argument('--chain', default='rsk_mainnet')
+    parser.add_argument('--source', help='source token address', required=True)
+    parser.add_argument('--target', help='target token address', required=True)
+    parser.add_argument('--amounts', help='comma-separated amounts of the source token', type=parse_amounts,
+                        required=True)
+    parser.add_argument('--max-hops', type=int, default=3)
+    parser.add_argument('--swap-network', help='SovrynSwapNetwork address, for paths through unmirrored pools')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        enable_logging()
+
+    web3 = get_web3(args.chain)
+    mirror = PoolStateMirror(web3)
+    mirror.update()
+    # The mirror has no block yet if no converters have been added to it
+    block_number = mirror.block_number if mirror.block_number is not None else web3.eth.block_number
+    swap_network = None
+    extra_paths = []
+    source_token = to_address(args.source)
+    target_token = to_address(args.target)
+    if args.swap_network:
+        swap_network = web3.eth.contract(
+            address=to_address(args.swap_network),
+            abi=load_abi('amm/SovrynSwapNetwork'),
+        )
+        extra_paths.append(
+            swap_network.functions.conversionPath(source_token, target_token).call(
+                block_identifier=block_number,
+            )
+        )
+
+    engine = QuoteEngine(
+        route_graph=RouteGraph(list(mirror.pools.values())),
+        swap_network=swap_network,
+        block_identifier=block_number,
+    )
+    tokens = get_token_registry(web3).get_many([source_token, target_token])
+    source_info, target_info = tokens[source_token], tokens[target_token]
+    result = engine.quote(
+        source_token,
+        target_token,
+        [int(amount * 10 ** source_info.decimals) for amount in args.amounts],
+        max_hops=args.max_hops,
+        extra_paths=extra_paths,
+    )
+    print(f"Evaluated {len(result.paths)} paths at block {block_number}")
+    if not result.paths:
+        return
+    for amount, (path, best_return) in zip(args.amounts, result.best_returns()):
+        print(
+            f"{amount} {source_info.symbol} -> {target_info.to_decimal(best_return)} {target_info.symbol} "
+            f"via {' -> '.join(path)}"
+        )
+
+
+if __name__ == '__main__':
+    main()
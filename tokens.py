@@ -0,0 +1,105 @@
+"""Token metadata (name, symbol, decimals), cached on disk per chain"""
+import functools
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+from typing import Dict, Iterable
+
+from eth_abi import decode_abi
+from eth_utils import to_bytes
+from web3 import Web3
+
+from utils import batch_rpc_request, get_cache_path, get_erc20_contract, to_address, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TokenInfo:
+    address: str
+    name: str
+    symbol: str
+    decimals: int
+
+    def to_decimal(self, amount_wei: int) -> Decimal:
+        return Decimal(amount_wei) / 10 ** self.decimals
+
+
+class TokenRegistry:
+    """
+    Registry of token metadata for a single chain.
+
+    Metadata of unknown tokens is fetched with batched eth_calls and persisted on disk, so that
+    every token is only looked up once. Tokens that return bytes32 instead of string for name()
+    and symbol() are supported.
+    """
+    def __init__(self, web3: Web3, *, path: str = None):
+        self.web3 = web3
+        if path is None:
+            path = get_cache_path('tokens', f'{web3.eth.chain_id}.json')
+        self.path = path
+        self._tokens: Dict[str, TokenInfo] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for data in json.load(f).values():
+                    token = TokenInfo(**data)
+                    self._tokens[token.address] = token
+
+    def get(self, address: str) -> TokenInfo:
+        return self.get_many([address])[to_address(address)]
+
+    def get_many(self, addresses: Iterable[str]) -> Dict[str, TokenInfo]:
+        """Get metadata of tokens by (checksummed) address, fetching unknown tokens in one batch"""
+        addresses = [to_address(a) for a in addresses]
+        unknown_addresses = sorted(set(a for a in addresses if a not in self._tokens))
+        if unknown_addresses:
+            self._fetch(unknown_addresses)
+        return {
+            address: self._tokens[address]
+            for address in addresses
+        }
+
+    def _fetch(self, addresses):
+        logger.info('fetching metadata of %s tokens', len(addresses))
+        requests = []
+        for address in addresses:
+            token = get_erc20_contract(token_address=address, web3=self.web3)
+            for function in (token.functions.name(), token.functions.symbol(), token.functions.decimals()):
+                requests.append(
+                    ('eth_call', [{'to': address, 'data': function._encode_transaction_data()}, 'latest'])
+                )
+        results = batch_rpc_request(self.web3, requests, allow_failure=True)
+        for i, address in enumerate(addresses):
+            raw_name, raw_symbol, raw_decimals = results[i * 3:i * 3 + 3]
+            if not raw_decimals or raw_decimals == '0x':
+                raise LookupError(f'Unable to get decimals of token {address}, is it an ERC20 token?')
+            self._tokens[address] = TokenInfo(
+                address=address,
+                name=decode_string_or_bytes32(raw_name),
+                symbol=decode_string_or_bytes32(raw_symbol),
+                decimals=decode_abi(['uint256'], to_bytes(hexstr=raw_decimals))[0],
+            )
+        write_json_atomic(self.path, {
+            address: asdict(token)
+            for address, token in sorted(self._tokens.items())
+        })
+
+
+def decode_string_or_bytes32(raw_result: str) -> str:
+    """Decode the result of name() or symbol(), which is bytes32 instead of string for some tokens"""
+    if not raw_result:
+        return ''
+    data = to_bytes(hexstr=raw_result)
+    if len(data) > 32:
+        try:
+            return decode_abi(['string'], data)[0]
+        except Exception:
+            pass
+    return data[:32].rstrip(b'\x00').decode('utf-8', errors='replace')
+
+
+@functools.lru_cache()
+def get_token_registry(web3: Web3) -> TokenRegistry:
+    return TokenRegistry(web3)
@@ -4,20 +4,28 @@ import json
 import logging
 import os
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from time import sleep
-from typing import Any, Dict, List, Optional, Union
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
+from eth_abi import decode_abi
 from eth_account.signers.local import LocalAccount
-from eth_typing import AnyAddress
-from eth_utils import to_checksum_address
+from eth_typing import AnyAddress, BlockIdentifier
+from eth_utils import event_abi_to_log_topic, function_abi_to_4byte_selector, to_checksum_address, to_bytes, to_hex
 from web3 import Web3
-from web3.contract import Contract, ContractEvent
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3._utils.request import make_post_request
+from web3.contract import Contract, ContractEvent, ContractFunction
 from web3.middleware import construct_sign_and_send_raw_middleware, geth_poa_middleware
-from web3.types import BlockData
+from web3.types import BlockData, TxParams, TxReceipt
 
 THIS_DIR = os.path.dirname(__file__)
 ABI_DIR = os.path.join(THIS_DIR, 'abi')
+CACHE_DIR = os.getenv('SOVRYN_SCRIPTS_CACHE_DIR', os.path.join(THIS_DIR, 'cache'))
 logger = logging.getLogger(__name__)
 
 INFURA_API_KEY = os.environ.get('INFURA_API_KEY', 'INFURA_API_KEY_NOT_SET')
@@ -85,13 +93,63 @@ def utcnow() -> datetime:
     return datetime.now(timezone.utc)
 
 
+@functools.lru_cache(maxsize=None)
 def load_abi(name: str) -> List[Dict[str, Any]]:
+    """Load an ABI from the abi directory. ABIs are parsed on first use and shared, so don't modify them."""
     abi_path = os.path.join(ABI_DIR, f'{name}.json')
     assert os.path.abspath(abi_path).startswith(os.path.abspath(ABI_DIR))
     with open(abi_path) as f:
         return json.load(f)
 
 
+@functools.lru_cache(maxsize=None)
+def get_function_selectors(abi_name: str) -> Dict[str, Dict[str, Any]]:
+    """Function ABIs of an ABI by 0x-prefixed 4-byte selector"""
+    return {
+        to_hex(function_abi_to_4byte_selector(item)): item
+        for item in load_abi(abi_name)
+        if item.get('type') == 'function'
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def get_event_topics(abi_name: str) -> Dict[str, Dict[str, Any]]:
+    """Event ABIs of an ABI by 0x-prefixed topic"""
+    return {
+        to_hex(event_abi_to_log_topic(item)): item
+        for item in load_abi(abi_name)
+        if item.get('type') == 'event' and not item.get('anonymous')
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def get_contract(*, web3: Web3, abi_name: str, address: Union[str, AnyAddress]) -> Contract:
+    """
+    Get a contract with an ABI of the abi directory, cached by web3, ABI and address.
+
+    Building a web3 contract processes the whole ABI, which is slow for large ABIs, so the same contract
+    should be reused instead of rebuilt.
+    """
+    return web3.eth.contract(
+        address=to_address(address),
+        abi=load_abi(abi_name),
+    )
+
+
+def get_cache_path(*parts: str) -> str:
+    """Get path to a file in the cache directory, creating the parent directories if needed"""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def write_json_atomic(path: str, data: Any):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
 def to_address(a: Union[bytes, str]) -> AnyAddress:
     # Web3.py expects checksummed addresses, but has no support for EIP-1191,
     # so RSK-checksummed addresses are broken
@@ -99,15 +157,27 @@ def to_address(a: Union[bytes, str]) -> AnyAddress:
     return to_checksum_address(a)
 
 
-ERC20_ABI = load_abi('IERC20')
+def get_lazy_abi_getattr(module_name: str, abi_names: Dict[str, str]) -> Callable[[str], Any]:
+    """
+    Get a module __getattr__ that loads ABIs on first access.
+
+    abi_names maps module attribute names (e.g. 'ERC20_ABI') to names of ABIs in the abi directory.
+    """
+    def __getattr__(name: str) -> Any:
+        if name in abi_names:
+            return load_abi(abi_names[name])
+        raise AttributeError(f'module {module_name!r} has no attribute {name!r}')
+    return __getattr__
+
+
+# ABIs that used to be loaded at import time, now loaded on first access
+__getattr__ = get_lazy_abi_getattr(__name__, {
+    'ERC20_ABI': 'IERC20',
+})
 
 
-@functools.lru_cache()
 def get_erc20_contract(*, token_address: Union[str, AnyAddress], web3: Web3) -> Contract:
-    return web3.eth.contract(
-        address=to_address(token_address),
-        abi=ERC20_ABI,
-    )
+    return get_contract(web3=web3, abi_name='IERC20', address=token_address)
 
 
 def get_events(
@@ -187,6 +257,57 @@ def retryable(*, max_attempts: int = 10):
     return decorator
 
 
+def get_contract_events(
+    *,
+    contract: Contract,
+    event_names: Sequence[str],
+    from_block: int,
+    to_block: int,
+    batch_size: int = 100,
+    addresses: Sequence[str] = None,
+):
+    """
+    Load events of many types of a contract in batches, with a single eth_getLogs call per batch.
+
+    If addresses is given, the events of all contracts at these addresses (with the ABI of contract)
+    are loaded instead. The events are returned in the order they were emitted.
+    """
+    if to_block < from_block:
+        raise ValueError(f'to_block {to_block} is smaller than from_block {from_block}')
+
+    events_by_topic = {}
+    for event_name in event_names:
+        event = contract.events[event_name]()
+        events_by_topic[to_hex(event_abi_to_log_topic(event.abi))] = event
+
+    ret = []
+    batch_from_block = from_block
+    while batch_from_block <= to_block:
+        batch_to_block = min(batch_from_block + batch_size, to_block)
+        logger.info('fetching %s from %s to %s (up to %s)', ', '.join(event_names), batch_from_block,
+                    batch_to_block, to_block)
+        logs = get_logs_with_retries(
+            web3=contract.web3,
+            filter_params={
+                'address': list(addresses) if addresses is not None else contract.address,
+                'fromBlock': batch_from_block,
+                'toBlock': batch_to_block,
+                'topics': [list(events_by_topic.keys())],
+            },
+        )
+        for log in logs:
+            event = events_by_topic[to_hex(log['topics'][0])]
+            ret.append(event.processLog(log))
+        batch_from_block = batch_to_block + 1
+    ret.sort(key=lambda e: (e.blockNumber, e.transactionIndex, e.logIndex))
+    return ret
+
+
+@retryable()
+def get_logs_with_retries(*, web3: Web3, filter_params: Dict[str, Any]):
+    return web3.eth.get_logs(filter_params)
+
+
 @functools.lru_cache()
 @retryable()
 def is_contract(*, web3: Web3, address: str) -> bool:
@@ -244,3 +365,358 @@ def get_closest_block(
         return web3.eth.get_block(closest_block["number"] + 1)
 
     return closest_block
+
+
+def batch_rpc_request(
+    web3: Web3,
+    requests: Sequence[Tuple[str, Any]],
+    *,
+    batch_size: int = 100,
+    allow_failure: bool = False,
+    allow_revert: bool = False,
+) -> List[Any]:
+    """
+    Send (method, params) requests to the node of web3 as JSON-RPC batches.
+
+    Returns the results in the same order as the requests. Errors raise ValueError (like web3 does),
+    unless allow_failure is True, in which case the result of a failed request is None.
+    With allow_revert, only reverted calls return None and other errors (e.g. node timeouts) still raise.
+    """
+    ret = []
+    for batch_start in range(0, len(requests), batch_size):
+        batch = [
+            {
+                'jsonrpc': '2.0',
+                'id': batch_start + i,
+                'method': method,
+                'params': params,
+            }
+            for i, (method, params) in enumerate(requests[batch_start:batch_start + batch_size])
+        ]
+        responses_by_id = {
+            response['id']: response
+            for response in _send_rpc_batch(web3, batch)
+        }
+        for request in batch:
+            response = responses_by_id.get(request['id'])
+            if response is None or 'error' in response:
+                is_revert = response is not None and is_revert_error(response['error'])
+                if not (allow_failure or (allow_revert and is_revert)):
+                    error = response['error'] if response else 'no response'
+                    raise ValueError(f'JSON-RPC error for {request["method"]}: {error}')
+                ret.append(None)
+            else:
+                ret.append(response['result'])
+    return ret
+
+
+@retryable(max_attempts=5)
+def _send_rpc_batch(web3: Web3, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    provider = web3.provider
+    raw_response = make_post_request(
+        provider.endpoint_uri,
+        json.dumps(batch).encode('utf-8'),
+        **provider.get_request_kwargs()
+    )
+    response = json.loads(raw_response)
+    if not isinstance(response, list):
+        # Some nodes respond to the whole batch with a single error object
+        raise ValueError(f'Invalid JSON-RPC batch response: {response!r}')
+    return response
+
+
+def is_revert_error(error: Any) -> bool:
+    """Is the JSON-RPC error object that of a reverted call (rather than e.g. a node or transport error)"""
+    if not isinstance(error, dict):
+        return False
+    message = str(error.get('message', '')).lower()
+    data = error.get('data')
+    return (
+        error.get('code') == 3  # geth: execution reverted
+        or 'revert' in message  # geth, RSK and ganache all mention revert in the message
+        or (isinstance(data, str) and data.startswith(('Reverted', '0x08c379a0')))
+    )
+
+
+def batch_call(
+    web3: Web3,
+    functions: Sequence[ContractFunction],
+    *,
+    block_identifier: BlockIdentifier = 'latest',
+    batch_size: int = 100,
+    allow_failure: bool = False,
+    allow_revert: bool = False,
+) -> List[Any]:
+    """
+    Call many contract functions with eth_call using JSON-RPC batches.
+
+    The return values are decoded like ContractFunction.call() would, in the same order as the functions.
+    If allow_failure is True, failed (e.g. reverted) calls return None instead of raising ValueError.
+    If allow_revert is True, only reverted calls (and calls that return nothing) return None.
+    """
+    if isinstance(block_identifier, int):
+        block_identifier = hex(block_identifier)
+    elif isinstance(block_identifier, bytes):
+        block_identifier = to_hex(block_identifier)
+    raw_results = batch_rpc_request(
+        web3,
+        [
+            (
+                'eth_call',
+                [
+                    {'to': function.address, 'data': function._encode_transaction_data()},
+                    block_identifier,
+                ],
+            )
+            for function in functions
+        ],
+        batch_size=batch_size,
+        allow_failure=allow_failure,
+        allow_revert=allow_revert,
+    )
+    ret = []
+    for function, raw_result in zip(functions, raw_results):
+        try:
+            if raw_result is None:
+                raise ValueError(f'call to {function.fn_name} failed')
+            ret.append(decode_function_result(function, to_bytes(hexstr=raw_result)))
+        except Exception:
+            # Undecodable results come from e.g. calls to addresses without code, which are as final as reverts
+            if not (allow_failure or allow_revert):
+                raise
+            ret.append(None)
+    return ret
+
+
+def get_block_timestamps(web3: Web3, block_numbers: Iterable[int], *, batch_size: int = 100) -> Dict[int, int]:
+    """Get the timestamps of many blocks with batched eth_getBlockByNumber requests"""
+    block_numbers = sorted(set(block_numbers))
+    blocks = batch_rpc_request(
+        web3,
+        [('eth_getBlockByNumber', [hex(block_number), False]) for block_number in block_numbers],
+        batch_size=batch_size,
+    )
+    return {
+        block_number: int(block['timestamp'], 16)
+        for block_number, block in zip(block_numbers, blocks)
+    }
+
+
+def run_task_graph(
+    tasks: Dict[str, Tuple[Callable[..., Any], Sequence[str]]],
+    *,
+    max_workers: int = 8,
+) -> Dict[str, Any]:
+    """
+    Run tasks concurrently as soon as the tasks they depend on are done.
+
+    tasks maps a name to (function, names of dependencies). The function is called with the results of its
+    dependencies as keyword arguments. Returns the results by name. The first error is raised after the
+    running tasks finish, and the tasks that haven't started are not run.
+    """
+    for name, (_, dependencies) in tasks.items():
+        for dependency in dependencies:
+            if dependency not in tasks:
+                raise ValueError(f'task {name!r} depends on unknown task {dependency!r}')
+    results = {}
+    not_started = dict(tasks)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+
+        def submit_ready():
+            for name, (func, dependencies) in list(not_started.items()):
+                if all(dependency in results for dependency in dependencies):
+                    del not_started[name]
+                    running[executor.submit(func, **{d: results[d] for d in dependencies})] = name
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+            submit_ready()
+    if not_started:
+        raise ValueError(f'circular dependencies between tasks: {", ".join(not_started)}')
+    return results
+
+
+def decode_function_result(function: ContractFunction, data: bytes) -> Any:
+    output_types = get_abi_output_types(function.abi)
+    decoded = decode_abi(output_types, data)
+    normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+    if len(normalized) == 1:
+        return normalized[0]
+    return normalized
+
+
+@dataclass
+class PipelineTransaction:
+    label: str
+    nonce: int
+    tx_hash: str
+    tx: TxParams
+    sent_at: float
+    # Hashes of all versions sent with this nonce (the original and gas price replacements)
+    tx_hashes: List[str] = field(default_factory=list)
+    receipt: Optional[TxReceipt] = None
+    error: Optional[Exception] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.receipt is not None and self.receipt['status'] == 1
+
+
+class TransactionPipeline:
+    """
+    Send many transactions from a local account back to back, and confirm them in a single polling loop.
+
+    Nonces are assigned locally (starting from the pending transaction count of the account, or the given
+    nonce), so sending doesn't wait for the previous transactions to be mined and a whole backlog fits in one
+    or a few blocks. A transaction that fails to send doesn't use up its nonce.
+
+    If replace_after (seconds) is given, transactions that are still pending after that long are sent again
+    with the same nonce and a gas price higher by gas_price_bump (at least 10% is needed for nodes to accept
+    the replacement), up to max_gas_price.
+    """
+    def __init__(
+        self,
+        web3: Web3,
+        *,
+        account: LocalAccount,
+        nonce: int = None,
+        gas_price: int = None,
+        timeout: float = 600,
+        poll_interval: float = 2.0,
+        replace_after: float = None,
+        gas_price_bump: float = 0.125,
+        max_gas_price: int = None,
+    ):
+        self.web3 = web3
+        self.account = account
+        self.gas_price = gas_price
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.replace_after = replace_after
+        self.gas_price_bump = gas_price_bump
+        self.max_gas_price = max_gas_price
+        self.transactions: List[PipelineTransaction] = []
+        self._lock = threading.Lock()
+        if nonce is None:
+            nonce = web3.eth.get_transaction_count(account.address, 'pending')
+        self._nonce = nonce
+
+    @property
+    def next_nonce(self) -> int:
+        return self._nonce
+
+    def send(self, tx: Union[ContractFunction, TxParams], *, label: str = None, value: int = 0) -> PipelineTransaction:
+        """Sign and send a contract function call or a transaction dict with the next nonce"""
+        with self._lock:
+            params: TxParams = {
+                'from': self.account.address,
+                'nonce': self._nonce,
+                'chainId': self.web3.eth.chain_id,
+            }
+            if self.gas_price is not None:
+                params['gasPrice'] = self.gas_price
+            if isinstance(tx, ContractFunction):
+                if label is None:
+                    label = tx.fn_name
+                if value:
+                    params['value'] = value
+                params = tx.buildTransaction(params)
+            else:
+                params = dict(tx, **params)
+                if 'gasPrice' not in params:
+                    params['gasPrice'] = self.web3.eth.gas_price
+                if 'gas' not in params:
+                    params['gas'] = self.web3.eth.estimate_gas(params)
+            tx_hash = self._send_signed(params)
+            transaction = PipelineTransaction(
+                label=label or f'transaction #{len(self.transactions) + 1}',
+                nonce=self._nonce,
+                tx_hash=tx_hash,
+                tx=params,
+                sent_at=monotonic(),
+                tx_hashes=[tx_hash],
+            )
+            self._nonce += 1
+            self.transactions.append(transaction)
+        logger.info('sent %s with nonce %s: %s', transaction.label, transaction.nonce, tx_hash)
+        return transaction
+
+    def wait(self) -> List[PipelineTransaction]:
+        """
+        Wait for the receipts of all unconfirmed transactions, replacing stuck ones if configured.
+
+        Returns all sent transactions. Transactions without a receipt before the timeout get a TimeoutError.
+        """
+        deadline = monotonic() + self.timeout
+        while True:
+            pending = self._poll_receipts()
+            if not pending:
+                break
+            now = monotonic()
+            if now >= deadline:
+                for transaction in pending:
+                    logger.warning('no receipt for %s (%s)', transaction.label, ', '.join(transaction.tx_hashes))
+                    transaction.error = TimeoutError(f'no receipt in {self.timeout} seconds')
+                break
+            if self.replace_after is not None:
+                for transaction in pending:
+                    if now - transaction.sent_at >= self.replace_after:
+                        self._replace(transaction)
+            sleep(self.poll_interval)
+        return list(self.transactions)
+
+    def _poll_receipts(self) -> List[PipelineTransaction]:
+        """Check the receipts of all versions of all pending transactions in one batch, return the still pending"""
+        pending = [t for t in self.transactions if t.receipt is None and t.error is None]
+        requests = [(transaction, tx_hash) for transaction in pending for tx_hash in transaction.tx_hashes]
+        raw_receipts = batch_rpc_request(
+            self.web3,
+            [('eth_getTransactionReceipt', [tx_hash]) for _, tx_hash in requests],
+            allow_failure=True,
+        )
+        for (transaction, tx_hash), raw_receipt in zip(requests, raw_receipts):
+            if raw_receipt is None or transaction.receipt is not None:
+                continue
+            transaction.tx_hash = tx_hash
+            transaction.receipt = self.web3.eth.get_transaction_receipt(tx_hash)
+            if transaction.succeeded:
+                logger.info('%s confirmed in block %s', transaction.label, transaction.receipt['blockNumber'])
+            else:
+                logger.warning('%s reverted in block %s', transaction.label, transaction.receipt['blockNumber'])
+        return [t for t in pending if t.receipt is None]
+
+    def _replace(self, transaction: PipelineTransaction):
+        gas_price = max(
+            int(transaction.tx['gasPrice'] * (1 + self.gas_price_bump)) + 1,
+            self.web3.eth.gas_price,
+        )
+        if self.max_gas_price is not None and gas_price > self.max_gas_price:
+            if transaction.tx['gasPrice'] >= self.max_gas_price:
+                return
+            gas_price = self.max_gas_price
+        params = dict(transaction.tx, gasPrice=gas_price)
+        try:
+            tx_hash = self._send_signed(params)
+        except ValueError as e:
+            # E.g. the previous version was just mined, which the next poll will see
+            logger.warning('could not replace %s (nonce %s): %s', transaction.label, transaction.nonce, e)
+            transaction.sent_at = monotonic()
+            return
+        logger.info(
+            'replaced %s (nonce %s) with gas price %s: %s',
+            transaction.label,
+            transaction.nonce,
+            gas_price,
+            tx_hash,
+        )
+        transaction.tx = params
+        transaction.tx_hashes.append(tx_hash)
+        transaction.sent_at = monotonic()
+
+    def _send_signed(self, params: TxParams) -> str:
+        signed = self.account.sign_transaction(params)
+        return to_hex(self.web3.eth.send_raw_transaction(signed.rawTransaction))
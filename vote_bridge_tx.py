@@ -1,15 +1,19 @@
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from getpass import getpass
+import csv
 import json
 import os
-from typing import Callable, Iterable, Optional, TypeVar
+from typing import Any, Callable, Iterable, List, Optional, Tuple, TypeVar
 
 from eth_account import Account
+from eth_account.signers.local import LocalAccount
 from eth_utils import is_hex, to_hex
 from web3.logs import DISCARD
 
 from constants import BRIDGES, BRIDGE_ABI, FEDERATION_ABI
-from utils import get_web3, set_web3_account, to_address
+from utils import TransactionPipeline, batch_call, get_web3, run_task_graph, to_address
 
 T = TypeVar('T')
 
@@ -35,6 +39,12 @@ def main():
     parser.add_argument('--tx-hash',
                         help='deposit transaction hash',
                         default=None)
+    parser.add_argument('--tx-hash-file',
+                        help='vote for all deposit transaction hashes in this file (one per line)',
+                        default=None)
+    parser.add_argument('--transfers-csv',
+                        help='vote for all unprocessed transfers in this CSV file written by bridge_transfer_status.py',
+                        default=None)
     parser.add_argument('--private-key',
                         help='federator account private key',
                         default=None)
@@ -46,6 +56,10 @@ def main():
                         help='timeout in minutes for a transaction',
                         type=int,
                         default=10)
+    parser.add_argument('--replace-after-minutes',
+                        help='send the vote again with a higher gas price if it is still pending after this long',
+                        type=float,
+                        default=None)
     args = parser.parse_args()
 
     if args.bridge:
@@ -102,20 +116,37 @@ def main():
         abi=FEDERATION_ABI,
     )
 
-    if args.gas_price is not None:
-        # This is the chain where the things are sent
-        # This is ugly btw...
-        if side_bridge_config['chain'].startswith('rsk'):
-            if args.gas_price > 0.25:
-                raise ValueError("Dangerously high gas price for RSK network (usually 0.06 should be enough)")
-        elif side_bridge_config['chain'].startswith('bsc'):
-            if args.gas_price > 20:
-                raise ValueError("Dangerously high gas price for BSC network (usually it's 5)")
+    # This is the chain where the things are sent
+    # This is ugly btw...
+    if side_bridge_config['chain'].startswith('rsk'):
+        max_gas_price = 0.25
+        max_gas_price_error = "Dangerously high gas price for RSK network (usually 0.06 should be enough)"
+    elif side_bridge_config['chain'].startswith('bsc'):
+        max_gas_price = 20
+        max_gas_price_error = "Dangerously high gas price for BSC network (usually it's 5)"
+    else:
         # I guess 2000 gwei is high enough for all else
-        if args.gas_price > 1000:
-            raise ValueError(
-                "Dangerously high gas price for ethereum network (it's bound to be high but over 1k is too much)"
-            )
+        max_gas_price = 1000
+        max_gas_price_error = (
+            "Dangerously high gas price for ethereum network (it's bound to be high but over 1k is too much)"
+        )
+    if args.gas_price is not None and args.gas_price > max_gas_price:
+        raise ValueError(max_gas_price_error)
+
+    if args.tx_hash_file or args.transfers_csv:
+        deposits = []
+        if args.tx_hash_file:
+            deposits.extend(read_tx_hash_file(args.tx_hash_file))
+        if args.transfers_csv:
+            deposits.extend(read_unprocessed_transfers_csv(args.transfers_csv, from_chain=bridge_config['chain']))
+        bulk_vote(
+            deposits=deposits,
+            bridge_contract=bridge_contract,
+            federation_contract=federation_contract,
+            account=get_account(args),
+            pipeline_kwargs=get_pipeline_kwargs(args, max_gas_price=max_gas_price),
+        )
+        return
 
     if args.tx_hash:
         tx_hash = args.tx_hash
@@ -159,68 +190,73 @@ def main():
         return False
 
     print(f"Getting transactionId from federation contract {federation_address} ({side_chain_name})")
-    # TODO: in the future, use getTransactionIdU
-    vote_transaction_args = (
-        cross_event.args['_tokenAddress'],
-        cross_event.args['_to'],
-        cross_event.args['_amount'],
-        cross_event.args['_symbol'],
-        cross_event.blockHash,
-        cross_event.transactionHash,
-        cross_event.logIndex,
-        cross_event.args['_decimals'],
-        cross_event.args['_granularity'],
-    )
-    vote_transaction_args_with_userdata = vote_transaction_args + (
-        cross_event.args['_userData'],
-    )
-    transaction_id = federation_contract.functions.getTransactionId(*vote_transaction_args).call()
-    transaction_id = to_hex(transaction_id)
+    vote_transaction_args, vote_transaction_args_with_userdata = get_vote_transaction_args(cross_event)
+    # The federation reads only depend on the transaction ids, so they're fetched concurrently,
+    # one round trip per dependency level
+    federation_functions = federation_contract.functions
+    federators = FEDERATORS_BY_BRIDGE.get(bridge_name, [])
+    preflight_tasks = {
+        'transaction_id': (
+            lambda: to_hex(federation_functions.getTransactionId(*vote_transaction_args).call()),
+            (),
+        ),
+        'transaction_id_u': (
+            lambda: to_hex(federation_functions.getTransactionIdU(*vote_transaction_args_with_userdata).call()),
+            (),
+        ),
+        'num_votes': (
+            lambda transaction_id: federation_functions.getTransactionCount(transaction_id).call(),
+            ('transaction_id',),
+        ),
+        'num_votes_u': (
+            lambda transaction_id_u: federation_functions.getTransactionCount(transaction_id_u).call(),
+            ('transaction_id_u',),
+        ),
+        'was_processed': (
+            lambda transaction_id: federation_functions.transactionWasProcessed(transaction_id).call(),
+            ('transaction_id',),
+        ),
+        'was_processed_u': (
+            lambda transaction_id_u: federation_functions.transactionWasProcessed(transaction_id_u).call(),
+            ('transaction_id_u',),
+        ),
+    }
+    for address, _ in federators:
+        preflight_tasks[f'has_voted_{address}'] = (
+            lambda transaction_id_u, address=address: federation_functions.votes(
+                transaction_id_u,
+                to_address(address),
+            ).call(),
+            ('transaction_id_u',),
+        )
+    preflight = run_task_graph(preflight_tasks)
+    transaction_id = preflight['transaction_id']
+    transaction_id_u = preflight['transaction_id_u']
     print(f"transactionId: {transaction_id}")
-    transaction_id_u = federation_contract.functions.getTransactionIdU(*vote_transaction_args_with_userdata).call()
-    transaction_id_u = to_hex(transaction_id_u)
     print(f"transactionIdU: {transaction_id_u}")
-
-    print("Fetching transaction data...")
-    num_votes = federation_contract.functions.getTransactionCount(transaction_id).call()
-    num_votes_u = federation_contract.functions.getTransactionCount(transaction_id_u).call()
-    print("Num votes:", num_votes)
-    print("Num votes (U):", num_votes_u)
-    was_processed = federation_contract.functions.transactionWasProcessed(transaction_id).call()
-    was_processed_u = federation_contract.functions.transactionWasProcessed(transaction_id_u).call()
-    print("Was processed:", was_processed)
-    print("Was processed (U):", was_processed_u)
-
-    federators = FEDERATORS_BY_BRIDGE.get(bridge_name, [])
+    print("Num votes:", preflight['num_votes'])
+    print("Num votes (U):", preflight['num_votes_u'])
+    print("Was processed:", preflight['was_processed'])
+    print("Was processed (U):", preflight['was_processed_u'])
     for address, name in federators:
-        address_has_voted = federation_contract.functions.votes(transaction_id_u, to_address(address)).call()
-        print('has', address, name, 'voted?', address_has_voted)
+        print('has', address, name, 'voted?', preflight[f'has_voted_{address}'])
 
-    if was_processed or was_processed_u:
+    if preflight['was_processed'] or preflight['was_processed_u']:
         print("Transaction already processed")
         return
 
-    if args.private_key:
-        private_key = args.private_key
-    else:
-        private_key = getpass("Enter federator private key (input hidden): ")
-    account = Account.from_key(private_key)
-    print("Account:", account.address)
+    account = get_account(args)
 
-    set_web3_account(
-        web3=web3,
-        account=account,
+    is_member, has_voted, has_voted_u = batch_call(
+        side_web3,
+        [
+            federation_functions.isMember(account.address),
+            federation_functions.votes(transaction_id, account.address),
+            federation_functions.votes(transaction_id_u, account.address),
+        ],
     )
-    set_web3_account(
-        web3=side_web3,
-        account=account,
-    )
-
-    is_member = federation_contract.functions.isMember(account.address).call()
     print("Is federation member:", is_member)
-    has_voted = federation_contract.functions.votes(transaction_id, account.address).call()
     print("Has voted:", has_voted)
-    has_voted_u = federation_contract.functions.votes(transaction_id_u, account.address).call()
     print("Has voted (U):", has_voted_u)
 
     if not is_member:
@@ -237,18 +273,253 @@ def main():
         return
 
     print("Voting for transaction.")
-    transact_opts = {}
     if args.gas_price:
         print("Using gas price", args.gas_price, "Gwei")
-        transact_opts["gasPrice"] = int(args.gas_price * 10**9)
-    vote_tx_hash = federation_contract.functions.voteTransactionAt(*vote_transaction_args_with_userdata).transact(transact_opts)
-    vote_tx_hash = to_hex(vote_tx_hash)
-    print("Vote tx:", vote_tx_hash)
+    pipeline = TransactionPipeline(
+        side_web3,
+        account=account,
+        **get_pipeline_kwargs(args, max_gas_price=max_gas_price),
+    )
+    vote_tx = pipeline.send(federation_contract.functions.voteTransactionAt(*vote_transaction_args_with_userdata))
+    print("Vote tx:", vote_tx.tx_hash)
     print("Waiting for receipt")
-    side_web3.eth.wait_for_transaction_receipt(vote_tx_hash)
+    pipeline.wait()
+    if vote_tx.error:
+        print("Error:", vote_tx.error)
+        return
+    if vote_tx.tx_hash != vote_tx.tx_hashes[0]:
+        print("Vote was replaced with a higher gas price, mined tx:", vote_tx.tx_hash)
+    if not vote_tx.succeeded:
+        print("Error: vote transaction reverted")
+        return
     print("All done.")
 
 
+@dataclass
+class VoteCandidate:
+    deposit_tx_hash: str
+    cross_event: Any = None
+    vote_transaction_args_with_userdata: Tuple = ()
+    transaction_id: Optional[str] = None
+    transaction_id_u: Optional[str] = None
+    num_votes_u: Optional[int] = None
+    was_processed: bool = False
+    has_voted: bool = False
+    error: Optional[str] = None
+
+    @property
+    def can_vote(self) -> bool:
+        return self.error is None and not self.was_processed and not self.has_voted
+
+    @property
+    def status(self) -> str:
+        if self.error:
+            return f'error: {self.error}'
+        if self.was_processed:
+            return 'already processed'
+        if self.has_voted:
+            return 'already voted'
+        return f'will vote ({self.num_votes_u} votes so far)'
+
+
+def bulk_vote(
+    *,
+    deposits: List[Tuple[str, Optional[int]]],
+    bridge_contract,
+    federation_contract,
+    account: LocalAccount,
+    pipeline_kwargs: dict,
+):
+    print(f"Resolving {len(deposits)} deposits")
+    candidates = resolve_vote_candidates(
+        deposits=deposits,
+        bridge_contract=bridge_contract,
+        federation_contract=federation_contract,
+        voter_address=account.address,
+    )
+    for i, candidate in enumerate(candidates, start=1):
+        if candidate.cross_event:
+            event_args = candidate.cross_event.args
+            print(
+                f"{i}) {candidate.deposit_tx_hash} #{candidate.cross_event.logIndex}: "
+                f"{event_args['_amount']} {event_args['_symbol']} to {event_args['_to']}, {candidate.status}"
+            )
+        else:
+            print(f"{i}) {candidate.deposit_tx_hash}: {candidate.status}")
+
+    votable = [c for c in candidates if c.can_vote]
+    if not votable:
+        print("Nothing to vote for -- quitting!")
+        return
+    if not federation_contract.functions.isMember(account.address).call():
+        print(f"Error: Account {account.address} is not a federator and cannot vote.")
+        return
+    vote_input = input(f"Vote for {len(votable)} transactions? [y/n] ")
+    do_vote = vote_input and len(vote_input) > 0 and vote_input[0].lower() == 'y'
+    if not do_vote:
+        print("Not voting -- quitting!")
+        return
+
+    pipeline = TransactionPipeline(federation_contract.web3, account=account, **pipeline_kwargs)
+    for candidate in votable:
+        vote_tx = pipeline.send(
+            federation_contract.functions.voteTransactionAt(*candidate.vote_transaction_args_with_userdata),
+            label=candidate.transaction_id_u,
+        )
+        print("Vote tx for", candidate.transaction_id_u, vote_tx.tx_hash)
+    print("Waiting for receipts")
+    num_succeeded = 0
+    for vote_tx in pipeline.wait():
+        if vote_tx.succeeded:
+            num_succeeded += 1
+        else:
+            print("Error: vote", vote_tx.tx_hash, "for", vote_tx.label, vote_tx.error or "reverted")
+    print(f"All done, {num_succeeded}/{len(votable)} votes succeeded.")
+
+
+def resolve_vote_candidates(
+    *,
+    deposits: List[Tuple[str, Optional[int]]],
+    bridge_contract,
+    federation_contract,
+    voter_address: str,
+    max_workers: int = 8,
+) -> List[VoteCandidate]:
+    """
+    Find the Cross events of the deposits (tx hash, and log index if known) and their vote status.
+
+    The deposit receipts are fetched concurrently and the federation is queried with batched calls.
+    A deposit without a log index gets a candidate for each Cross event of the bridge in it.
+    """
+    deposits = list(dict.fromkeys(deposits))
+    web3 = bridge_contract.web3
+
+    def get_receipt(tx_hash: str):
+        try:
+            return web3.eth.get_transaction_receipt(tx_hash)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        receipts = list(executor.map(get_receipt, [tx_hash for tx_hash, _ in deposits]))
+
+    candidates = []
+    for (tx_hash, log_index), receipt in zip(deposits, receipts):
+        if isinstance(receipt, Exception):
+            candidates.append(VoteCandidate(deposit_tx_hash=tx_hash, error=f'no receipt ({receipt})'))
+            continue
+        cross_events = [
+            event for event in bridge_contract.events.Cross().processReceipt(receipt, errors=DISCARD)
+            if event.address.lower() == bridge_contract.address.lower()
+            and (log_index is None or event.logIndex == log_index)
+        ]
+        if not cross_events:
+            candidates.append(VoteCandidate(deposit_tx_hash=tx_hash, error='no Cross events for this bridge'))
+        for cross_event in cross_events:
+            candidates.append(VoteCandidate(
+                deposit_tx_hash=tx_hash,
+                cross_event=cross_event,
+                vote_transaction_args_with_userdata=get_vote_transaction_args(cross_event)[1],
+            ))
+
+    resolvable = [c for c in candidates if c.error is None]
+    transaction_ids = batch_call(
+        federation_contract.web3,
+        [
+            function
+            for candidate in resolvable
+            for function in (
+                federation_contract.functions.getTransactionId(*candidate.vote_transaction_args_with_userdata[:-1]),
+                federation_contract.functions.getTransactionIdU(*candidate.vote_transaction_args_with_userdata),
+            )
+        ],
+    )
+    for i, candidate in enumerate(resolvable):
+        candidate.transaction_id = to_hex(transaction_ids[2 * i])
+        candidate.transaction_id_u = to_hex(transaction_ids[2 * i + 1])
+
+    statuses = batch_call(
+        federation_contract.web3,
+        [
+            function
+            for candidate in resolvable
+            for function in (
+                federation_contract.functions.getTransactionCount(candidate.transaction_id_u),
+                federation_contract.functions.transactionWasProcessed(candidate.transaction_id),
+                federation_contract.functions.transactionWasProcessed(candidate.transaction_id_u),
+                federation_contract.functions.votes(candidate.transaction_id_u, voter_address),
+            )
+        ],
+    )
+    for i, candidate in enumerate(resolvable):
+        num_votes_u, was_processed, was_processed_u, has_voted_u = statuses[4 * i:4 * i + 4]
+        candidate.num_votes_u = num_votes_u
+        candidate.was_processed = was_processed or was_processed_u
+        candidate.has_voted = has_voted_u
+    return candidates
+
+
+def get_vote_transaction_args(cross_event) -> Tuple[Tuple, Tuple]:
+    """Arguments of getTransactionId and of getTransactionIdU/voteTransactionAt (with user data)"""
+    vote_transaction_args = (
+        cross_event.args['_tokenAddress'],
+        cross_event.args['_to'],
+        cross_event.args['_amount'],
+        cross_event.args['_symbol'],
+        cross_event.blockHash,
+        cross_event.transactionHash,
+        cross_event.logIndex,
+        cross_event.args['_decimals'],
+        cross_event.args['_granularity'],
+    )
+    vote_transaction_args_with_userdata = vote_transaction_args + (
+        cross_event.args['_userData'],
+    )
+    return vote_transaction_args, vote_transaction_args_with_userdata
+
+
+def read_tx_hash_file(path: str) -> List[Tuple[str, Optional[int]]]:
+    ret = []
+    with open(path) as f:
+        for line in f:
+            tx_hash = line.split('#')[0].strip()
+            if not tx_hash:
+                continue
+            if get_tx_hash_error(tx_hash):
+                raise ValueError(get_tx_hash_error(tx_hash))
+            ret.append((tx_hash.lower(), None))
+    return ret
+
+
+def read_unprocessed_transfers_csv(path: str, *, from_chain: str) -> List[Tuple[str, Optional[int]]]:
+    """Deposit tx hashes and log indexes of the unprocessed transfers from from_chain in the CSV"""
+    with open(path, newline='') as f:
+        return [
+            (row['event_transaction_hash'].lower(), int(row['event_log_index']))
+            for row in csv.DictReader(f)
+            if row['from_chain'] == from_chain and row['was_processed'] != 'True'
+        ]
+
+
+def get_account(args) -> LocalAccount:
+    if args.private_key:
+        private_key = args.private_key
+    else:
+        private_key = getpass("Enter federator private key (input hidden): ")
+    account = Account.from_key(private_key)
+    print("Account:", account.address)
+    return account
+
+
+def get_pipeline_kwargs(args, *, max_gas_price: float) -> dict:
+    return dict(
+        gas_price=int(args.gas_price * 10**9) if args.gas_price else None,
+        timeout=args.timeout_minutes * 60,
+        replace_after=args.replace_after_minutes * 60 if args.replace_after_minutes else None,
+        max_gas_price=int(max_gas_price * 10**9),
+    )
+
+
 def prompt_option(options: Iterable[T], *, prompt: str = 'Select option:') -> T:
     options = list(options)
     ret = None